@@ -30,3 +30,50 @@ def verify_auth(auth_header: str = Header(None, alias="Authorization")):
         return True
     except Exception:
         raise HTTPException(status_code=401, detail="Authentication failed")
+
+
+def require_auth(auth_header: str = Header(None, alias="Authorization")):
+    """Like verify_auth, but refuses the request when Basic Auth is disabled"""
+    if not BASIC_AUTH_ENABLED:
+        raise HTTPException(
+            status_code=403,
+            detail="Admin endpoints are disabled; set BASIC_AUTH_ENABLED=true to use them",
+        )
+    return verify_auth(auth_header)
+
+
+# ==================== PASSWORD HASHING ====================
+# These run inside the password hashing process pool, so they only use
+# bcrypt and must stay importable without loading the main app.
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def hash_password_sync(password: str, rounds: int = None) -> str:
+    """Hash password using bcrypt at the given cost"""
+    import bcrypt
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode(), salt).decode()
+
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    """Verify password against a bcrypt hash"""
+    import bcrypt
+    try:
+        return bcrypt.checkpw(password.encode(), hashed_password.encode())
+    except ValueError:
+        # Malformed hash in storage
+        return False
+
+
+def get_hash_rounds(hashed_password: str):
+    """Read the cost factor out of a $2b$NN$... hash (None if unparseable)"""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+def password_needs_rehash(hashed_password: str, rounds: int = None) -> bool:
+    """True if the stored hash was made with a different cost than configured"""
+    return get_hash_rounds(hashed_password) != (rounds or BCRYPT_ROUNDS)
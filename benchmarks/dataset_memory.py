@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Dataset Memory Benchmark
+Compares the memory held by the certification index in its old layout
+(one dict per row with a full row_data copy) against CertificationRecord +
+RowTable, using a synthetic workbook.
+
+Usage:
+    python benchmarks/dataset_memory.py [--rows 50000]
+"""
+
+import argparse
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+# Keep the app's user store out of the working tree
+os.environ.setdefault(
+    "USER_DATABASE_FILE", os.path.join(tempfile.gettempdir(), "tbl_bench_users.db")
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = [
+    "en:beverages", "en:coffee", "en:teas", "en:snacks", "en:chocolates",
+    "en:breakfast-cereals", "en:dairies", "en:yogurts", "en:biscuits",
+    "en:frozen-foods", "en:condiments", "en:baby-foods", "Personal Care",
+    "Household", "Pet Food",
+]
+WORDS = [
+    "green", "valley", "harvest", "river", "sun", "maple", "ocean", "stone",
+    "golden", "wild", "bright", "honest", "little", "north", "happy", "pure",
+    "bay", "hill", "field", "garden", "bean", "leaf", "grove", "meadow",
+]
+
+
+def make_synthetic_sheet(rows: int, seed: int = 42, brands: int = None):
+    """DataFrame shaped like the shipped workbook with `rows` rows"""
+    import pandas as pd
+
+    rng = random.Random(seed)
+    brands_needed = max(1, brands or rows // 3)
+    brands = set()
+    while len(brands) < brands_needed:
+        brands.add(" ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 3)))
+                   + f" {rng.randint(1, 99999)}")
+    brands = sorted(brands)
+
+    records = []
+    for i in range(rows):
+        records.append({
+            "Product_Brand": brands[i % len(brands)],
+            "Category": CATEGORIES[(i // len(brands)) % len(CATEGORIES)],
+            "Notes": float("nan") if rng.random() < 0.8 else "Checked manually",
+            "B_Corp": rng.random() < 0.15,
+            "Fair_Trade": rng.random() < 0.05,
+            "Rainforest_Alliance": rng.random() < 0.03,
+            "Leaping_Bunny": rng.random() < 0.5,
+            "Certification_Categories": rng.choice(["Coffee", "Cocoa", "Tea", "", "Coffee, Cocoa"]),
+            "Research_Complete": rng.random() < 0.3,
+            "Last_Updated": pd.Timestamp("2026-01-01") + pd.Timedelta(days=rng.randint(0, 300)),
+            "Confidence": rng.choice(["High", "Medium", "Low"]),
+        })
+    return pd.DataFrame.from_records(records)
+
+
+def build_legacy_index(manager, df):
+    """The pre-CertificationRecord layout: nested dicts with row.to_dict() copies"""
+    import pandas as pd
+    from elegant_app import BrandNormalizer
+
+    cert_data = {}
+    for _, row in df.iterrows():
+        brand_value = row.get("Product_Brand")
+        if pd.isna(brand_value):
+            continue
+        brand = str(brand_value).strip()
+        brand_normalized = BrandNormalizer.normalize(brand)
+        category_value = row.get("Category")
+        category = "" if pd.isna(category_value) else str(category_value).strip()
+        certifications = manager._extract_certifications(row, df.columns)
+        cert_data.setdefault(brand_normalized, {})[category or "_default"] = {
+            "original_brand": brand,
+            "certifications": certifications,
+            "research_complete": certifications.get("research_complete", False),
+            "row_data": row.to_dict(),
+            "category": category,
+        }
+    return cert_data
+
+
+def measure(label, build):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = after - before
+    print(f"{label:<28} retained {retained / 1024 / 1024:8.1f} MiB   peak {peak / 1024 / 1024:8.1f} MiB")
+    return result, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from elegant_app import BrandNormalizer, CertificationManager
+
+    manager = CertificationManager()
+    df = make_synthetic_sheet(args.rows)
+    print(f"Synthetic sheet: {len(df)} rows, {df['Product_Brand'].nunique()} brands")
+
+    # Warm the normalize() cache so neither layout is charged for it
+    for brand in df["Product_Brand"].unique():
+        BrandNormalizer.normalize(str(brand).strip())
+
+    legacy, legacy_bytes = measure("legacy dict + row_data", lambda: build_legacy_index(manager, df))
+    del legacy
+    compact, compact_bytes = measure("CertificationRecord", lambda: manager.build_certification_index(df))
+    del compact
+
+    if compact_bytes:
+        print(f"Reduction: {legacy_bytes / compact_bytes:.1f}x less retained memory")
+
+
+if __name__ == "__main__":
+    main()
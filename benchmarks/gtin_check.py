@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+GTIN Canonicalization Check
+Verifies Gtin.canonicalize against known reads and every UPC-E code.
+
+Known reads cover each symbology, reads that lost leading zeros, typed
+separators, ambiguous 8-digit reads (valid as both EAN-8 and UPC-E) and
+misreads that must be rejected. The exhaustive pass expands all 2,000,000
+UPC-E codes (number systems 0 and 1, every body, correct check digit) and
+requires each one to reach its own UPC-A key, either as the canonical code
+or, for number system 1 reads that are also valid EAN-8s, as the alternate
+lookup_barcode tries next.
+
+Usage:
+    python benchmarks/gtin_check.py [--show 10]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Keep the app's stores out of the working tree
+_TMP = os.path.join(tempfile.gettempdir(), "tbl_bench")
+os.makedirs(_TMP, exist_ok=True)
+os.environ.setdefault("USER_DATABASE_FILE", os.path.join(_TMP, "gtin_users.db"))
+os.environ.setdefault("PRODUCT_CACHE_FILE", os.path.join(_TMP, "gtin_product_cache.db"))
+os.environ.setdefault("COMPANY_PREFIX_FILE", os.path.join(_TMP, "gtin_company_prefixes.db"))
+os.environ.setdefault("DATASET_SNAPSHOT_FILE", os.path.join(_TMP, "gtin_certifications.snapshot"))
+os.environ.setdefault("DATASET_CHANGES_FILE", os.path.join(_TMP, "gtin_changes.db"))
+sys.path.insert(0, REPO_DIR)
+
+# read -> (canonical code, symbology, alternates); None = must be rejected
+KNOWN = {
+    "036000291452": ("0036000291452", "UPC-A", ()),
+    "0036000291452": ("0036000291452", "UPC-A", ()),
+    "00036000291452": ("0036000291452", "UPC-A", ()),
+    "4006381333931": ("4006381333931", "EAN-13", ()),
+    " 3017 6204 2200 3 ": ("3017620422003", "EAN-13", ()),
+    "10012345678902": ("10012345678902", "GTIN-14", ()),
+    "96385074": ("96385074", "EAN-8", ()),
+    "04252614": ("0042100005264", "UPC-E", ()),
+    "425261": ("0042100005264", "UPC-E", ()),
+    # UPC-E ending in 5-9: its EAN-8 check digit holds too, UPC-E must win
+    "00345675": ("0003456000075", "UPC-E", ("00345675",)),
+    "01234565": ("0012345000065", "UPC-E", ("01234565",)),
+    # Number system 1 read that is also a valid EAN-8: EAN-8 first, UPC-E next
+    "12345670": ("12345670", "EAN-8", ("0123456000070",)),
+    "03600029145": None,
+    "3017620422004": None,
+    "0123456": None,
+    "12345": None,
+    "ABC-123": None,
+    "": None,
+}
+
+
+def check_known(app, show: int) -> int:
+    failures = 0
+    for read, expected in KNOWN.items():
+        try:
+            gtin = app.Gtin.canonicalize(read)
+            got = (gtin.code, gtin.symbology, gtin.alternates)
+        except app.InvalidBarcodeError:
+            got = None
+        if got != expected:
+            failures += 1
+            if failures <= show:
+                print(f"  {read!r}: expected {expected}, got {got}")
+    print(f"{'known reads':<20} {len(KNOWN):>8} cases  {'ok' if not failures else f'{failures} FAILED'}")
+    return failures
+
+
+def check_upce(app, show: int) -> int:
+    gtin = app.Gtin
+    failures = cases = 0
+    t0 = time.perf_counter()
+    for number_system in "01":
+        for body in range(1_000_000):
+            digits = f"{number_system}{body:06d}0"
+            upca = gtin.expand_upce(digits)
+            upca = upca[:-1] + gtin.check_digit(upca[:-1])
+            read = digits[:-1] + upca[-1]
+            result = gtin.canonicalize(read)
+            cases += 1
+            key = "0" + upca
+            if result.code == key if number_system == "0" else key in (result.code, *result.alternates):
+                continue
+            failures += 1
+            if failures <= show:
+                print(f"  {read}: expected {key}, got {result.code}/{result.symbology} {result.alternates}")
+    elapsed = time.perf_counter() - t0
+    print(f"{'upc-e expansion':<20} {cases:>8} cases  {'ok' if not failures else f'{failures} FAILED'}"
+          f"  ({elapsed:.1f}s)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--show", type=int, default=10, help="failures to print per check")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import elegant_app as app
+
+    failures = check_known(app, args.show) + check_upce(app, args.show)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Load Test Runner
+Ramps concurrency through a scenario's stages and reports, per stage:
+throughput, latency percentiles and histogram, error rate and event-loop lag.
+The report names the highest stage that stayed within the scenario's p99 SLO
+and error budget, i.e. what one instance sustains before p99 blows up.
+
+Scenarios are JSON files in benchmarks/scenarios/. A scenario lists the
+weighted request mix, think time per virtual user, the concurrency ramp and
+value pools. {name} placeholders in paths, params and bodies are filled from
+the pools:
+    workbook:brands            brand names from the workbook
+    workbook:brand_prefixes    first 3-5 characters of those brands
+    workbook:categories        workbook categories
+    synthetic:barcodes         EAN-13 codes the in-process OFF stub knows
+                               (plain misses against a real server)
+    [..]                       an inline list
+
+Targets:
+    inprocess   the app on this event loop via httpx ASGITransport, with Open
+                Food Facts stubbed (loop lag here is the app's own loop lag)
+    procfile    the Procfile web command (gunicorn + uvicorn workers) on a
+                free local port; --workers overrides the worker count. Open
+                Food Facts is live in this mode.
+    URL         an already running server, e.g. http://127.0.0.1:8000
+
+Usage:
+    python benchmarks/load_test.py benchmarks/scenarios/shopping_scans.json
+    python benchmarks/load_test.py benchmarks/scenarios/shopping_scans.json --target procfile --workers 2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+WORK_DIR = os.path.join(tempfile.gettempdir(), "tbl_bench")
+DEFAULT_WORKBOOK = os.path.join(REPO_DIR, "comprehensive_grocery_certifications_COMPLETE.xlsx")
+
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+LOAD_USER = {"username": "loadtest", "email": "loadtest@example.com", "password": "loadtest-password"}
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+# ==================== SCENARIOS ====================
+
+
+def workbook_pools(path: str) -> dict:
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    rows = df[["Product_Brand", "Category"]].dropna(subset=["Product_Brand"])
+    brands = sorted({str(b).strip() for b in rows["Product_Brand"]})
+    categories = sorted({str(c).strip() for c in rows["Category"].dropna()})
+    rng = random.Random(0)
+    return {
+        "workbook:brands": brands,
+        "workbook:categories": categories,
+        "workbook:brand_prefixes": sorted({b[:rng.randint(3, 5)] for b in brands if len(b) >= 3}),
+        "workbook:rows": [(str(b).strip(), "" if pd.isna(c) else str(c).strip())
+                          for b, c in rows.itertuples(index=False)],
+    }
+
+
+class Scenario:
+    """A weighted request mix with placeholder pools"""
+
+    def __init__(self, spec: dict, pools: dict):
+        self.name = spec["name"]
+        self.description = spec.get("description", "")
+        self.think_time = [t / 1000.0 for t in spec.get("think_time_ms", [0, 0])]
+        self.ramp = spec.get("ramp", [1, 2, 4, 8, 16, 32])
+        self.stage_seconds = spec.get("stage_seconds", 20)
+        self.slo_p99_ms = spec.get("slo_p99_ms", 1000)
+        self.max_error_rate = spec.get("max_error_rate", 0.05)
+        self.requests = spec["requests"]
+        self._weights = [r.get("weight", 1) for r in self.requests]
+        self.pools = {}
+        for key, source in spec.get("pools", {}).items():
+            values = source if isinstance(source, list) else pools[source]
+            if not values:
+                raise ValueError(f"pool '{key}' ({source}) is empty")
+            self.pools[key] = values
+
+    @classmethod
+    def load(cls, path: str, pools: dict) -> "Scenario":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), pools)
+
+    def _fill(self, value, rng: random.Random):
+        if isinstance(value, str):
+            return PLACEHOLDER.sub(lambda m: str(rng.choice(self.pools[m.group(1)])), value)
+        if isinstance(value, list):
+            return [self._fill(v, rng) for v in value]
+        if isinstance(value, dict):
+            return {k: self._fill(v, rng) for k, v in value.items()}
+        return value
+
+    def next_request(self, rng: random.Random) -> dict:
+        template = rng.choices(self.requests, weights=self._weights)[0]
+        return {
+            "name": template.get("name", template["path"]),
+            "method": template.get("method", "GET"),
+            "path": self._fill(template["path"], rng),
+            "params": self._fill(template.get("params"), rng),
+            "json": self._fill(template.get("json"), rng),
+        }
+
+
+# ==================== MEASUREMENT ====================
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def histogram(latencies_ms) -> dict:
+    buckets = {f"<={bound}": 0 for bound in HISTOGRAM_BOUNDS_MS}
+    buckets[f">{HISTOGRAM_BOUNDS_MS[-1]}"] = 0
+    for value in latencies_ms:
+        for bound in HISTOGRAM_BOUNDS_MS:
+            if value <= bound:
+                buckets[f"<={bound}"] += 1
+                break
+        else:
+            buckets[f">{HISTOGRAM_BOUNDS_MS[-1]}"] += 1
+    return buckets
+
+
+def latency_summary(latencies_ms) -> dict:
+    values = sorted(latencies_ms)
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p90": round(percentile(values, 90), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(values[-1], 2) if values else 0.0,
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+    }
+
+
+class StageStats:
+    def __init__(self):
+        self.samples = []  # (name, status, latency_ms)
+        self.loop_lag_ms = []
+
+    def record(self, name: str, status, latency_ms: float):
+        self.samples.append((name, str(status), latency_ms))
+
+    def summary(self, concurrency: int, duration: float) -> dict:
+        latencies = [s[2] for s in self.samples]
+        statuses = {}
+        for _, status, _ in self.samples:
+            statuses[status] = statuses.get(status, 0) + 1
+        # Connection failures and 5xx are errors; 404s are normal misses
+        errors = sum(n for status, n in statuses.items() if not status.isdigit() or int(status) >= 500)
+        by_request = {}
+        for name in sorted({s[0] for s in self.samples}):
+            values = [s[2] for s in self.samples if s[0] == name]
+            by_request[name] = {"count": len(values), **latency_summary(values)}
+        return {
+            "concurrency": concurrency,
+            "duration_s": round(duration, 2),
+            "requests": len(self.samples),
+            "throughput_rps": round(len(self.samples) / duration, 2) if duration else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / len(self.samples), 4) if self.samples else 0.0,
+            "statuses": dict(sorted(statuses.items())),
+            "latency_ms": latency_summary(latencies),
+            "histogram_ms": histogram(latencies),
+            "loop_lag_ms": latency_summary(self.loop_lag_ms),
+            "by_request": by_request,
+        }
+
+
+async def monitor_loop_lag(stats: StageStats, interval: float = 0.01):
+    """How late a 10 ms sleep wakes up: time the loop spent blocked"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag_ms.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+
+
+async def virtual_user(client, scenario: Scenario, rng: random.Random, stats: StageStats, stop_at: float):
+    import httpx
+
+    while time.monotonic() < stop_at:
+        request = scenario.next_request(rng)
+        start = time.perf_counter()
+        try:
+            response = await client.request(
+                request["method"], request["path"], params=request["params"], json=request["json"]
+            )
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        stats.record(request["name"], status, (time.perf_counter() - start) * 1000)
+        if scenario.think_time[1]:
+            await asyncio.sleep(rng.uniform(*scenario.think_time))
+
+
+async def run_stage(client, scenario: Scenario, concurrency: int, seed: int) -> dict:
+    stats = StageStats()
+    monitor = asyncio.create_task(monitor_loop_lag(stats))
+    started = time.monotonic()
+    stop_at = started + scenario.stage_seconds
+    users = [
+        virtual_user(client, scenario, random.Random(seed * 1000 + i), stats, stop_at)
+        for i in range(concurrency)
+    ]
+    await asyncio.gather(*users)
+    monitor.cancel()
+    return stats.summary(concurrency, time.monotonic() - started)
+
+
+async def run_ramp(client, scenario: Scenario, args) -> list:
+    register = await client.post("/auth/register", json=LOAD_USER)
+    if register.status_code not in (200, 400):
+        print(f"warning: could not register {LOAD_USER['username']}: {register.status_code}")
+
+    stages = []
+    for seed, concurrency in enumerate(scenario.ramp):
+        stage = await run_stage(client, scenario, concurrency, seed)
+        stages.append(stage)
+        latency = stage["latency_ms"]
+        print(
+            f"c={concurrency:<4} {stage['throughput_rps']:>8.1f} req/s  p50 {latency['p50']:>8.1f} ms  "
+            f"p99 {latency['p99']:>8.1f} ms  errors {stage['error_rate']:.1%}  "
+            f"loop lag p99 {stage['loop_lag_ms']['p99']:.1f} ms",
+            flush=True,
+        )
+        if args.stop_on_breach and (
+            latency["p99"] > scenario.slo_p99_ms or stage["error_rate"] > scenario.max_error_rate
+        ):
+            print("SLO breached; stopping the ramp")
+            break
+    return stages
+
+
+# ==================== TARGETS ====================
+
+
+def prepare_environment(run_dir: str, workbook: str):
+    """Point the app's stores at a scratch directory"""
+    os.environ["CERTIFICATION_EXCEL_FILE"] = workbook
+    os.environ["USER_DATABASE_FILE"] = os.path.join(run_dir, "users.db")
+    os.environ["PRODUCT_CACHE_FILE"] = os.path.join(run_dir, "product_cache.db")
+    os.environ["COMPANY_PREFIX_FILE"] = os.path.join(run_dir, "company_prefixes.db")
+    os.environ["DATASET_SNAPSHOT_FILE"] = os.path.join(run_dir, "certifications.snapshot")
+    # Loads of logins from one address would otherwise trip the limiter
+    os.environ.setdefault("LOGIN_IP_BURST", "100000")
+
+
+async def run_inprocess(scenario: Scenario, pools: dict, args) -> list:
+    import httpx
+
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    logging.disable(logging.CRITICAL)
+    # The stub isn't rate limited like OFF; keep the outbound token buckets out of the numbers
+    os.environ.setdefault("OFF_PRODUCT_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("OFF_SEARCH_RATE_PER_MINUTE", "1000000")
+    import elegant_app
+    from off_stub import OffStub
+
+    elegant_app.certification_manager.load_certification_data()
+    stub = OffStub.from_fixture(latency_ms=args.off_latency_ms)
+    stub.synthesize(pools["workbook:rows"])
+
+    transport = httpx.ASGITransport(app=elegant_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+        with stub.installed():
+            try:
+                return await run_ramp(client, scenario, args)
+            finally:
+                elegant_app.password_hasher.shutdown()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def procfile_command(port: int, workers: int = None) -> list:
+    with open(os.path.join(REPO_DIR, "Procfile"), encoding="utf-8") as f:
+        line = next(line for line in f if line.startswith("web:"))
+    command = line[len("web:"):].strip().replace("$PORT", str(port))
+    if workers:
+        command = re.sub(r"--workers \d+", f"--workers {workers}", command)
+    return shlex.split(command)
+
+
+async def wait_for_health(base_url: str, process, timeout: float = 180.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=5.0) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise SystemExit(f"server exited with code {process.returncode}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise SystemExit(f"{base_url} did not become healthy within {timeout:.0f}s")
+
+
+async def run_remote(scenario: Scenario, base_url: str, args, process=None) -> list:
+    import httpx
+
+    await wait_for_health(base_url, process)
+    limits = httpx.Limits(max_connections=max(scenario.ramp) + 10, max_keepalive_connections=max(scenario.ramp))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        return await run_ramp(client, scenario, args)
+
+
+# ==================== REPORT ====================
+
+
+def sustainable_stage(stages: list, scenario: Scenario):
+    ok = [
+        s for s in stages
+        if s["latency_ms"]["p99"] <= scenario.slo_p99_ms and s["error_rate"] <= scenario.max_error_rate
+    ]
+    return max(ok, key=lambda s: s["throughput_rps"]) if ok else None
+
+
+def render_report(report: dict) -> str:
+    scenario = report["scenario"]
+    lines = [
+        f"Load test: {scenario['name']} against {report['target']}",
+        f"{scenario['description']}",
+        f"Run at {report['date']}; SLO p99 <= {scenario['slo_p99_ms']} ms, errors <= {scenario['max_error_rate']:.0%}",
+        "",
+        f"{'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+        f"{'errors':>7} {'lag p99':>8}",
+    ]
+    for s in report["stages"]:
+        lat = s["latency_ms"]
+        lines.append(
+            f"{s['concurrency']:>5} {s['throughput_rps']:>9.1f} {lat['p50']:>9.1f} {lat['p90']:>9.1f} "
+            f"{lat['p99']:>9.1f} {lat['max']:>9.1f} {s['error_rate']:>7.1%} {s['loop_lag_ms']['p99']:>8.1f}"
+        )
+    lines.append("")
+    best = report["sustainable"]
+    if best:
+        lines.append(
+            f"Sustainable: {best['throughput_rps']:.1f} req/s at concurrency {best['concurrency']} "
+            f"(p99 {best['latency_ms']['p99']:.1f} ms)"
+        )
+    else:
+        lines.append("No stage met the SLO")
+
+    last = report["stages"][-1] if report["stages"] else None
+    if last:
+        lines.append("")
+        lines.append(f"Latency histogram at concurrency {last['concurrency']}:")
+        total = max(1, last["requests"])
+        for bucket, count in last["histogram_ms"].items():
+            lines.append(f"  {bucket:>8} ms {count:>7}  {'#' * int(40 * count / total)}")
+        lines.append("")
+        lines.append(f"Per request at concurrency {last['concurrency']}:")
+        for name, r in last["by_request"].items():
+            lines.append(f"  {name:<16} n={r['count']:<6} p50 {r['p50']:>8.1f} ms  p99 {r['p99']:>8.1f} ms")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", help="scenario JSON file")
+    parser.add_argument("--target", default="inprocess", help="inprocess, procfile or a base URL")
+    parser.add_argument("--workers", type=int, help="worker count for --target procfile")
+    parser.add_argument("--workbook", default=DEFAULT_WORKBOOK)
+    parser.add_argument("--ramp", help="comma-separated concurrency levels (overrides the scenario)")
+    parser.add_argument("--stage-seconds", type=float, help="seconds per stage (overrides the scenario)")
+    parser.add_argument("--no-think", action="store_true", help="drop think time (closed-loop saturation)")
+    parser.add_argument("--off-latency-ms", type=float, default=50.0, help="stubbed OFF latency (inprocess)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout")
+    parser.add_argument("--stop-on-breach", action="store_true", help="end the ramp at the first SLO breach")
+    parser.add_argument("--report", help="report path prefix (default: a file in the temp dir)")
+    parser.add_argument("--seed", type=int, default=99)
+    args = parser.parse_args()
+
+    pools = workbook_pools(args.workbook)
+    from off_stub import ean13
+
+    pools["synthetic:barcodes"] = [ean13(i) for i in range(len(pools["workbook:rows"]))]
+    scenario = Scenario.load(args.scenario, pools)
+    if args.ramp:
+        scenario.ramp = [int(c) for c in args.ramp.split(",")]
+    if args.stage_seconds:
+        scenario.stage_seconds = args.stage_seconds
+    if args.no_think:
+        scenario.think_time = [0.0, 0.0]
+    random.seed(args.seed)
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix=f"load_{scenario.name}_", dir=WORK_DIR)
+    prepare_environment(run_dir, os.path.abspath(args.workbook))
+
+    process = None
+    if args.target == "inprocess":
+        target = "in-process app"
+        stages = asyncio.run(run_inprocess(scenario, pools, args))
+    else:
+        if args.target == "procfile":
+            port = free_port()
+            command = procfile_command(port, args.workers)
+            target = " ".join(command)
+            print(f"Starting: {target}", flush=True)
+            process = subprocess.Popen(command, cwd=REPO_DIR, env=dict(os.environ, PYTHONPATH=REPO_DIR))
+            base_url = f"http://127.0.0.1:{port}"
+        else:
+            base_url = target = args.target.rstrip("/")
+        try:
+            stages = asyncio.run(run_remote(scenario, base_url, args, process))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "target": target,
+        "scenario": {
+            "name": scenario.name,
+            "description": scenario.description,
+            "ramp": scenario.ramp,
+            "stage_seconds": scenario.stage_seconds,
+            "think_time_ms": [t * 1000 for t in scenario.think_time],
+            "slo_p99_ms": scenario.slo_p99_ms,
+            "max_error_rate": scenario.max_error_rate,
+        },
+        "stages": stages,
+    }
+    report["sustainable"] = sustainable_stage(stages, scenario)
+
+    prefix = args.report or os.path.join(WORK_DIR, f"load_{scenario.name}_{datetime.now():%Y%m%d_%H%M%S}")
+    with open(prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    text = render_report(report)
+    with open(prefix + ".txt", "w", encoding="utf-8") as f:
+        f.write(text)
+    print()
+    print(text)
+    print(f"Report written to {prefix}.json and {prefix}.txt")
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, BENCH_DIR)
+    main()
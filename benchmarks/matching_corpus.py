@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Matching Golden Corpus
+Records what the brand-matching functions return today, so an optimized
+implementation can be diffed against the exact same outputs, and times each
+function on the same inputs.
+
+Functions covered:
+    BrandNormalizer.normalize
+    BrandNormalizer.find_parent_company
+    BrandNormalizer.extract_brand_from_product_text
+    CertificationManager._improved_partial_match
+    CertificationManager._find_best_category_match
+    CertificationManager.get_certifications   (end to end, sampled)
+
+Inputs (seeded, so regenerating gives the same corpus): every workbook brand,
+mangled variants of it (case, accents, punctuation, legal suffixes, typos,
+extra product words), OFF-style product names, and generic-word traps like
+"Great Value" or "Organic Valley".
+
+The corpus is tied to the workbook it was generated from. When the workbook
+changes on purpose, regenerate and commit the corpus with it.
+
+Usage:
+    python benchmarks/matching_corpus.py generate
+    python benchmarks/matching_corpus.py check [--show 20]
+    python benchmarks/matching_corpus.py bench [--repeat 3]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+CORPUS_FILE = os.path.join(BENCH_DIR, "fixtures", "matching_corpus.json.gz")
+
+# Keep the app's stores out of the working tree
+_TMP = os.path.join(tempfile.gettempdir(), "tbl_bench")
+os.makedirs(_TMP, exist_ok=True)
+os.environ.setdefault("USER_DATABASE_FILE", os.path.join(_TMP, "corpus_users.db"))
+os.environ.setdefault("PRODUCT_CACHE_FILE", os.path.join(_TMP, "corpus_product_cache.db"))
+os.environ.setdefault("COMPANY_PREFIX_FILE", os.path.join(_TMP, "corpus_company_prefixes.db"))
+os.environ.setdefault("DATASET_SNAPSHOT_FILE", os.path.join(_TMP, "corpus_certifications.snapshot"))
+sys.path.insert(0, REPO_DIR)
+
+GENERIC_TRAPS = [
+    "Great Value", "Organic Valley", "Simple Truth", "Market Pantry", "Good & Gather",
+    "Nature's Promise", "365 Everyday Value", "Kirkland Signature", "Best Choice",
+    "Fresh Market", "Pure Life", "Natural Choice", "Premium Select", "Classic Original",
+    "Farm Fresh", "Home Style", "Country Harvest", "New World", "Old Fashioned",
+    "Great Taste", "Family Size", "Smart Choice", "Total Quality", "Simple Goodness",
+    "Value Brand", "House Brand", "Everyday Essentials", "American Classic",
+    "Organic", "Natural", "Fresh", "Original",
+]
+LEGAL_SUFFIXES = [" Inc.", " Co.", " LLC", " Company", " Brands", " Foods", "®", "™"]
+PRODUCT_WORDS = [
+    "Organic Dark Chocolate 3.5 oz", "Whole Bean Coffee", "Green Tea 20 bags",
+    "Greek Yogurt Vanilla", "Sparkling Water 12 pack", "Oat Cereal Family Size",
+    "Hand Soap Lavender", "Peanut Butter Crunchy", "Frozen Pizza", "Dog Food Chicken",
+]
+OFF_CATEGORIES = [
+    "Beverages", "en:coffees", "Dark chocolates", "en:plant-based-foods", "Snacks",
+    "en:dairies", "Breakfast cereals", "en:teas", "Cleaning products", "Unknown", "",
+]
+ACCENTS = {"e": "é", "a": "á", "o": "ö", "u": "ü", "n": "ñ", "i": "í", "c": "ç"}
+
+FUNCTIONS = ["normalize", "find_parent_company", "extract_brand", "partial_match", "category_match", "lookup"]
+
+
+# ==================== INPUTS ====================
+
+
+def typo(text: str, rng: random.Random) -> str:
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    kind = rng.choice(["drop", "double", "swap"])
+    if kind == "drop":
+        return text[:i] + text[i + 1:]
+    if kind == "double":
+        return text[:i] + text[i] + text[i:]
+    return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+
+
+def mangle(brand: str, rng: random.Random) -> list:
+    """A handful of realistic ways the same brand shows up in input"""
+    accented = "".join(ACCENTS.get(ch, ch) if rng.random() < 0.3 else ch for ch in brand)
+    return [
+        brand.upper(),
+        brand.lower(),
+        accented,
+        brand + rng.choice(LEGAL_SUFFIXES),
+        brand.replace(" ", "-") if " " in brand else brand + "'s",
+        "The " + brand,
+        typo(brand, rng),
+        f"{brand} {rng.choice(PRODUCT_WORDS)}",
+    ]
+
+
+def build_inputs(manager, normalizer_cls, seed: int) -> dict:
+    rng = random.Random(seed)
+    brand_keys = list(manager.data.keys())
+    originals = [next(iter(manager.data[k].values())).original_brand for k in brand_keys]
+    categories = sorted({c for products in manager.data.values() for c in products.keys() if c != "_default"})
+
+    variants = []
+    for original in originals:
+        variants.extend(mangle(original, rng))
+
+    parent_keys = list(normalizer_cls.PARENT_COMPANY_MAPPING.keys())
+    product_names = [
+        f"{original} {rng.choice(PRODUCT_WORDS)}" for original in rng.sample(originals, min(1500, len(originals)))
+    ]
+    product_names += [f"{key.title()} {rng.choice(PRODUCT_WORDS)}" for key in parent_keys]
+    product_names += [f"{trap} {rng.choice(PRODUCT_WORDS)}" for trap in GENERIC_TRAPS]
+    product_names += ["Unknown", "Generic Product", "", "x", "Organic Valley Whole Milk"]
+
+    text_inputs = originals + variants + GENERIC_TRAPS + product_names
+
+    # Partial match pairs: the brand's own key, its sorted neighbours (the
+    # likeliest substring hits), keys sharing a word, and random keys.
+    sorted_keys = sorted(brand_keys)
+    position = {key: i for i, key in enumerate(sorted_keys)}
+    by_word = {}
+    for key in brand_keys:
+        for word in set(key.split()):
+            by_word.setdefault(word, []).append(key)
+
+    pairs = []
+    for key, original in zip(brand_keys, originals):
+        search = normalizer_cls.normalize(rng.choice(mangle(original, rng)))
+        i = position[key]
+        candidates = {key, *sorted_keys[max(0, i - 2):i + 3], *rng.sample(brand_keys, 2)}
+        for word in key.split()[:2]:
+            candidates.update(by_word.get(word, [])[:3])
+        pairs.extend((search, candidate) for candidate in sorted(candidates))
+    for trap in GENERIC_TRAPS:
+        search = normalizer_cls.normalize(trap)
+        pairs.extend((search, candidate) for candidate in rng.sample(brand_keys, 10))
+
+    category_queries = []
+    for key in rng.sample(brand_keys, min(1500, len(brand_keys))):
+        own = [c for c in manager.data[key].keys() if c != "_default"]
+        for category in own[:2] + [rng.choice(categories), rng.choice(OFF_CATEGORIES)]:
+            category_queries.append((key, category))
+    for trap in GENERIC_TRAPS:
+        category_queries.append((normalizer_cls.normalize(trap), rng.choice(categories)))
+
+    lookups = [(rng.choice(variants), rng.choice(categories + OFF_CATEGORIES)) for _ in range(400)]
+    lookups += [(trap, rng.choice(OFF_CATEGORIES)) for trap in GENERIC_TRAPS]
+
+    return {
+        "normalize": text_inputs,
+        "find_parent_company": originals + GENERIC_TRAPS + product_names + variants[::8],
+        "extract_brand": product_names + variants[::4],
+        "partial_match": pairs,
+        "category_match": category_queries,
+        "lookup": lookups,
+    }
+
+
+# ==================== EVALUATION ====================
+
+
+def load_app():
+    logging.disable(logging.CRITICAL)
+    import elegant_app
+
+    if not elegant_app.certification_manager.load_certification_data():
+        raise SystemExit("Could not load the certification workbook")
+    return elegant_app
+
+
+def record_key(record):
+    return None if record is None else [record.original_brand, record.category]
+
+
+def lookup_key(response):
+    return {k: v for k, v in response.items() if k != "details"}
+
+
+def evaluators(app) -> dict:
+    normalizer = app.BrandNormalizer
+    manager = app.certification_manager
+    return {
+        "normalize": lambda text: normalizer.normalize(text),
+        "find_parent_company": lambda text: normalizer.find_parent_company(text),
+        "extract_brand": lambda text: normalizer.extract_brand_from_product_text(text),
+        "partial_match": lambda pair: manager._improved_partial_match(*pair),
+        "category_match": lambda query: record_key(manager._find_best_category_match(*query)),
+        "lookup": lambda query: lookup_key(manager.get_certifications(query[0], query[1], include_details=False)),
+    }
+
+
+def workbook_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def generate(app, seed: int):
+    inputs = build_inputs(app.certification_manager, app.BrandNormalizer, seed)
+    evaluate = evaluators(app)
+    corpus = {
+        "meta": {
+            "seed": seed,
+            "workbook": os.path.basename(app.FileConfig.CERTIFICATION_EXCEL_FILE),
+            "workbook_sha256": workbook_digest(app.FileConfig.CERTIFICATION_EXCEL_FILE),
+        },
+    }
+    for name in FUNCTIONS:
+        corpus[name] = [[case, evaluate[name](case)] for case in inputs[name]]
+        print(f"{name:<20} {len(corpus[name]):>7} cases")
+
+    os.makedirs(os.path.dirname(CORPUS_FILE), exist_ok=True)
+    # mtime=0 keeps the gzip bytes stable for identical content
+    with open(CORPUS_FILE, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+        f.write(json.dumps(corpus, sort_keys=True).encode("utf-8"))
+    print(f"Corpus written to {CORPUS_FILE}")
+
+
+def load_corpus() -> dict:
+    if not os.path.exists(CORPUS_FILE):
+        raise SystemExit(f"{CORPUS_FILE} not found; run 'generate' first")
+    with gzip.open(CORPUS_FILE, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def as_case(name: str, case):
+    """JSON turns tuples into lists; put them back for the evaluators"""
+    return tuple(case) if name in ("partial_match", "category_match", "lookup") else case
+
+
+def check(app, show: int) -> int:
+    corpus = load_corpus()
+    if corpus["meta"]["workbook_sha256"] != workbook_digest(app.FileConfig.CERTIFICATION_EXCEL_FILE):
+        print("WARNING: the workbook changed since the corpus was generated; differences may be expected")
+
+    evaluate = evaluators(app)
+    failures = 0
+    for name in FUNCTIONS:
+        mismatches = []
+        for case, expected in corpus[name]:
+            # Round-trip through JSON so tuples/lists compare like the stored values
+            actual = json.loads(json.dumps(evaluate[name](as_case(name, case))))
+            if actual != expected:
+                mismatches.append((case, expected, actual))
+        status = "ok" if not mismatches else f"{len(mismatches)} DIFFERENT"
+        print(f"{name:<20} {len(corpus[name]):>7} cases  {status}")
+        for case, expected, actual in mismatches[:show]:
+            print(f"    {case!r}\n        expected {expected!r}\n        actual   {actual!r}")
+        failures += len(mismatches)
+    return failures
+
+
+def bench(app, repeat: int):
+    corpus = load_corpus()
+    evaluate = evaluators(app)
+    normalize_uncached = app.BrandNormalizer.normalize.__func__.__wrapped__
+    evaluate["normalize (uncached)"] = lambda text: normalize_uncached(app.BrandNormalizer, text)
+    corpus["normalize (uncached)"] = corpus["normalize"]
+
+    print(f"{'function':<22} {'calls':>8} {'best us/call':>13} {'calls/s':>10}")
+    for name in ["normalize", "normalize (uncached)"] + FUNCTIONS[1:]:
+        cases = [as_case(name, case) for case, _ in corpus[name]]
+        fn = evaluate[name]
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for case in cases:
+                fn(case)
+            best = min(best, time.perf_counter() - start)
+        per_call = best / len(cases)
+        print(f"{name:<22} {len(cases):>8} {per_call * 1e6:>13.2f} {1 / per_call:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["generate", "check", "bench"])
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--show", type=int, default=10, help="differences to print per function")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = load_app()
+    if args.command == "generate":
+        generate(app, args.seed)
+    elif args.command == "check":
+        sys.exit(1 if check(app, args.show) else 0)
+    else:
+        bench(app, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Open Food Facts Payload Benchmark
+Measures what one upstream lookup costs to receive and decode.
+
+Products are synthesized for workbook brands as full-size OFF documents
+(benchmarks/off_stub.py, full_documents=True; approximate, ~60 KB each; use
+off_stub.py --record for real ones) and fetched both ways:
+
+    legacy     /api/v0/product/{barcode}.json and an unprojected name search
+               (the whole document, as the app used to request it)
+    projected  the app's own OpenFoodFactsClient.lookup_barcode and
+               search_by_name (/api/v2 with fields=)
+
+For each, the table shows bytes received per call, best-of json.loads time
+and the tracemalloc peak while decoding one response.
+
+Usage:
+    python benchmarks/off_payload.py [--products 200] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import quote
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Keep the app's stores out of the working tree
+_TMP = os.path.join(tempfile.gettempdir(), "tbl_bench")
+os.makedirs(_TMP, exist_ok=True)
+os.environ.setdefault("USER_DATABASE_FILE", os.path.join(_TMP, "payload_users.db"))
+# Fresh product cache every run: a cached barcode never reaches the stub
+os.environ.setdefault("PRODUCT_CACHE_FILE", os.path.join(tempfile.mkdtemp(dir=_TMP), "payload_product_cache.db"))
+os.environ.setdefault("DATASET_SNAPSHOT_FILE", os.path.join(_TMP, "payload_certifications.snapshot"))
+os.environ.setdefault("COMPANY_PREFIX_FILE", os.path.join(_TMP, "payload_company_prefixes.db"))
+os.environ.setdefault("DATASET_CHANGES_FILE", os.path.join(_TMP, "payload_changes.db"))
+# The stub isn't rate limited like OFF; keep the outbound token buckets out of the numbers
+os.environ.setdefault("OFF_PRODUCT_RATE_PER_MINUTE", "1000000")
+os.environ.setdefault("OFF_SEARCH_RATE_PER_MINUTE", "1000000")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+
+def legacy_search_url(name: str) -> str:
+    """search_by_name's URL before it asked for fields="""
+    return (
+        f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={quote(name)}"
+        f"&search_simple=1&action=process&json=1&page_size=20"
+    )
+
+
+async def capture(app_module, stub, barcodes, names) -> dict:
+    """(kind, mode) -> list of response bodies received from the stub"""
+    import httpx
+    from off_stub import product_url
+
+    client_cls = app_module.OpenFoodFactsClient
+    bodies = {}
+    handle = stub.handle
+
+    async def recording_handle(request):
+        response = await handle(request)
+        bodies.setdefault(current[0], []).append(response.content)
+        return response
+
+    current = [None]
+    stub.handle = recording_handle
+    try:
+        with stub.installed():
+            current[0] = ("lookup", "legacy")
+            async with httpx.AsyncClient() as client:
+                for barcode in barcodes:
+                    await client.get(product_url(barcode))
+                current[0] = ("search", "legacy")
+                for name in names:
+                    await client.get(legacy_search_url(name))
+            current[0] = ("lookup", "projected")
+            for barcode in barcodes:
+                await client_cls.lookup_barcode(barcode)
+            current[0] = ("search", "projected")
+            for name in names:
+                await client_cls.search_by_name(name)
+    finally:
+        stub.handle = handle
+    return bodies
+
+
+def decode_time(bodies, repeat: int) -> float:
+    """Best-of-repeat seconds per json.loads"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for body in bodies:
+            json.loads(body)
+        best = min(best, (time.perf_counter() - t0) / len(bodies))
+    return best
+
+
+def decode_peak(bodies) -> float:
+    """Mean tracemalloc peak bytes while decoding one body"""
+    total = 0
+    for body in bodies:
+        tracemalloc.start()
+        json.loads(body)
+        total += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return total / len(bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200, help="synthesized products looked up and searched")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import elegant_app as app_module
+    from off_stub import OffStub, product_url, response_key
+
+    manager = app_module.certification_manager
+    if not manager.load_certification_data():
+        raise SystemExit("Could not load the certification workbook")
+
+    rows = []
+    for _, products in list(manager.data.items())[: args.products]:
+        record = next(iter(products.values()))
+        rows.append((record.original_brand, record.category))
+    stub = OffStub(full_documents=True)
+    barcodes = stub.synthesize(rows)
+    names = [stub.responses[response_key(product_url(b))]["json"]["product"]["product_name"] for b in barcodes]
+
+    bodies = asyncio.run(capture(app_module, stub, barcodes, names))
+
+    header = f"{'request':<20} {'calls':>6} {'bytes/call':>11} {'decode us':>10} {'peak KB':>8}"
+    print(header)
+    print("-" * len(header))
+    results = {}
+    for kind in ("lookup", "search"):
+        for mode in ("legacy", "projected"):
+            received = bodies.get((kind, mode), [])
+            if not received:
+                print(f"{kind + ' ' + mode:<20} {'no responses captured':>38}")
+                continue
+            avg_bytes = sum(map(len, received)) / len(received)
+            seconds = decode_time(received, args.repeat)
+            peak = decode_peak(received)
+            results[kind, mode] = avg_bytes
+            print(
+                f"{kind + ' ' + mode:<20} {len(received):>6} {avg_bytes:>11.0f} "
+                f"{seconds * 1e6:>10.1f} {peak / 1024:>8.1f}"
+            )
+
+    print()
+    for kind in ("lookup", "search"):
+        if (kind, "legacy") in results and (kind, "projected") in results:
+            ratio = results[kind, "legacy"] / results[kind, "projected"]
+            print(f"{kind}: {ratio:.1f}x fewer bytes received with fields= projection")
+
+
+if __name__ == "__main__":
+    main()
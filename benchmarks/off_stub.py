@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Open Food Facts Stub
+Replays Open Food Facts responses so benchmarks never touch the network.
+
+Responses are keyed by host + path + query. They come from a recording
+(benchmarks/fixtures/off_responses.json, captured with --record) or are
+synthesized from a workbook's brands; anything unknown gets OFF's own
+"not found" shape. Products are stored as full documents under their v0 URL
+and v2 requests are answered from them, applying fields= the way OFF does.
+The stub is installed by swapping httpx.AsyncClient for a subclass that
+routes through an httpx.MockTransport, so the app code runs unchanged.
+
+Usage:
+    python benchmarks/off_stub.py --record 3017620422003 737628064502
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from contextlib import contextmanager
+from urllib.parse import quote, urlsplit
+
+import httpx
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "off_responses.json")
+
+PRODUCT_HOSTS = [
+    "world.openfoodfacts.org",
+    "world.openpetfoodfacts.org",
+    "world.openproductsfacts.org",
+    "world.openbeautyfacts.org",
+]
+
+PRODUCT_PATH = re.compile(r"^/api/v[02]/product/([^/.?]+)(?:\.json)?$")
+LANGUAGES = ["en", "fr", "de", "es", "it", "nl", "pt", "pl", "sv", "da", "fi", "cs", "ro", "hu", "el", "ja", "zh", "ar"]
+NUTRIENTS = [
+    "energy", "energy-kcal", "energy-kj", "fat", "saturated-fat", "trans-fat", "cholesterol", "carbohydrates",
+    "sugars", "added-sugars", "fiber", "proteins", "salt", "sodium", "calcium", "iron", "potassium", "vitamin-a",
+    "vitamin-c", "vitamin-d", "magnesium", "zinc", "fruits-vegetables-nuts-estimate-from-ingredients",
+]
+
+PRODUCT_WORDS = ["Organic", "Classic", "Original", "Dark", "Sparkling", "Whole", "Roasted", "Light"]
+PRODUCT_NOUNS = ["Coffee", "Tea", "Chocolate Bar", "Cereal", "Yogurt", "Crackers", "Juice", "Soap"]
+
+
+def response_key(url) -> str:
+    parts = urlsplit(str(url))
+    return f"{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+def product_url(barcode: str, host: str = PRODUCT_HOSTS[0]) -> str:
+    return f"https://{host}/api/v0/product/{barcode}.json"
+
+
+def ean13(seed: int) -> str:
+    """Deterministic EAN-13 with a valid check digit"""
+    body = f"{200000000000 + seed:012d}"[-12:]
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def pad_document(product: dict, rng: random.Random):
+    """
+    Add the bulk a real OFF product document carries (per-language names,
+    image sets, ingredient analysis, full nutrient tables, edit history), so
+    unprojected responses are a realistic size (~60 KB; recorded documents
+    are often larger).
+    """
+    barcode, name = product["code"], product["product_name"]
+    for lang in LANGUAGES:
+        product[f"product_name_{lang}"] = f"{name} ({lang})"
+        product[f"ingredients_text_{lang}"] = product["ingredients_text"]
+    product["images"] = {
+        f"{kind}_{lang}": {
+            "imgid": str(rng.randint(1, 40)),
+            "rev": str(rng.randint(1, 90)),
+            "sizes": {size: {"w": size_px, "h": size_px} for size, size_px in
+                      (("100", 100), ("200", 200), ("400", 400), ("full", 1600))},
+            "geometry": "0x0-0-0",
+            "angle": 0,
+            "normalize": None,
+            "white_magic": None,
+        }
+        for kind in ("front", "ingredients", "nutrition", "packaging")
+        for lang in LANGUAGES
+    }
+    product["selected_images"] = {
+        kind: {size: {lang: f"https://images.openfoodfacts.org/images/products/{barcode}/{kind}_{lang}.{size}.jpg"
+                      for lang in LANGUAGES} for size in ("display", "small", "thumb")}
+        for kind in ("front", "ingredients", "nutrition", "packaging")
+    }
+    product["ingredients"] = [
+        {"id": f"en:ingredient-{i}", "text": f"ingredient {i}", "rank": i + 1,
+         "percent_estimate": round(rng.uniform(0, 50), 2), "percent_min": 0, "percent_max": 100,
+         "vegan": "yes", "vegetarian": "yes", "from_palm_oil": "no"}
+        for i in range(rng.randint(20, 40))
+    ]
+    nutriments = product["nutriments"]
+    for nutrient in NUTRIENTS:
+        value = round(rng.uniform(0, 50), 3)
+        for suffix in ("", "_100g", "_serving", "_value", "_unit", "_modifier", "_prepared_100g"):
+            nutriments.setdefault(f"{nutrient}{suffix}", "g" if suffix == "_unit" else value)
+    product["_keywords"] = name.lower().split() * 4
+    product["categories_hierarchy"] = product["categories_tags"] * 3
+    product["editors_tags"] = [f"editor-{i}" for i in range(30)]
+    product["states_tags"] = [f"en:state-{i}" for i in range(25)]
+    product["ecoscore_data"] = {
+        "adjustments": {
+            "packaging": {
+                "packagings": [{"material": "en:plastic", "shape": "en:bag", "ecoscore_material_score": 0}] * 6,
+            },
+            "origins_of_ingredients": {
+                "aggregated_origins": [{"origin": f"en:{lang}", "percent": 5} for lang in LANGUAGES],
+            },
+        },
+        "agribalyse": {
+            f"{stage}_{metric}": round(rng.uniform(0, 5), 6)
+            for stage in (
+                "agriculture", "consumption", "distribution", "packaging", "processing", "transportation", "total"
+            )
+            for metric in ("co2", "ef")
+        },
+    }
+
+
+def synthesize_product(
+    barcode: str, brand: str, category: str, rng: random.Random, full_document: bool = False
+) -> dict:
+    """A product payload with the fields the app reads from OFF (padded like a real document if asked)"""
+    name = f"{brand} {rng.choice(PRODUCT_WORDS)} {rng.choice(PRODUCT_NOUNS)}"
+    payload = {
+        "status": 1,
+        "code": barcode,
+        "product": {
+            "code": barcode,
+            "product_name": name,
+            "brands": brand,
+            "categories": f"Foods, {category}" if category else "Foods",
+            "categories_tags": [category] if category else [],
+            "labels": "",
+            "ingredients_text": "water, sugar, natural flavours",
+            "nutriscore_grade": rng.choice("abcde"),
+            "ecoscore_grade": rng.choice("abcde"),
+            "nova_group": rng.randint(1, 4),
+            "quantity": f"{rng.randint(100, 1000)} g",
+            "packaging": "plastic",
+            "image_url": f"https://images.openfoodfacts.org/images/products/{barcode}/front_en.jpg",
+            "countries": "United States",
+            "nutriments": {
+                "energy-kcal_100g": rng.randint(20, 550),
+                "fat_100g": round(rng.uniform(0, 40), 1),
+                "carbohydrates_100g": round(rng.uniform(0, 80), 1),
+                "proteins_100g": round(rng.uniform(0, 25), 1),
+                "salt_100g": round(rng.uniform(0, 2), 2),
+            },
+            "last_modified_t": 1767225600,
+        },
+    }
+    if full_document:
+        pad_document(payload["product"], rng)
+    return payload
+
+
+def project(payload: dict, fields: str) -> dict:
+    """Keep only the requested product fields, as OFF does for ?fields="""
+    wanted = [f for f in fields.split(",") if f]
+    product = payload.get("product")
+    if not wanted or not isinstance(product, dict):
+        return payload
+    return {**payload, "product": {f: product[f] for f in wanted if f in product}}
+
+
+def search_payload(products: list) -> dict:
+    return {"count": len(products), "page": 1, "page_size": len(products), "products": products}
+
+
+class OffStub:
+    """In-process replay of Open Food Facts responses"""
+
+    def __init__(self, responses: dict = None, latency_ms: float = 0.0, full_documents: bool = False):
+        self.responses = dict(responses or {})
+        self.searches = {}  # lowercased search terms / brand tag -> products
+        self.latency = latency_ms / 1000.0
+        self.full_documents = full_documents
+        self.requests = 0
+        self.bytes_served = 0
+
+    @classmethod
+    def from_fixture(cls, path: str = FIXTURE_FILE, **kwargs) -> "OffStub":
+        responses = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                responses = json.load(f)
+        return cls(responses, **kwargs)
+
+    def add_product(self, barcode: str, payload: dict):
+        self.responses[response_key(product_url(barcode))] = {"status_code": 200, "json": payload}
+
+    def add_search(self, terms: str, products: list):
+        """Answer name searches (cgi/search.pl) and brand searches (api/v2/search) for terms"""
+        self.searches[terms.strip().lower()] = products
+
+    def synthesize(self, brand_rows, seed: int = 7) -> list:
+        """
+        Add a product for each (brand, category) pair, searchable by its
+        name and brand; returns the barcodes that were added.
+        """
+        rng = random.Random(seed)
+        barcodes = []
+        for i, (brand, category) in enumerate(brand_rows):
+            barcode = ean13(i)
+            payload = synthesize_product(barcode, brand, category, rng, self.full_documents)
+            self.add_product(barcode, payload)
+            self.add_search(payload["product"]["product_name"], [payload["product"]])
+            self.searches.setdefault(brand.strip().lower(), []).append(payload["product"])
+            barcodes.append(barcode)
+        return barcodes
+
+    def _product(self, request: httpx.Request, barcode: str) -> httpx.Response:
+        """v0 or v2 product lookup, answered from the stored full document"""
+        recorded = self.responses.get(response_key(product_url(barcode, request.url.host)))
+        v2 = request.url.path.startswith("/api/v2/")
+        if recorded is None or recorded["json"].get("status") != 1:
+            # v2 says "not found" with a 404, v0 with a 200
+            return httpx.Response(404 if v2 else 200, json={"status": 0, "status_verbose": "product not found"})
+        fields = request.url.params.get("fields")
+        payload = project(recorded["json"], fields) if fields else recorded["json"]
+        return httpx.Response(recorded["status_code"], json=payload)
+
+    def _fallback(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.startswith("/cgi/search.pl") or path.startswith("/api/v2/search"):
+            params = request.url.params
+            terms = params.get("search_terms") or params.get("brands_tags") or ""
+            page_size = int(params.get("page_size") or 20)
+            products = self.searches.get(terms.strip().lower(), [])[:page_size]
+            fields = [f for f in (params.get("fields") or "").split(",") if f]
+            if fields:
+                products = [{f: p[f] for f in fields if f in p} for p in products]
+            return httpx.Response(200, json=search_payload(products))
+        return httpx.Response(404, json={"error": "not recorded"})
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        product = PRODUCT_PATH.match(request.url.path)
+        recorded = None if product else self.responses.get(response_key(request.url))
+        if product:
+            response = self._product(request, product.group(1))
+        elif recorded is None:
+            response = self._fallback(request)
+        else:
+            response = httpx.Response(recorded["status_code"], json=recorded["json"])
+        self.bytes_served += len(response.content)
+        return response
+
+    @contextmanager
+    def installed(self):
+        """Route every httpx.AsyncClient created inside the block to the stub"""
+        original = httpx.AsyncClient
+        transport = httpx.MockTransport(self.handle)
+
+        class StubbedAsyncClient(original):
+            def __init__(self, *args, **kwargs):
+                kwargs["transport"] = transport
+                super().__init__(*args, **kwargs)
+
+        httpx.AsyncClient = StubbedAsyncClient
+        try:
+            yield self
+        finally:
+            httpx.AsyncClient = original
+
+
+async def record(barcodes, searches, path: str):
+    """Fetch live responses and merge them into the fixture file"""
+    stub = OffStub.from_fixture(path)
+    headers = {"User-Agent": "TBLGroceryScanner/1.0 (benchmark recorder)"}
+    # Full documents (v0); the stub projects them for the app's v2 fields= requests
+    urls = [product_url(b) for b in barcodes]
+    # Name searches, unprojected for the same reason
+    urls += [
+        f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={quote(s)}"
+        f"&search_simple=1&action=process&json=1&page_size=20"
+        for s in searches
+    ]
+    async with httpx.AsyncClient(timeout=20.0, headers=headers) as client:
+        for url in urls:
+            response = await client.get(url)
+            stub.responses[response_key(url)] = {"status_code": response.status_code, "json": response.json()}
+            print(f"{response.status_code} {url}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stub.responses, f, indent=1, sort_keys=True)
+    print(f"Saved {len(stub.responses)} responses to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", nargs="*", default=[], metavar="BARCODE", help="barcodes to record")
+    parser.add_argument("--search", nargs="*", default=[], metavar="TERMS", help="name searches to record")
+    parser.add_argument("--fixture", default=FIXTURE_FILE)
+    args = parser.parse_args()
+    if not args.record and not args.search:
+        parser.error("nothing to record")
+    asyncio.run(record(args.record, args.search, args.fixture))
+
+
+if __name__ == "__main__":
+    main()
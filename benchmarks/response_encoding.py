@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Response Encoding Benchmark
+Measures what it costs to turn an endpoint's result into response bytes.
+
+Payloads are captured from real requests: the scan pipeline workload
+(benchmarks/scan_pipeline.py, with Open Food Facts replayed from
+benchmarks/off_stub.py) for /scan, /product/{barcode} and /compare, plus
+/certifications/search/{brand} for workbook brands. Memoized /scan and
+/product results are captured when first encoded. Each payload is then
+encoded both ways:
+
+    legacy   sanitize_for_json -> jsonable_encoder -> JSONResponse.render
+             (what a dict returned from these endpoints went through)
+    fast     encode_json (FastJSONResponse.render)
+
+and the two byte strings must be identical.
+
+Usage:
+    python benchmarks/response_encoding.py [--requests 200] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Keep the app's stores out of the working tree
+_TMP = os.path.join(tempfile.gettempdir(), "tbl_bench")
+os.makedirs(_TMP, exist_ok=True)
+os.environ.setdefault("USER_DATABASE_FILE", os.path.join(_TMP, "encoding_users.db"))
+os.environ.setdefault("PRODUCT_CACHE_FILE", os.path.join(_TMP, "encoding_product_cache.db"))
+os.environ.setdefault("COMPANY_PREFIX_FILE", os.path.join(_TMP, "encoding_company_prefixes.db"))
+os.environ.setdefault("DATASET_SNAPSHOT_FILE", os.path.join(_TMP, "encoding_certifications.snapshot"))
+# The stub isn't rate limited like OFF; keep the outbound token buckets out of the numbers
+os.environ.setdefault("OFF_PRODUCT_RATE_PER_MINUTE", "1000000")
+os.environ.setdefault("OFF_SEARCH_RATE_PER_MINUTE", "1000000")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+ENDPOINTS = ["/scan", "/product/{barcode}", "/compare", "/certifications/search/{brand}"]
+
+
+async def capture(app_module, requests: int, seed: int) -> dict:
+    """endpoint -> list of payloads handed to FastJSONResponse"""
+    import httpx
+    from off_stub import OffStub
+    from scan_pipeline import build_workload
+
+    manager = app_module.certification_manager
+    stub = OffStub.from_fixture()
+    workload = build_workload(manager, stub, seed)
+    rng = random.Random(seed)
+    originals = [next(iter(products.values())).original_brand for _, products in manager.data.items()]
+    workload["/certifications/search/{brand}"] = [
+        ("search", "GET", f"/certifications/search/{brand}", None, None)
+        for brand in rng.sample(originals, min(requests, len(originals)))
+    ]
+
+    captured = {endpoint: [] for endpoint in ENDPOINTS}
+    current = [None]
+    render = app_module.FastJSONResponse.render
+    memoize = app_module.MemoizedResult.from_content.__func__
+
+    def recording_render(self, content):
+        captured[current[0]].append(content)
+        return render(self, content)
+
+    def recording_memoize(cls, content, volatile):
+        # Memoized /scan and /product results are encoded here instead
+        captured[current[0]].append(content)
+        return memoize(cls, content, volatile)
+
+    app_module.FastJSONResponse.render = recording_render
+    app_module.MemoizedResult.from_content = classmethod(recording_memoize)
+    try:
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            with stub.installed():
+                for endpoint in ENDPOINTS:
+                    current[0] = endpoint
+                    for _, method, path, params, body in workload[endpoint][:requests]:
+                        await client.request(method, path, params=params, json=body)
+    finally:
+        app_module.FastJSONResponse.render = render
+        app_module.MemoizedResult.from_content = classmethod(memoize)
+    return captured
+
+
+def time_per_call(encode, payloads, repeat: int) -> float:
+    """Best-of-repeat seconds per payload"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for payload in payloads:
+            encode(payload)
+        best = min(best, (time.perf_counter() - t0) / len(payloads))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="captured responses per endpoint")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import elegant_app as app_module
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    if not app_module.certification_manager.load_certification_data():
+        raise SystemExit("Could not load the certification workbook")
+
+    def legacy(payload) -> bytes:
+        return JSONResponse(content=jsonable_encoder(app_module.sanitize_for_json(payload))).body
+
+    fast = app_module.encode_json
+
+    captured = asyncio.run(capture(app_module, args.requests, args.seed))
+
+    header = f"{'endpoint':<32} {'n':>5} {'avg bytes':>10} {'legacy us':>10} {'fast us':>9} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    mismatches = 0
+    for endpoint, payloads in captured.items():
+        if not payloads:
+            print(f"{endpoint:<32} {'no payloads captured':>44}")
+            continue
+        for payload in payloads:
+            if legacy(payload) != fast(payload):
+                mismatches += 1
+        legacy_s = time_per_call(legacy, payloads, args.repeat)
+        fast_s = time_per_call(fast, payloads, args.repeat)
+        avg_bytes = sum(len(fast(p)) for p in payloads) / len(payloads)
+        print(
+            f"{endpoint:<32} {len(payloads):>5} {avg_bytes:>10.0f} {legacy_s * 1e6:>10.1f} "
+            f"{fast_s * 1e6:>9.1f} {legacy_s / fast_s:>7.1f}x"
+        )
+
+    if mismatches:
+        print(f"\n{mismatches} payload(s) encoded differently")
+        sys.exit(1)
+    print("\nAll payloads encode to identical bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Scan Pipeline Benchmark
+Drives the FastAPI app in-process (httpx ASGITransport) with Open Food Facts
+replayed from benchmarks/off_stub.py, and reports p50/p99 latency and
+single-client throughput for /scan, /product/{barcode}, /search-brand,
+/compare, /extract-brand and /purchase.
+
+Each endpoint gets a seeded mix of requests: barcode hits and misses,
+multi-category brands, typos, unknown brands and name-only scans.
+
+Datasets (each runs in its own subprocess with a fresh user store, product
+cache and dataset snapshot):
+    shipped   the committed workbook
+    10k       synthetic sheet with 10,000 brands
+    100k      synthetic sheet with 100,000 brands
+
+Results are compared with benchmarks/baselines/scan_pipeline.json. After an
+intended change, re-run with --save-baseline and commit the file so the diff
+shows the new numbers.
+
+Usage:
+    python benchmarks/scan_pipeline.py [--datasets shipped,10k,100k] [--requests 200]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_FILE = os.path.join(BENCH_DIR, "baselines", "scan_pipeline.json")
+WORK_DIR = os.path.join(tempfile.gettempdir(), "tbl_bench")
+
+SYNTHETIC_BRANDS = {"10k": 10000, "100k": 100000}
+ENDPOINTS = ["/scan", "/product/{barcode}", "/search-brand", "/compare", "/extract-brand", "/purchase"]
+
+UNKNOWN_BRANDS = ["Zyxwv Provisions", "Quillfeather Farms", "Northbright Pantry", "Great Value", "Kirkland"]
+GENERIC_NAMES = ["chocolate", "Organic Valley Milk", "Whole Wheat Bread", "sparkling water"]
+
+
+# ==================== WORKLOAD ====================
+
+
+def typo(text: str, rng: random.Random) -> str:
+    """Drop, double or swap one character (the kinds of slips users make)"""
+    if len(text) < 4:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    kind = rng.choice(["drop", "double", "swap"])
+    if kind == "drop":
+        return text[:i] + text[i + 1:]
+    if kind == "double":
+        return text[:i] + text[i] + text[i:]
+    return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+
+
+def build_workload(manager, stub, seed: int) -> dict:
+    """endpoint -> list of (kind, method, path, params, json) in a seeded order"""
+    from off_stub import ean13, product_url, response_key
+
+    rng = random.Random(seed)
+    brands = list(manager.data.items())
+    sample = rng.sample(brands, min(400, len(brands)))
+
+    multi, single, product_rows = [], [], []
+    for _, products in sample:
+        records = list(products.values())
+        (multi if len(records) > 1 else single).append(records)
+        record = records[0]
+        product_rows.append((record.original_brand, record.category))
+    multi = multi or single
+
+    hits = stub.synthesize(product_rows[:200])
+    misses = [ean13(10 ** 9 + i) for i in range(50)]
+    names = [stub.responses[response_key(product_url(b))]["json"]["product"]["product_name"] for b in hits]
+
+    def brand_of(records):
+        return records[0].original_brand
+
+    scan, product, search, compare, extract, purchase = [], [], [], [], [], []
+    for _ in range(200):
+        records = rng.choice(multi)
+        record = rng.choice(records)
+        scan += [
+            ("barcode_hit", "POST", "/scan", None, {"barcode": rng.choice(hits)}),
+            ("barcode_miss", "POST", "/scan", None, {"barcode": rng.choice(misses)}),
+            ("multi_category", "POST", "/scan", None,
+             {"brand": record.original_brand, "category": record.category}),
+            ("typo", "POST", "/scan", None, {"brand": typo(brand_of(rng.choice(single)), rng)}),
+            ("unknown", "POST", "/scan", None, {"brand": rng.choice(UNKNOWN_BRANDS)}),
+            ("name_only", "POST", "/scan", None, {"product_name": rng.choice(names)}),
+        ]
+        product += [
+            ("hit", "GET", f"/product/{rng.choice(hits)}", None, None),
+            ("hit", "GET", f"/product/{rng.choice(hits)}", None, None),
+            ("miss", "GET", f"/product/{rng.choice(misses)}", None, None),
+        ]
+        prefix_brand = brand_of(rng.choice(single))
+        search += [
+            ("prefix", "GET", "/search-brand", {"q": prefix_brand[:4]}, None),
+            ("exact_category", "GET", "/search-brand",
+             {"q": record.original_brand, "category": record.category}, None),
+            ("typo", "GET", "/search-brand", {"q": typo(prefix_brand, rng)}, None),
+            ("unknown", "GET", "/search-brand", {"q": rng.choice(UNKNOWN_BRANDS)}, None),
+        ]
+        compare.append(("mixed", "POST", "/compare", None, [
+            {"brand": brand_of(rng.choice(multi))},
+            {"brand": typo(brand_of(rng.choice(single)), rng)},
+            {"brand": rng.choice(UNKNOWN_BRANDS)},
+        ]))
+        extract += [
+            ("product_name", "POST", "/extract-brand", None, {"product_name": rng.choice(names)}),
+            ("generic", "POST", "/extract-brand", None, {"product_name": rng.choice(GENERIC_NAMES)}),
+        ]
+        purchase.append(("purchase", "POST", "/purchase", {"username": "bench"}, {
+            "barcode": rng.choice(hits),
+            "brand": record.original_brand,
+            "product_name": rng.choice(names),
+            "category": record.category,
+            "price": round(rng.uniform(1, 20), 2),
+        }))
+
+    for requests in (scan, product, search, compare, extract, purchase):
+        rng.shuffle(requests)
+    return dict(zip(ENDPOINTS, (scan, product, search, compare, extract, purchase)))
+
+
+# ==================== MEASUREMENT ====================
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, statuses: dict) -> dict:
+    values = sorted(latencies)
+    total = sum(values)
+    return {
+        "requests": len(values),
+        # 404s are expected for misses; only server errors count
+        "errors": sum(n for status, n in statuses.items() if int(status) >= 500),
+        "statuses": dict(sorted(statuses.items())),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(total / len(values) * 1000, 3) if values else 0.0,
+        "throughput_rps": round(len(values) / total, 1) if total else 0.0,
+    }
+
+
+async def drive(client, requests, count: int, warmup: int, max_seconds: float):
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    for i in range(warmup + count):
+        _, method, path, params, body = requests[i % len(requests)]
+        t0 = time.perf_counter()
+        response = await client.request(method, path, params=params, json=body)
+        elapsed = time.perf_counter() - t0
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        status = str(response.status_code)
+        statuses[status] = statuses.get(status, 0) + 1
+        if time.perf_counter() - started > max_seconds:
+            break
+    return latencies, statuses
+
+
+async def run_worker(args) -> dict:
+    import httpx
+
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    logging.disable(logging.CRITICAL)
+    from off_stub import OffStub
+
+    t0 = time.perf_counter()
+    import elegant_app as app_module
+
+    manager = app_module.certification_manager
+    if not manager.load_certification_data():
+        raise SystemExit(f"could not load {app_module.FileConfig.CERTIFICATION_EXCEL_FILE}")
+    load_seconds = time.perf_counter() - t0
+
+    stub = OffStub.from_fixture(latency_ms=args.off_latency_ms)
+    workload = build_workload(manager, stub, args.seed)
+    app_module.user_store.create_user("bench", "bench@example.com", "not-a-login-account")
+
+    results = {}
+    transport = httpx.ASGITransport(app=app_module.app)
+    # Built before the stub is installed so it keeps the ASGI transport
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        with stub.installed():
+            for endpoint in args.endpoints:
+                requests_before, bytes_before = stub.requests, stub.bytes_served
+                latencies, statuses = await drive(
+                    client, workload[endpoint], args.requests, args.warmup, args.max_seconds
+                )
+                results[endpoint] = summarize(latencies, statuses)
+                results[endpoint]["off_requests"] = stub.requests - requests_before
+                results[endpoint]["off_bytes"] = stub.bytes_served - bytes_before
+
+    return {
+        "brands": len(manager.data),
+        "load_seconds": round(load_seconds, 2),
+        "endpoints": results,
+    }
+
+
+# ==================== DATASETS ====================
+
+
+def dataset_workbook(name: str, seed: int) -> str:
+    if name == "shipped":
+        return os.path.join(REPO_DIR, "comprehensive_grocery_certifications_COMPLETE.xlsx")
+
+    brands = SYNTHETIC_BRANDS[name]
+    path = os.path.join(WORK_DIR, f"synthetic_{name}_{seed}.xlsx")
+    if not os.path.exists(path):
+        sys.path.insert(0, BENCH_DIR)
+        from dataset_memory import make_synthetic_sheet
+
+        print(f"Generating {path} ...", flush=True)
+        os.makedirs(WORK_DIR, exist_ok=True)
+        # ~20% of brands appear in a second category, like the shipped sheet
+        df = make_synthetic_sheet(int(brands * 1.2), seed=seed, brands=brands)
+        df.to_excel(path + ".tmp.xlsx", index=False)
+        os.replace(path + ".tmp.xlsx", path)
+    return path
+
+
+def run_dataset(name: str, args) -> dict:
+    workbook = dataset_workbook(name, args.seed)
+    run_dir = tempfile.mkdtemp(prefix=f"run_{name}_", dir=WORK_DIR)
+    output = os.path.join(run_dir, "result.json")
+    env = dict(
+        os.environ,
+        CERTIFICATION_EXCEL_FILE=workbook,
+        USER_DATABASE_FILE=os.path.join(run_dir, "users.db"),
+        PRODUCT_CACHE_FILE=os.path.join(run_dir, "product_cache.db"),
+        COMPANY_PREFIX_FILE=os.path.join(run_dir, "company_prefixes.db"),
+        DATASET_SNAPSHOT_FILE=os.path.join(run_dir, "certifications.snapshot"),
+        # The stub isn't rate limited like OFF; keep the outbound token buckets out of the numbers
+        OFF_PRODUCT_RATE_PER_MINUTE="1000000",
+        OFF_SEARCH_RATE_PER_MINUTE="1000000",
+    )
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", name, "--output", output,
+        "--requests", str(args.requests), "--warmup", str(args.warmup),
+        "--max-seconds", str(args.max_seconds), "--seed", str(args.seed),
+        "--off-latency-ms", str(args.off_latency_ms), "--endpoints", ",".join(args.endpoints),
+    ]
+    print(f"Running dataset '{name}' ...", flush=True)
+    subprocess.run(command, env=env, cwd=REPO_DIR, check=True)
+    with open(output, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ==================== REPORT ====================
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for dataset, data in results["datasets"].items():
+        base_endpoints = baseline.get("datasets", {}).get(dataset, {}).get("endpoints", {})
+        for endpoint, stats in data["endpoints"].items():
+            base = base_endpoints.get(endpoint)
+            if not base:
+                continue
+            for metric in ("p50_ms", "p99_ms"):
+                if base[metric] and stats[metric] > base[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{dataset} {endpoint} {metric}: {base[metric]:.1f} -> {stats[metric]:.1f}"
+                    )
+    return regressions
+
+
+def print_report(results: dict, baseline: dict):
+    header = (
+        f"{'dataset':<8} {'endpoint':<20} {'n':>5} {'err':>4} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'base p50':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for dataset, data in results["datasets"].items():
+        base_endpoints = baseline.get("datasets", {}).get(dataset, {}).get("endpoints", {})
+        for endpoint, stats in data["endpoints"].items():
+            base = base_endpoints.get(endpoint, {}).get("p50_ms")
+            print(
+                f"{dataset:<8} {endpoint:<20} {stats['requests']:>5} {stats['errors']:>4} "
+                f"{stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['throughput_rps']:>8.1f} "
+                f"{base if base is not None else '-':>9}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasets", default="shipped,10k,100k")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=60.0, help="time budget per endpoint")
+    parser.add_argument("--off-latency-ms", type=float, default=0.0, help="simulated OFF latency")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--output", help="also write results JSON here")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.endpoints = [e for e in args.endpoints.split(",") if e]
+
+    if args.worker:
+        result = asyncio.run(run_worker(args))
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "seed": args.seed,
+            "off_latency_ms": args.off_latency_ms,
+        },
+        "datasets": {},
+    }
+    for name in args.datasets.split(","):
+        results["datasets"][name] = run_dataset(name, args)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print()
+    print_report(results, baseline)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {BASELINE_FILE}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,56 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import sys
+import asyncio
 import io
 import json
+import csv
+import codecs
+import base64
+import gzip
+import hashlib
 import math
+import mmap
 import time
 import threading
 import sqlite3
+import heapq
 import importlib.util
 import logging
+import uuid
 from datetime import datetime
 from typing import Optional, List, Dict, Any, Set, ClassVar
-from urllib.parse import quote
-from collections import Counter
-from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from urllib.parse import quote, urlsplit
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping, ItemsView
+from contextlib import asynccontextmanager, contextmanager, redirect_stdout, redirect_stderr
 from dataclasses import dataclass
 from difflib import SequenceMatcher
+from functools import wraps
+from itertools import islice
 
 import httpx
-from fastapi import FastAPI, Query, HTTPException, File, UploadFile
+from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, field_validator
 
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot builds are not cross-process locked
+    fcntl = None
+
+from auth import (
+    verify_auth,
+    require_auth,
+    BCRYPT_ROUNDS as DEFAULT_BCRYPT_ROUNDS,
+    hash_password_sync,
+    verify_password_sync,
+    password_needs_rehash,
+)
+
 
 # ==================== BRAND MATCHING ====================
 # This handles real-world product names like:
@@ -78,6 +106,33 @@ def sanitize_for_json(data):
         return str(data)
 
 
+# Same output as sanitize_for_json + JSONResponse, in one pass of the C
+# encoder: non-JSON types go through default=str exactly as the sanitizer
+# turns them into strings. Only NaN/Infinity need the sanitizer, and they
+# make the encoder raise, so that rare payload takes the slow path.
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str)
+
+
+def encode_json(content: Any) -> bytes:
+    """Serialize a response body (NaN/Infinity become 0.0, other types str())"""
+    try:
+        return _JSON_ENCODER.encode(content).encode("utf-8")
+    except ValueError:
+        return _JSON_ENCODER.encode(sanitize_for_json(content)).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response that skips jsonable_encoder and the sanitizer walk.
+
+    Return it from an endpoint (rather than a dict) so FastAPI hands it
+    straight to the client.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+
 PORT = int(os.getenv("PORT", 8000))
 
 # REMOVED: import bcrypt           # Will load inside functions
@@ -90,18 +145,6 @@ def lazy_import(module_name: str):
     return importlib.import_module(module_name)
 
 
-# Add these after the lazy_import function in your imports section
-_BCRYPT = None
-
-
-def get_bcrypt():
-    """Get bcrypt module with lazy loading and caching"""
-    global _BCRYPT
-    if _BCRYPT is None:
-        _BCRYPT = lazy_import("bcrypt")
-    return _BCRYPT
-
-
 # CACHED PANDAS IMPORT
 _PANDAS = None
 _OPENPYXL = None
@@ -123,6 +166,23 @@ def get_openpyxl():
     return _OPENPYXL
 
 
+_BROTLI = None
+
+
+def get_brotli():
+    """brotli (or brotlicffi) if installed, else None"""
+    global _BROTLI
+    if _BROTLI is None:
+        _BROTLI = False
+        for module_name in ("brotli", "brotlicffi"):
+            try:
+                _BROTLI = lazy_import(module_name)
+                break
+            except ImportError:
+                continue
+    return _BROTLI or None
+
+
 # Add Numpy caching to your imports section (after pandas caching)
 # NUMPY CACHING (not currently used, but available for future)
 _NUMPY = None
@@ -158,12 +218,36 @@ class ScoringConfig:
         "POOR": 0.0,
     }
 
+    @classmethod
+    def version(cls) -> str:
+        """Hash of the scoring parameters; pages rendered from them are cached under it"""
+        settings = [cls.BASE_SCORE, cls.MULTI_CERT_BONUS, cls.CERTIFICATION_BONUSES, cls.GRADE_THRESHOLDS]
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
 
 @dataclass
 class FileConfig:
     """Configuration for file paths"""
-    CERTIFICATION_EXCEL_FILE: ClassVar[str] = "comprehensive_grocery_certifications_COMPLETE.xlsx"  # CHANGED
+    CERTIFICATION_EXCEL_FILE: ClassVar[str] = os.getenv(
+        "CERTIFICATION_EXCEL_FILE", "comprehensive_grocery_certifications_COMPLETE.xlsx"
+    )  # CHANGED
     CREATE_EXCEL_SCRIPT: ClassVar[str] = "create_excel.py"
+    USER_DATABASE_FILE: ClassVar[str] = os.getenv("USER_DATABASE_FILE", "user_data.db")
+    PRODUCT_CACHE_FILE: ClassVar[str] = os.getenv("PRODUCT_CACHE_FILE", "product_cache.db")
+    # OFF data older than this is fetched again; past the row cap the oldest rows are evicted
+    PRODUCT_CACHE_MAX_AGE_SECONDS: ClassVar[float] = float(os.getenv("PRODUCT_CACHE_MAX_AGE_HOURS", "168")) * 3600
+    PRODUCT_CACHE_MAX_ROWS: ClassVar[int] = int(os.getenv("PRODUCT_CACHE_MAX_ROWS", "50000"))
+    # Brand counts per GS1 company prefix, learned from resolved barcodes
+    COMPANY_PREFIX_FILE: ClassVar[str] = os.getenv("COMPANY_PREFIX_FILE", "company_prefixes.db")
+    # Memory-mapped copy of the parsed workbook shared by all workers (POSIX only)
+    DATASET_SNAPSHOT_FILE: ClassVar[str] = os.getenv("DATASET_SNAPSHOT_FILE", ".certifications.snapshot")
+    SHARED_DATASET: ClassVar[bool] = (
+        os.name == "posix" and os.getenv("SHARED_DATASET", "1").lower() not in ("0", "false", "no")
+    )
+    DATASET_CHECK_SECONDS: ClassVar[float] = float(os.getenv("DATASET_CHECK_SECONDS", "5"))
+    # Admin record changes, applied on top of the workbook until compacted into it
+    DATASET_CHANGES_FILE: ClassVar[str] = os.getenv("DATASET_CHANGES_FILE", "dataset_changes.db")
+    DATASET_COMPACT_SECONDS: ClassVar[float] = float(os.getenv("DATASET_COMPACT_SECONDS", "3600"))  # 0 = off
     CERT_SOURCES: ClassVar[Dict[str, str]] = {
         "b_corp": "https://www.bcorporation.net/en-us/find-a-b-corp/",
         "fair_trade": "https://www.flocert.net/fairtrade-customer-search/",
@@ -207,6 +291,7 @@ def cache_result(func):
     """Cache expensive function results"""
     cache = {}
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         # Create a cache key from arguments
         key = str(args) + str(sorted(kwargs.items()))
@@ -216,6 +301,8 @@ def cache_result(func):
 
         return cache[key]
 
+    # The undecorated function stays reachable as wrapper.__wrapped__
+    wrapper.cache_clear = cache.clear
     return wrapper
 
 
@@ -254,16 +341,18 @@ def calculate_overall_score(
     """Calculate overall TBL score and grade"""
     overall = (social + environmental + economic) / 3
 
+    return {"overall_score": round(overall, 2), "grade": get_grade(overall)}
+
+
+def get_grade(overall: float) -> str:
+    """Map an overall TBL score to its grade"""
     if overall >= ScoringConfig.GRADE_THRESHOLDS["EXCELLENT"]:
-        grade = "EXCELLENT"
+        return "EXCELLENT"
     elif overall >= ScoringConfig.GRADE_THRESHOLDS["GREAT"]:
-        grade = "GREAT"
+        return "GREAT"
     elif overall >= ScoringConfig.GRADE_THRESHOLDS["GOOD"]:
-        grade = "GOOD"
-    else:
-        grade = "POOR"
-
-    return {"overall_score": round(overall, 2), "grade": grade}
+        return "GOOD"
+    return "POOR"
 
 
 # ==================== FASTAPI APP ====================
@@ -351,6 +440,20 @@ class ProductSearch(BaseModel):
     max_results: int = 10
 
 
+class CertificationRecordChange(BaseModel):
+    """Upsert of one (brand, category) record; unset flags keep their value"""
+
+    brand: str
+    category: str = ""
+    original_brand: Optional[str] = None
+    b_corp: Optional[bool] = None
+    fair_trade: Optional[bool] = None
+    rainforest_alliance: Optional[bool] = None
+    leaping_bunny: Optional[bool] = None
+    research_complete: Optional[bool] = None
+    columns: Dict[str, Any] = {}
+
+
 # ==================== BRAND NORMALIZER ====================
 
 
@@ -1096,7 +1199,7 @@ class BrandNormalizer:
                         if brand_normalized in product_lower:
                             # Get the original brand name from Excel data
                             first_product = next(iter(certification_manager.data[brand].values()))
-                            original_brand = first_product.get("original_brand", brand.title())
+                            original_brand = first_product.original_brand
                             logger.info(
                                 f"Found brand '{original_brand}' directly in product name '{product_name}'"
                             )
@@ -1107,7 +1210,7 @@ class BrandNormalizer:
                             for variation in cls.BRAND_VARIATIONS[brand]:
                                 if variation in product_lower:
                                     first_product = next(iter(certification_manager.data[brand].values()))
-                                    original_brand = first_product.get("original_brand", brand.title())
+                                    original_brand = first_product.original_brand
                                     logger.info(
                                         f"Found brand variation '{variation}' for '{brand}' in product name"
                                     )
@@ -1125,7 +1228,7 @@ class BrandNormalizer:
                         brand_normalized = brand  # Already normalized from Excel
                         if brand_normalized == first_word or brand_normalized.startswith(first_word):
                             first_product = next(iter(certification_manager.data[brand].values()))
-                            original_brand = first_product.get("original_brand", brand.title())
+                            original_brand = first_product.original_brand
                             logger.info(
                                 f"Extracted brand '{original_brand}' from first word of product name"
                             )
@@ -1138,7 +1241,7 @@ class BrandNormalizer:
                         brand_normalized = brand  # Already normalized from Excel
                         if brand_normalized == first_two_words or brand_normalized.startswith(first_two_words):
                             first_product = next(iter(certification_manager.data[brand].values()))
-                            original_brand = first_product.get("original_brand", brand.title())
+                            original_brand = first_product.original_brand
                             logger.info(
                                 f"Extracted brand '{original_brand}' from first two words of product name"
                             )
@@ -1147,1493 +1250,6025 @@ class BrandNormalizer:
             return None
 
 
-class CertificationManager:
-    """Manage all certification-related operations"""
+# ==================== CERTIFICATION RECORDS ====================
+# One record per (brand, category) row of the workbook. The five yes/no
+# columns are packed into a single int, brand/category strings are interned
+# (categories repeat thousands of times), and the raw spreadsheet row lives
+# once in a shared column table that is only read when details are needed.
 
-    def __init__(self):
-        self.data = None
-        self.brand_categories = None  # NEW: Track categories per brand
-        self.last_loaded = None
-        self._lock = threading.Lock()
 
-    def load_certification_data(self) -> bool:
-        """Load certification data from Excel file and build category index"""
-        try:
-            if os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE):
-                logger.info(
-                    f"Loading certification data from {FileConfig.CERTIFICATION_EXCEL_FILE}"
-                )
+CERTIFICATION_FLAGS: Dict[str, int] = {
+    "b_corp": 1,
+    "fair_trade": 2,
+    "rainforest_alliance": 4,
+    "leaping_bunny": 8,
+    "research_complete": 16,
+}
 
-                # First get pandas, then use it
-                pd = get_pandas()
-                df = pd.read_excel(FileConfig.CERTIFICATION_EXCEL_FILE)
-                logger.info(f"Excel file loaded. Columns: {list(df.columns)}")
 
-                cert_data = {}
-                brand_categories = {}  # NEW: Track categories per brand
+class RowTable:
+    """
+    Column-oriented copy of the raw workbook rows.
 
-                for _, row in df.iterrows():
-                    # Use "Product_Brand" column from new file
-                    brand = None
-                    if "Product_Brand" in df.columns:
-                        brand_value = row.get("Product_Brand")
-                        if not pd.isna(brand_value):
-                            brand = str(brand_value).strip()
+    Every column is dictionary-encoded: a small-int code array (numpy) plus
+    the list of distinct values, so repeated categories, flags and dates
+    cost one or two bytes per row instead of one Python object each.
+    """
 
-                    if not brand:
-                        continue
+    __slots__ = ("columns", "_codes", "_uniques", "_missing", "_row_count", "_json_uniques", "_json_missing")
 
-                    brand_normalized = BrandNormalizer.normalize(brand)
-
-                    # NEW: Get category for this row
-                    category = ""
-                    if "Category" in df.columns:
-                        category_value = row.get("Category")
-                        if not pd.isna(category_value):
-                            category = str(category_value).strip()
-
-                    # NEW: Track categories for this brand
-                    if brand_normalized not in brand_categories:
-                        brand_categories[brand_normalized] = set()
-                    if category:
-                        brand_categories[brand_normalized].add(category)
-
-                    # Get certifications with exact column names
-                    certifications = self._extract_certifications(
-                        row, df.columns)
-
-                    # Store brand data with category as secondary key (store all products)
-                    if brand_normalized not in cert_data:
-                        cert_data[brand_normalized] = {}
-
-                    # Use category as the key to store product-specific data
-                    product_key = category if category else "_default"
-
-                    # Store this product's data
-                    cert_data[brand_normalized][product_key] = {
-                        "original_brand": brand,
-                        "certifications": certifications,
-                        "research_complete": certifications.get("research_complete", False),
-                        "row_data": row.to_dict(),
-                        "category": category,  # Store category for reference
-                    }
+    def __init__(self, columns, codes, uniques, missing, row_count: int):
+        self.columns = tuple(columns)
+        self._codes = codes
+        self._uniques = uniques
+        self._missing = missing
+        self._row_count = row_count
+        # JSON-safe copies of the distinct values, sanitized once here
+        # instead of on every response that shows a row
+        self._json_uniques = {col: [sanitize_for_json(v) for v in values] for col, values in uniques.items()}
+        self._json_missing = {col: sanitize_for_json(value) for col, value in missing.items()}
 
-                self.data = cert_data
-                self.brand_categories = brand_categories
-                self.last_loaded = datetime.now()
+    @classmethod
+    def from_dataframe(cls, df) -> "RowTable":
+        pd = get_pandas()
+        np = get_numpy()
+        columns, codes, uniques, missing = [], {}, {}, {}
+
+        for col in df.columns:
+            name = str(col)
+            col_codes, col_uniques = pd.factorize(df[col], use_na_sentinel=True)
+            # Smallest signed int that fits the number of distinct values
+            dtype = np.int8 if len(col_uniques) < 2 ** 7 else (
+                np.int16 if len(col_uniques) < 2 ** 15 else np.int32
+            )
+            columns.append(name)
+            codes[name] = col_codes.astype(dtype)
+            uniques[name] = [
+                sys.intern(v) if isinstance(v, str) else v for v in col_uniques.tolist()
+            ]
+            missing[name] = pd.NaT if pd.api.types.is_datetime64_any_dtype(df[col]) else float("nan")
 
-                logger.info(f"Loaded {len(cert_data)} certification records")
-                logger.info(f"Loaded category index for {len(brand_categories)} brands")
+        return cls(columns, codes, uniques, missing, len(df))
 
-                # Log some sample data for debugging
-                sample_brands = list(cert_data.keys())[:3]
-                for brand in sample_brands:
-                    first_product = next(iter(cert_data[brand].values()))
-                    logger.info(
-                        f"Sample brand '{brand}': certs={first_product.get('certifications', {})}, categories={brand_categories.get(brand, set())}"
-                    )
+    def __len__(self) -> int:
+        return self._row_count
 
-                # ✅ ADD THIS: Verify data is ready
-                if self.data is not None and len(self.data) > 0:
-                    logger.info(f"✅ Data verification: {len(self.data)} records ready")
-                    return True
-                else:
-                    logger.warning("⚠️ Data appears empty, retrying...")
-                    time.sleep(1)
-                    return self.load_certification_data()
-            else:
-                logger.warning(
-                    f"Certification Excel file {FileConfig.CERTIFICATION_EXCEL_FILE} not found"
-                )
-                return False
-        except Exception as e:
-            logger.error(f"Error loading certification data: {e}")
-            import traceback
+    def get_row(self, index: int) -> Dict[str, Any]:
+        row = {}
+        for col in self.columns:
+            code = int(self._codes[col][index])
+            row[col] = self._uniques[col][code] if code >= 0 else self._missing[col]
+        return row
 
-            logger.error(traceback.format_exc())
-            return False
+    def get_json_row(self, index: int) -> Dict[str, Any]:
+        """get_row() with JSON-safe values (what sanitize_for_json would give)"""
+        row = {}
+        for col in self.columns:
+            code = int(self._codes[col][index])
+            row[col] = self._json_uniques[col][code] if code >= 0 else self._json_missing[col]
+        return row
 
-    def _extract_certifications(self, row, columns) -> Dict[str, bool]:
-        """Extract certifications from a row"""
-        cert_mapping = {
-            "b_corp": ["B_Corp", "B Corp", "b_corp", "B Corp Certification", "bcorp"],
-            "fair_trade": [
-                "Fair_Trade",
-                "Fair Trade",
-                "fair_trade",
-                "Fair Trade Certified",
-                "fairtrade",
-            ],
-            "rainforest_alliance": [
-                "Rainforest_Alliance",
-                "Rainforest Alliance",
-                "rainforest_alliance",
-                "Rainforest Alliance Certified",
-                "rainforest",
-            ],
-            "leaping_bunny": [
-                "Leaping_Bunny",
-                "Leaping Bunny",
-                "leaping_bunny",
-                "Cruelty Free",
-                "leapingbunny",
-            ],
-            "research_complete": [
-                "Research_Complete",
-                "Research Complete",
-                "research_complete",
-                "Research Done",
-                "research_done",
-            ],
-        }
+    def column_values(self, col: str) -> List[Any]:
+        """Every row's value in one column"""
+        uniques, missing = self._uniques[col], self._missing[col]
+        return [uniques[code] if code >= 0 else missing for code in self._codes[col].tolist()]
 
-        pd = get_pandas()
 
-        # ===== ADD DEBUGGING =====
-        logger.info(f"🔍 DEBUG: Columns in Excel: {columns}")
-        # Log the specific columns we care about
-        for cert_type, possible_names in cert_mapping.items():
-            for col_name in possible_names:
-                if col_name in columns:
-                    logger.info(f"🔍 DEBUG: Found column '{col_name}' for '{cert_type}'")
-                    cell_value = row.get(col_name)
-                    logger.info(f"🔍 DEBUG: Value for '{col_name}': {cell_value}, type: {type(cell_value)}")
-        # ===== END DEBUGGING =====
+class CertificationRecord:
+    """Immutable certification data for one brand + category"""
 
-        certifications = {}
-        for cert_type, possible_names in cert_mapping.items():
-            value = False
-            for col_name in possible_names:
-                if col_name in columns:
-                    cell_value = row.get(col_name)
-                    logger.info(f"Checking {cert_type} in column '{col_name}': cell_value={cell_value}, type={type(cell_value)}")
-                    if pd.isna(cell_value):
-                        value = False
-                    elif isinstance(cell_value, bool):
-                        value = cell_value
-                        logger.info(f"✅ {cert_type} is boolean: {value}")
-                    elif isinstance(cell_value, (int, float)):
-                        value = bool(cell_value)
-                        logger.info(f"✅ {cert_type} is number: {value}")
-                    elif isinstance(cell_value, str):
-                        cell_value_lower = cell_value.strip().lower()
-                        if cell_value_lower in ["true", "yes", "y", "1", "t"]:
-                            value = True
-                        elif cell_value_lower in ["false", "no", "n", "0", "f"]:
-                            value = False
-                        logger.info(f"✅ {cert_type} is string: {value}")
-                    break
-            certifications[cert_type] = value
+    __slots__ = ("original_brand", "category", "flags", "row_index", "_rows")
 
-        logger.info(f"🔍 DEBUG: Extracted certifications: {certifications}")
-        return certifications
+    def __init__(self, original_brand: str, category: str, flags: int, row_index: int, rows: RowTable):
+        object.__setattr__(self, "original_brand", sys.intern(original_brand))
+        object.__setattr__(self, "category", sys.intern(category))
+        object.__setattr__(self, "flags", flags)
+        object.__setattr__(self, "row_index", row_index)
+        object.__setattr__(self, "_rows", rows)
 
-    def _get_brand_categories(self, brand_normalized: str) -> List[str]:
-        """Get all categories a brand appears in"""
-        categories = set()
+    def __setattr__(self, name, value):
+        raise AttributeError("CertificationRecord is immutable")
 
-        # Check exact match
-        if brand_normalized in self.data:
-            for product_key, product_data in self.data[brand_normalized].items():
-                if product_key != "_default":
-                    categories.add(product_key)
+    @staticmethod
+    def pack_flags(certifications: Dict[str, bool]) -> int:
+        flags = 0
+        for name, bit in CERTIFICATION_FLAGS.items():
+            if certifications.get(name):
+                flags |= bit
+        return flags
+
+    def has(self, certification: str) -> bool:
+        return bool(self.flags & CERTIFICATION_FLAGS[certification])
+
+    @property
+    def certifications(self) -> Dict[str, bool]:
+        return {name: bool(self.flags & bit) for name, bit in CERTIFICATION_FLAGS.items()}
+
+    @property
+    def research_complete(self) -> bool:
+        return self.has("research_complete")
+
+    @property
+    def row_data(self) -> Dict[str, Any]:
+        """Raw spreadsheet row (built on demand from the shared column table)"""
+        if self._rows is None or self.row_index < 0:
+            return {}
+        return self._rows.get_row(self.row_index)
+
+    @property
+    def json_row_data(self) -> Dict[str, Any]:
+        """Raw spreadsheet row with JSON-safe values (NaN -> 0.0, dates -> str)"""
+        if self._rows is None or self.row_index < 0:
+            return {}
+        return self._rows.get_json_row(self.row_index)
+
+    def to_dict(self, include_row_data: bool = True) -> Dict[str, Any]:
+        result = {
+            "original_brand": self.original_brand,
+            "certifications": self.certifications,
+            "research_complete": self.research_complete,
+            "category": self.category,
+        }
+        if include_row_data:
+            result["row_data"] = self.json_row_data
+        return result
 
-        # Also check partial matches
-        for stored_brand, products in self.data.items():
-            if stored_brand != brand_normalized and self._improved_partial_match(brand_normalized, stored_brand):
-                for product_key, product_data in products.items():
-                    if product_key != "_default":
-                        categories.add(product_key)
+    def __repr__(self) -> str:
+        return f"CertificationRecord({self.original_brand!r}, {self.category!r}, flags={self.flags:#07b})"
 
-        return sorted(list(categories))
 
-    def _find_exact_brand_category_match(self, brand_normalized: str, category: str) -> Optional[Dict]:
-        """Find exact brand + category match in stored data"""
-        category_normalized = category.strip().lower()
+# ==================== SHARED DATASET SNAPSHOT ====================
+# The certification index never changes between reloads, so rather than each
+# gunicorn worker parsing the workbook into its own Python objects, one worker
+# writes it out as a flat snapshot file (fixed-width arrays + a string table)
+# and every worker mmaps that file. The OS page cache then holds a single
+# physical copy however many workers run; records are materialized on access.
+#
+# File layout: 8-byte magic, 8-byte header length, JSON header, then 8-byte
+# aligned array sections whose offset/dtype/shape are listed in the header.
 
-        # Check exact brand match
-        if brand_normalized in self.data:
-            # Look for exact category match in this brand's products
-            for product_key, product_data in self.data[brand_normalized].items():
-                if product_key.lower() == category_normalized:
-                    return product_data
 
-        # Check partial brand matches
-        for stored_brand, products in self.data.items():
-            if self._improved_partial_match(brand_normalized, stored_brand):
-                for product_key, product_data in products.items():
-                    if product_key.lower() == category_normalized:
-                        return product_data
+SNAPSHOT_MAGIC = b"TBLSNAP2"
 
-        return None
+# Tags for the raw-cell value table
+(
+    CELL_NAN,
+    CELL_NONE,
+    CELL_NAT,
+    CELL_STR,
+    CELL_BOOL,
+    CELL_INT,
+    CELL_FLOAT,
+    CELL_TIMESTAMP,
+    CELL_DATETIME,
+) = range(9)
 
-    def _find_best_category_match(self, brand_normalized: str, category: str) -> Optional[Dict]:
-        """Find best category match for barcode scans when exact match fails"""
-        category_lower = category.strip().lower()
-        best_match = None
-        best_score = 0
-        match_confidence = "low"  # Track confidence level
 
-        # Check exact brand match (HIGHEST CONFIDENCE)
-        if brand_normalized in self.data:
-            match_confidence = "high"
-            for product_key, product_data in self.data[brand_normalized].items():
-                if product_key == "_default":
-                    continue
+class SnapshotWriter:
+    """Collect arrays and strings, then write them as one snapshot file"""
 
-                product_key_lower = product_key.lower()
-                if category_lower in product_key_lower or product_key_lower in category_lower:
-                    score = len(category_lower) if category_lower in product_key_lower else len(product_key_lower)
-                    if score > best_score:
-                        best_score = score
-                        best_match = product_data
-                        logger.info(f"Found exact brand category match: '{category}' → '{product_key}'")
+    def __init__(self):
+        self._string_ids: Dict[str, int] = {}
+        self._strings: List[bytes] = []
+        self._sections: Dict[str, Any] = {}
+
+    def sid(self, value: str) -> int:
+        """Id of a string in the string table (added on first use)"""
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = len(self._strings)
+            self._string_ids[value] = sid
+            self._strings.append(value.encode("utf-8"))
+        return sid
+
+    def add(self, name: str, array):
+        self._sections[name] = get_numpy().ascontiguousarray(array)
+
+    def write(self, path: str, meta: Dict[str, Any]):
+        np = get_numpy()
+        offsets = np.zeros(len(self._strings) + 1, dtype=np.uint64)
+        if self._strings:
+            np.cumsum([len(s) for s in self._strings], out=offsets[1:])
+        self.add("string_offsets", offsets)
+        self.add("string_blob", np.frombuffer(b"".join(self._strings), dtype=np.uint8))
+
+        sections, position = {}, 0
+        for name, array in self._sections.items():
+            sections[name] = [position, array.dtype.str, list(array.shape)]
+            position += array.nbytes + (-array.nbytes % 8)
+
+        header = json.dumps({**meta, "sections": sections}).encode("utf-8")
+        header += b" " * (-(len(header) + 16) % 8)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for array in self._sections.values():
+                f.write(array.tobytes())
+                f.write(b"\0" * (-array.nbytes % 8))
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers keep their old mapping until they notice the new inode
+        os.replace(tmp_path, path)
+
+
+def write_dataset_snapshot(path: str, cert_data: Dict, row_table: RowTable, source: str, version: str):
+    """Serialize a built certification index (see build_certification_index)"""
+    np = get_numpy()
+    pd = get_pandas()
+    writer = SnapshotWriter()
+
+    brand_keys = list(cert_data.keys())
+    brand_key_sid = np.empty(len(brand_keys), dtype=np.uint32)
+    brand_start = np.empty(len(brand_keys), dtype=np.uint32)
+    brand_count = np.empty(len(brand_keys), dtype=np.uint32)
+
+    product_key_sid, original_brand_sid, category_sid, flags, row_index = [], [], [], [], []
+    for i, brand in enumerate(brand_keys):
+        products = cert_data[brand]
+        brand_key_sid[i] = writer.sid(brand)
+        brand_start[i] = len(product_key_sid)
+        brand_count[i] = len(products)
+        for product_key, record in products.items():
+            product_key_sid.append(writer.sid(product_key))
+            original_brand_sid.append(writer.sid(record.original_brand))
+            category_sid.append(writer.sid(record.category))
+            flags.append(record.flags)
+            row_index.append(record.row_index)
+
+    # Brands stay in workbook order (first partial match wins); this
+    # permutation gives the sorted order used for exact lookups.
+    sorted_brands = np.array(sorted(range(len(brand_keys)), key=brand_keys.__getitem__), dtype=np.uint32)
+
+    writer.add("brand_key_sid", brand_key_sid)
+    writer.add("brand_start", brand_start)
+    writer.add("brand_count", brand_count)
+    writer.add("sorted_brands", sorted_brands)
+    writer.add("product_key_sid", np.array(product_key_sid, dtype=np.uint32))
+    writer.add("original_brand_sid", np.array(original_brand_sid, dtype=np.uint32))
+    writer.add("category_sid", np.array(category_sid, dtype=np.uint32))
+    writer.add("flags", np.array(flags, dtype=np.uint8))
+    writer.add("row_index", np.array(row_index, dtype=np.int32))
+
+    # Raw rows: one table of distinct cell values, and per column a vector of
+    # value ids (the RowTable codes remapped; code -1 maps to the column's
+    # missing value, which is appended last to each lookup).
+    value_ids: Dict[Any, int] = {}
+    value_tags, value_ints, value_floats = [], [], []
+
+    def value_id(value) -> int:
+        if value is None:
+            key = (CELL_NONE, 0, 0.0)
+        elif value is pd.NaT:
+            key = (CELL_NAT, 0, 0.0)
+        elif isinstance(value, str):
+            key = (CELL_STR, writer.sid(value), 0.0)
+        elif isinstance(value, (bool, np.bool_)):
+            key = (CELL_BOOL, int(value), 0.0)
+        elif isinstance(value, (int, np.integer)):
+            key = (CELL_INT, int(value), 0.0)
+        elif isinstance(value, (float, np.floating)):
+            key = (CELL_NAN, 0, 0.0) if math.isnan(value) else (CELL_FLOAT, 0, float(value))
+        elif isinstance(value, pd.Timestamp):
+            key = (CELL_TIMESTAMP, value.value, 0.0)
+        elif isinstance(value, datetime) and value.tzinfo is None:
+            key = (CELL_DATETIME, pd.Timestamp(value).value, 0.0)
+        else:
+            key = (CELL_STR, writer.sid(str(value)), 0.0)
+        vid = value_ids.get(key)
+        if vid is None:
+            vid = len(value_tags)
+            value_ids[key] = vid
+            value_tags.append(key[0])
+            value_ints.append(key[1])
+            value_floats.append(key[2])
+        return vid
+
+    cells = np.empty((len(row_table.columns), len(row_table)), dtype=np.int32)
+    for c, col in enumerate(row_table.columns):
+        lookup = [value_id(v) for v in row_table._uniques[col]]
+        lookup.append(value_id(row_table._missing[col]))
+        cells[c] = np.array(lookup, dtype=np.int32)[row_table._codes[col]]
+
+    writer.add("cells", cells)
+    writer.add("value_tags", np.array(value_tags, dtype=np.uint8))
+    writer.add("value_ints", np.array(value_ints, dtype=np.int64))
+    writer.add("value_floats", np.array(value_floats, dtype=np.float64))
+
+    writer.write(path, {"source": source, "version": version, "columns": list(row_table.columns)})
+
+
+class SnapshotStrings:
+    """Read-only view of the snapshot string table"""
+
+    __slots__ = ("_blob", "_offsets")
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, sid: int) -> str:
+        return str(self._blob[int(self._offsets[sid]):int(self._offsets[sid + 1])], "utf-8")
+
+
+class SharedRowTable:
+    """RowTable interface over the snapshot's cell value ids"""
+
+    __slots__ = ("columns", "_snapshot")
+
+    def __init__(self, snapshot: "DatasetSnapshot"):
+        self.columns = tuple(snapshot.columns)
+        self._snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self._snapshot.cells.shape[1]
+
+    def _value(self, vid: int):
+        snapshot = self._snapshot
+        tag = snapshot.value_tags[vid]
+        if tag == CELL_STR:
+            return snapshot.strings[snapshot.value_ints[vid]]
+        if tag == CELL_NAN:
+            return float("nan")
+        if tag == CELL_BOOL:
+            return bool(snapshot.value_ints[vid])
+        if tag == CELL_INT:
+            return int(snapshot.value_ints[vid])
+        if tag == CELL_FLOAT:
+            return float(snapshot.value_floats[vid])
+        if tag == CELL_TIMESTAMP:
+            return get_pandas().Timestamp(int(snapshot.value_ints[vid]))
+        if tag == CELL_DATETIME:
+            return get_pandas().Timestamp(int(snapshot.value_ints[vid])).to_pydatetime()
+        if tag == CELL_NAT:
+            return get_pandas().NaT
+        return None
 
-        # Check partial brand matches (LOWER CONFIDENCE - ONLY if exact brand not found)
-        if not best_match:
-            for stored_brand, products in self.data.items():
-                if self._improved_partial_match(brand_normalized, stored_brand):
-                    # Check if this is a high-confidence partial match (2+ words)
-                    search_words = set(brand_normalized.split())
-                    stored_words = set(stored_brand.split())
-                    common_words = search_words & stored_words
-                    meaningful_common = [w for w in common_words if w not in {
-                        "value", "brand", "store", "market", "everyday", "organic",
-                        "natural", "premium", "select", "choice", "essential",
-                        "basic", "original", "classic", "traditional", "regular",
-                        "quality", "fresh", "pure", "simple", "smart", "total",
-                        "complete", "farm", "food", "house", "good", "great"
-                    }]
+    def _json_value(self, vid: int):
+        """sanitize_for_json(self._value(vid)), decided from the tag"""
+        tag = self._snapshot.value_tags[vid]
+        if tag == CELL_NAN:
+            return 0.0
+        if tag == CELL_FLOAT:
+            return safe_float(self._snapshot.value_floats[vid])
+        if tag == CELL_NAT:
+            return "NaT"
+        if tag in (CELL_TIMESTAMP, CELL_DATETIME):
+            return str(self._value(vid))
+        return self._value(vid)
 
-                    # Only use partial match if at least 2 meaningful words match
-                    if len(meaningful_common) >= 2:
-                        match_confidence = "medium"
-                    else:
-                        # Single word match - only use if it's a distinctive word
-                        distinctive_words = {
-                            "nestle", "unilever", "pepsico", "coca", "cola",
-                            "mars", "hershey", "kellogg", "danone", "campbell",
-                            "pepperidge", "smucker", "quaker", "kraft", "heinz"
-                        }
-                        if meaningful_common and meaningful_common[0] in distinctive_words:
-                            match_confidence = "medium"
-                        else:
-                            match_confidence = "low"
-                            continue  # Skip low-confidence partial matches
+    def get_row(self, index: int) -> Dict[str, Any]:
+        cells = self._snapshot.cells
+        return {col: self._value(int(cells[c, index])) for c, col in enumerate(self.columns)}
 
-                    for product_key, product_data in products.items():
-                        if product_key == "_default":
-                            continue
+    def get_json_row(self, index: int) -> Dict[str, Any]:
+        cells = self._snapshot.cells
+        return {col: self._json_value(int(cells[c, index])) for c, col in enumerate(self.columns)}
 
-                        product_key_lower = product_key.lower()
-                        if category_lower in product_key_lower or product_key_lower in category_lower:
-                            score = len(category_lower) if category_lower in product_key_lower else len(product_key_lower)
-                            if score > best_score:
-                                best_score = score
-                                best_match = product_data
-                                logger.info(f"Found partial category match via partial brand: '{category}' → '{product_key}'")
+    def column_values(self, col: str) -> List[Any]:
+        """Every row's value in one column"""
+        return [self._value(vid) for vid in self._snapshot.cells[self.columns.index(col)].tolist()]
 
-        # ===== SAFETY CHECK: Only return match if confidence is high enough =====
-        if best_match and match_confidence in ["high", "medium"]:
-            return best_match
 
-        # If match_confidence is "low", don't return anything (prevents false positives)
-        logger.info(f"Rejected low-confidence brand match for '{brand_normalized}' → category '{category}'")
-        return None
+class SharedProductMap(Mapping):
+    """category -> CertificationRecord for one brand, read from the snapshot"""
 
-    @staticmethod
-    def _improved_partial_match(search_brand: str, stored_brand: str) -> bool:
-        """Improved brand matching with hybrid approach to prevent generic word mismatches"""
+    __slots__ = ("_snapshot", "_brand_id")
 
-        # ===== DEFINED AT TOP (available everywhere) =====
-        distinctive_words = {
-            "nespresso", "dannon", "activia", "oikos", "evian",
-            "volvic", "starbucks", "cadbury", "dunkin", "hershey",
-            "coca", "cola", "pepsi", "kraft", "heinz", "general",
-            "mills", "kellogg", "mondelez", "unilever", "procter",
-            "gamble", "johnson", "campbell", "tyson", "hormel",
-            "danone", "nestle", "mars", "pepperidge", "smucker",
-            "quaker", "kroger", "safeway", "traders", "joes"
-        }
+    def __init__(self, snapshot: "DatasetSnapshot", brand_id: int):
+        # Created for every brand the matchers walk past, so keep it cheap
+        self._snapshot = snapshot
+        self._brand_id = brand_id
 
-        # Generic words that shouldn't trigger matches alone
-        GENERIC_WORDS = {
-            "value", "brand", "store", "market", "everyday", "organic",
-            "natural", "premium", "select", "choice", "essential",
-            "basic", "original", "classic", "traditional", "regular",
-            "quality", "fresh", "pure", "simple", "smart", "total",
-            "complete", "farm", "food", "house", "good", "great",
-            "best", "finest", "fresh", "home", "family", "country",
-            "american", "old", "new", "world", "nature", "harvest"
-        }
+    def _range(self) -> range:
+        start = int(self._snapshot.brand_start[self._brand_id])
+        return range(start, start + int(self._snapshot.brand_count[self._brand_id]))
 
-        # ===== STEP 1: EXACT MATCH =====
-        if search_brand == stored_brand:
-            return True
+    def __len__(self) -> int:
+        return int(self._snapshot.brand_count[self._brand_id])
 
-        # ===== STEP 2: SUBSTRING CHECK WITH SAFEGUARDS =====
-        if stored_brand in search_brand or search_brand in stored_brand:
-            # Split into words
-            search_words = set(search_brand.split())
-            stored_words = set(stored_brand.split())
-            common_words = search_words & stored_words
+    def __iter__(self):
+        snapshot = self._snapshot
+        for i in self._range():
+            yield snapshot.strings[snapshot.product_key_sid[i]]
 
-            # Remove generic words from consideration
-            meaningful_common = [w for w in common_words if w not in GENERIC_WORDS]
+    def __getitem__(self, product_key: str) -> CertificationRecord:
+        snapshot = self._snapshot
+        for i in self._range():
+            if snapshot.strings[snapshot.product_key_sid[i]] == product_key:
+                return snapshot.record(i)
+        raise KeyError(product_key)
 
-            # Rule 1: At least 2 meaningful words match - SAFE
-            if len(meaningful_common) >= 2:
-                return True
+    def items(self):
+        return _SnapshotItems(self, self._record_items)
 
-            # Rule 2: Single meaningful word match - require it to be distinctive
-            if len(meaningful_common) == 1:
-                word = next(iter(meaningful_common))
+    def _record_items(self):
+        snapshot = self._snapshot
+        for i in self._range():
+            yield snapshot.strings[snapshot.product_key_sid[i]], snapshot.record(i)
 
-                # Reject if word is short and generic
-                if len(word) < 5 and word not in distinctive_words:
-                    return False
+    def values(self):
+        return [record for _, record in self._record_items()]
 
-                if word in distinctive_words:
-                    return True
 
-                # For single-word brands, use similarity with high threshold
-                if len(search_words) == 1 and len(stored_words) == 1:
-                    similarity = SequenceMatcher(None, search_brand, stored_brand).ratio()
-                    return similarity >= 0.85
+class SharedBrandIndex(Mapping):
+    """normalized brand -> SharedProductMap, in workbook order"""
 
-            # Substring match with only generic words = NO MATCH
-            return False
+    __slots__ = ("_snapshot",)
 
-        # ===== STEP 3: WORD OVERLAP CHECK =====
-        search_words = set(search_brand.split())
-        stored_words = set(stored_brand.split())
-        common_words = search_words & stored_words
-        meaningful_common = [w for w in common_words if w not in GENERIC_WORDS]
+    def __init__(self, snapshot: "DatasetSnapshot"):
+        self._snapshot = snapshot
+
+    def __len__(self) -> int:
+        return len(self._snapshot.brand_keys)
 
-        # Rule 3: At least 2 meaningful words overlap - SAFE
-        if len(meaningful_common) >= 2:
-            return True
+    def __iter__(self):
+        return iter(self._snapshot.brand_keys)
+
+    def __contains__(self, brand) -> bool:
+        return self._snapshot.find_brand(brand) is not None
+
+    def __getitem__(self, brand: str) -> SharedProductMap:
+        brand_id = self._snapshot.find_brand(brand)
+        if brand_id is None:
+            raise KeyError(brand)
+        return SharedProductMap(self._snapshot, brand_id)
+
+    def items(self):
+        return _SnapshotItems(self, self._brand_items)
+
+    def _brand_items(self):
+        snapshot = self._snapshot
+        for brand_id, brand in enumerate(snapshot.brand_keys):
+            yield brand, SharedProductMap(snapshot, brand_id)
+
+
+class SharedBrandCategories(Mapping):
+    """normalized brand -> set of workbook categories"""
+
+    __slots__ = ("_snapshot",)
+
+    def __init__(self, snapshot: "DatasetSnapshot"):
+        self._snapshot = snapshot
 
-        # Rule 4: Single meaningful word overlap - require distinctiveness
-        if len(meaningful_common) == 1:
-            word = meaningful_common[0]
+    def __len__(self) -> int:
+        return len(self._snapshot.brand_keys)
 
-            # Reject short/generic words
-            if len(word) < 4 and word not in {"coca", "cola", "pepsi", "mars"}:
-                return False
+    def __iter__(self):
+        return iter(self._snapshot.brand_keys)
 
-            # Get remaining words for fuzzy matching
-            search_remaining = [w for w in search_words if w not in GENERIC_WORDS and w != word]
-            stored_remaining = [w for w in stored_words if w not in GENERIC_WORDS and w != word]
+    def __contains__(self, brand) -> bool:
+        return self._snapshot.find_brand(brand) is not None
 
-            # If we have one word remaining in each, check similarity
-            if len(search_remaining) == 1 and len(stored_remaining) == 1:
-                word1 = search_remaining[0]
-                word2 = stored_remaining[0]
-                similarity = SequenceMatcher(None, word1, word2).ratio()
-                if similarity >= 0.75 and (len(word1) >= 4 or len(word2) >= 4):
-                    return True
+    def __getitem__(self, brand: str) -> Set[str]:
+        snapshot = self._snapshot
+        brand_id = snapshot.find_brand(brand)
+        if brand_id is None:
+            raise KeyError(brand)
+        start = int(snapshot.brand_start[brand_id])
+        stop = start + int(snapshot.brand_count[brand_id])
+        categories = (snapshot.strings[snapshot.category_sid[i]] for i in range(start, stop))
+        return {category for category in categories if category}
 
-            # Also check if one contains the other
-            if search_remaining and stored_remaining:
-                for s_word in search_remaining:
-                    for t_word in stored_remaining:
-                        if s_word in t_word or t_word in s_word:
-                            if len(s_word) >= 4 or len(t_word) >= 4:
-                                return True
 
-        # ===== STEP 4: SINGLE-WORD BRAND MATCH (STRICT) =====
-        if len(search_words) == 1 and len(stored_words) == 1:
-            word1 = search_brand
-            word2 = stored_brand
+class _SnapshotItems(ItemsView):
+    """items() view that walks the snapshot arrays directly"""
+
+    def __init__(self, mapping, iterate):
+        super().__init__(mapping)
+        self._iterate = iterate
+
+    def __iter__(self):
+        return self._iterate()
+
+
+class DatasetSnapshot:
+    """A mapped snapshot file; the arrays are views into the shared mapping"""
+
+    def __init__(self, path: str):
+        np = get_numpy()
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
 
-            # Exact single word match
-            if word1 == word2:
-                return True
+        if self._mmap[:8] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a dataset snapshot")
+        header_length = int.from_bytes(self._mmap[8:16], "little")
+        header = json.loads(self._mmap[16:16 + header_length])
+        self.source = header["source"]
+        self.version = header["version"]
+        self.columns = header["columns"]
 
-            # Similarity check with high threshold (85%)
-            similarity = SequenceMatcher(None, word1, word2).ratio()
-            if similarity >= 0.85:
-                return True
+        data_start = 16 + header_length
+        arrays = {}
+        for name, (offset, dtype, shape) in header["sections"].items():
+            count = int(np.prod(shape)) if shape else 1
+            arrays[name] = np.frombuffer(
+                self._mmap, dtype=np.dtype(dtype), count=count, offset=data_start + offset
+            ).reshape(shape)
 
-            # Also allow if the word is distinctive and matches partially
-            if word1 in distinctive_words or word2 in distinctive_words:
-                if word1 in word2 or word2 in word1:
-                    return True
+        self.brand_start = arrays["brand_start"]
+        self.brand_count = arrays["brand_count"]
+        self.sorted_brands = arrays["sorted_brands"]
+        self.product_key_sid = arrays["product_key_sid"]
+        self.original_brand_sid = arrays["original_brand_sid"]
+        self.category_sid = arrays["category_sid"]
+        self.flags = arrays["flags"]
+        self.row_index = arrays["row_index"]
+        self.cells = arrays["cells"]
+        self.value_tags = arrays["value_tags"]
+        self.value_ints = arrays["value_ints"]
+        self.value_floats = arrays["value_floats"]
+        self.strings = SnapshotStrings(memoryview(arrays["string_blob"]), arrays["string_offsets"])
+
+        # The only per-worker copy: brand keys as str, which the partial
+        # matchers scan on every request.
+        self.brand_keys = tuple(sys.intern(self.strings[sid]) for sid in arrays["brand_key_sid"].tolist())
+        self._sorted_keys = tuple(self.brand_keys[i] for i in self.sorted_brands.tolist())
+
+        self.rows = SharedRowTable(self)
+        self.data = SharedBrandIndex(self)
+        self.brand_categories = SharedBrandCategories(self)
+
+    def find_brand(self, brand) -> Optional[int]:
+        if not isinstance(brand, str):
+            return None
+        position = bisect_left(self._sorted_keys, brand)
+        if position < len(self._sorted_keys) and self._sorted_keys[position] == brand:
+            return int(self.sorted_brands[position])
+        return None
 
-            return False
+    def product_keys(self) -> Set[str]:
+        """Distinct category keys across all brands"""
+        np = get_numpy()
+        return {self.strings[sid] for sid in np.unique(self.product_key_sid).tolist()}
+
+    def record(self, i: int) -> CertificationRecord:
+        return CertificationRecord(
+            original_brand=self.strings[self.original_brand_sid[i]],
+            category=self.strings[self.category_sid[i]],
+            flags=int(self.flags[i]),
+            row_index=int(self.row_index[i]),
+            rows=self.rows,
+        )
 
-        # ===== NO MATCH =====
-        return False
 
-    def get_certifications(self, brand: str, category: str = None, source: str = "manual") -> Dict[str, Any]:
+class DatasetSnapshotStore:
+    """
+    Find, build and swap the shared snapshot of a workbook.
+
+    The snapshot records the workbook's size and mtime; when they no longer
+    match, the first worker to notice rebuilds it under an exclusive file
+    lock while the others wait, then everyone maps the new file.
+    """
+
+    def __init__(self, path: str, source_path: str):
+        self.path = path
+        self.source_path = source_path
+        self.current: Optional[DatasetSnapshot] = None
+
+    def source_signature(self) -> str:
+        stat = os.stat(self.source_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_stale(self, snapshot: Optional[DatasetSnapshot]) -> bool:
+        """Cheap check (two stats) for a rebuilt snapshot or a changed workbook"""
+        if snapshot is None:
+            return True
+        try:
+            stat = os.stat(self.path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            return identity != snapshot.identity or snapshot.source != self.source_signature()
+        except OSError:
+            return True
+
+    def _open(self, signature: str) -> Optional[DatasetSnapshot]:
+        if self.current is not None and not self.is_stale(self.current):
+            return self.current
+        if not os.path.exists(self.path):
+            return None
+        try:
+            snapshot = DatasetSnapshot(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable dataset snapshot {self.path}: {e}")
+            return None
+        return snapshot if snapshot.source == signature else None
+
+    @contextmanager
+    def _build_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, build) -> DatasetSnapshot:
         """
-        Get certifications for a brand from Excel data, filtered by category.
+        Map the snapshot for the current workbook, calling build() ->
+        (cert_data, row_table, version) to create it if no worker has yet.
+        """
+        signature = self.source_signature()
+        snapshot = self._open(signature)
+        if snapshot is None:
+            with self._build_lock():
+                snapshot = self._open(signature)  # another worker may have built it
+                if snapshot is None:
+                    cert_data, row_table, version = build()
+                    write_dataset_snapshot(self.path, cert_data, row_table, signature, version)
+                    logger.info(f"💾 Wrote shared dataset snapshot {self.path}")
+                    snapshot = DatasetSnapshot(self.path)
+        self.current = snapshot
+        return snapshot
+
+
+# ==================== CATEGORY TAXONOMY ====================
+# Workbook categories are OFF tags ("en:breakfast-cereals") while barcode
+# scans bring OFF's display text ("Breakfast cereals") and its tag hierarchy
+# ("en:plant-based-foods", ..., "en:coffees"). The taxonomy indexes the
+# workbook categories once per dataset load and memoizes how each OFF
+# category resolves against them, so matching a scan to a brand's categories
+# is a dict lookup per category key.
+
+
+class CategoryTaxonomy:
+    """
+    Resolve OFF categories to workbook categories.
+
+    resolve() returns {workbook category: score}; higher scores are better
+    matches. Scores are tuples ranked by tier:
+        3  substring match on the category as given (the original rule)
+        2  same canonical name as an element of the OFF hierarchy
+        1  shares distinctive words with an element of the OFF hierarchy
+    Within tiers 2 and 1, more specific hierarchy elements rank higher.
+    """
+
+    MAX_RESOLVED: ClassVar[int] = 4096
+    # Words too broad to link two categories on their own
+    GENERIC_TOKENS: ClassVar[frozenset] = frozenset({
+        "and", "or", "of", "with", "in", "the", "food", "product", "based",
+        "other", "plant", "item", "misc",
+    })
+    _LANGUAGE_PREFIX: ClassVar = re.compile(r"^[a-z]{2}:")
+    _SEPARATORS: ClassVar = re.compile(r"[^a-z0-9]+")
+
+    def __init__(self, categories):
+        self.categories = sorted({c for c in categories if c and c != "_default"})
+        self.by_name = {}      # canonical name -> workbook categories
+        self.token_index = {}  # distinctive token -> workbook categories
+        self._tokens = {}      # workbook category -> distinctive tokens
+        for category in self.categories:
+            tokens = self.tokenize(category)
+            self.by_name.setdefault(" ".join(tokens), []).append(category)
+            distinctive = frozenset(t for t in tokens if t not in self.GENERIC_TOKENS)
+            self._tokens[category] = distinctive
+            for token in distinctive:
+                self.token_index.setdefault(token, []).append(category)
+
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.unresolved = 0
+
+    @staticmethod
+    def singular(token: str) -> str:
+        if len(token) <= 3 or token.endswith("ss"):
+            return token
+        if token.endswith("ies"):
+            return token[:-3] + "y"
+        if token.endswith(("ches", "shes", "xes", "sses")):
+            return token[:-2]
+        if token.endswith("s"):
+            return token[:-1]
+        return token
+
+    @classmethod
+    def tokenize(cls, category: str) -> List[str]:
+        """'en:Breakfast-Cereals' -> ['breakfast', 'cereal']"""
+        text = cls._LANGUAGE_PREFIX.sub("", category.strip().lower())
+        return [cls.singular(t) for t in cls._SEPARATORS.split(text) if t]
+
+    def resolve(self, category: str, path=None) -> Dict[str, tuple]:
+        """
+        Score workbook categories against an OFF category.
 
         Args:
-            brand: Brand name to look up
-            category: Product category (required for multi-category brands unless source is "barcode")
-            source: "barcode" (OFF provided category) or "manual" (user selected)
+            category: The category text (most specific OFF category, or user input)
+            path: Optional OFF hierarchy, broadest first (categories_tags or
+                the split categories string)
         """
-        # ===== CHECK DATA WITH LOCK (prevents reload failures) =====
+        category_lower = (category or "").strip().lower()
+        key = (category_lower, tuple(path or ()))
         with self._lock:
-            need_load = (
-                self.data is None
-                or self.last_loaded is None
-                or (datetime.now() - self.last_loaded).seconds > 300
-            )
+            scores = self._resolved.get(key)
+            if scores is not None:
+                self.hits += 1
+                self._resolved.move_to_end(key)
+                return scores
+            self.misses += 1
 
-            if need_load:
-                logger.info("🔄 Loading/Reloading certification data...")
-                self.load_certification_data()
+        scores = self._score(category_lower, key[1])
 
-                if self.data is None:
-                    logger.error("❌ Data still None after load attempt")
-                    return self._get_default_response(
-                        found=False,
-                        match_type="data_not_loaded",
-                        note="Certification data is loading. Please try again in a moment."
-                    )
+        with self._lock:
+            if not scores:
+                self.unresolved += 1
+            self._resolved[key] = scores
+            if len(self._resolved) > self.MAX_RESOLVED:
+                self._resolved.popitem(last=False)
+        return scores
+
+    def _score(self, category_lower: str, path) -> Dict[str, tuple]:
+        scores = {}
+
+        # Tiers 1 and 2: the hierarchy, most specific element last
+        elements = [e for e in path if e and e.strip()]
+        if category_lower:
+            elements.append(category_lower)
+        for depth, element in enumerate(elements):
+            tokens = self.tokenize(element)
+            for match in self.by_name.get(" ".join(tokens), ()):
+                scores[match] = max(scores.get(match, ()), (2, depth))
+            distinctive = {t for t in tokens if t not in self.GENERIC_TOKENS}
+            for token in distinctive:
+                for match in self.token_index.get(token, ()):
+                    overlap = len(distinctive & self._tokens[match])
+                    scores[match] = max(scores.get(match, ()), (1, depth, overlap))
+
+        # Tier 3: substring either way, scored by the shorter string's length
+        if category_lower:
+            for match in self.categories:
+                match_lower = match.lower()
+                if category_lower in match_lower:
+                    scores[match] = (3, len(category_lower))
+                elif match_lower in category_lower:
+                    scores[match] = (3, len(match_lower))
+
+        return scores
+
+    def add(self, category: str):
+        """Index a category introduced by a dataset change (copy-on-write for readers)"""
+        if not category or category == "_default" or category in self._tokens:
+            return
+        tokens = self.tokenize(category)
+        distinctive = frozenset(t for t in tokens if t not in self.GENERIC_TOKENS)
+        with self._lock:
+            name = " ".join(tokens)
+            self.by_name[name] = self.by_name.get(name, []) + [category]
+            for token in distinctive:
+                self.token_index[token] = self.token_index.get(token, []) + [category]
+            self._tokens[category] = distinctive
+            self.categories = sorted(self.categories + [category])
+            self._resolved.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "workbook_categories": len(self.categories),
+            "resolved_categories": len(self._resolved),
+            "unresolved_categories": self.unresolved,
+            "lookups": lookups,
+            "cache_hits": self.hits,
+            "cache_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
 
-        if not brand or brand.lower() in ["unknown", "n/a", ""]:
-            logger.info("Empty brand requested, returning default certifications")
-            return self._get_default_response(found=False, match_type="no_brand")
 
-        brand_normalized = BrandNormalizer.normalize(brand)
-        logger.info(f"Looking for certifications for brand: '{brand_normalized}', category: '{category}', source: '{source}'")
+# ==================== DATASET VERSIONS ====================
+# Every load publishes one immutable DatasetVersion. Its version string is
+# a hash of the workbook bytes, so it is the same in every worker and only
+# changes when the content does. Readers take certification_manager.dataset
+# once and use that object throughout. A reload can then never mix two
+# workbooks in one response, and anything derived from the data can be
+# cached under the version.
 
-        # ===== STEP 1: Try exact brand + category match if category provided =====
-        if category and category.strip():
-            exact_match = self._find_exact_brand_category_match(brand_normalized, category)
-            if exact_match:
-                logger.info(f"Found exact match: brand='{brand_normalized}', category='{category}'")
-                return self._format_response(
-                    found=True,
-                    data=exact_match,
-                    search_brand=brand,
-                    match_type="exact_product"
-                )
 
-        # ===== STEP 2: Check if brand exists in our data =====
-        brand_exists = False
-        matched_brand = None
-        matched_products = None
+def workbook_version(content: bytes) -> str:
+    """Content hash identifying a workbook (and everything derived from it)"""
+    return hashlib.sha256(content).hexdigest()[:16]
 
-        # Check exact brand match
-        if brand_normalized in self.data:
-            brand_exists = True
-            matched_brand = brand_normalized
-            matched_products = self.data[brand_normalized]  # This is now a dict of products by category
-        else:
-            # Check partial brand match
-            for stored_brand, products in self.data.items():
-                if self._improved_partial_match(brand_normalized, stored_brand):
-                    brand_exists = True
-                    matched_brand = stored_brand
-                    matched_products = products
-                    break
 
-        if brand_exists and matched_products:
-            # Get categories this brand appears in
-            categories = [k for k in matched_products.keys() if k != "_default"]
-            is_single_category = len(categories) == 1
+@dataclass(frozen=True)
+class DatasetVersion:
+    """One loaded workbook: the brand index and its content hash"""
 
-            # Get the first product's category for single-category case
-            first_category = categories[0] if categories else None
-            first_product_data = matched_products.get(first_category) if first_category else matched_products.get("_default")
+    version: str
+    data: Mapping  # normalized brand -> category -> CertificationRecord
+    brand_categories: Mapping  # normalized brand -> set of categories
+    rows: Any  # RowTable or SharedRowTable
+    loaded_at: datetime
+    base_version: str = ""  # workbook hash when admin changes are applied on top
 
-            # CASE A: Single-category brand - safe to use brand-only match
-            if is_single_category:
-                single_category = categories[0]
-                product_data = matched_products[single_category]
-                logger.info(f"Brand '{matched_brand}' appears only in category '{single_category}' - using brand-only match")
-                return self._format_response(
-                    found=True,
-                    data=product_data,
-                    search_brand=brand,
-                    match_type="brand_only_single_category",
-                    matched_category=single_category,
-                    note=f"This brand only produces {single_category} products."
-                )
 
-            # CASE B: Barcode scan with category from OFF
-            elif source == "barcode" and category:
-                # Try to find best category match
-                best_match = self._find_best_category_match(brand_normalized, category)
-                if best_match:
-                    # Get the category from the matched product data
-                    best_category = best_match.get("category", "")
-                    if not best_category:
-                        # Fallback to row_data
-                        best_row_data = best_match.get("row_data", {})
-                        best_category = best_row_data.get("Category", "") if best_row_data else ""
+# ==================== DATASET CHANGES ====================
+# Admin edits to single (brand, category) records go to an append-only
+# change log in SQLite rather than into the workbook. Every worker applies
+# the log on top of the workbook it has loaded: the brand index becomes an
+# overlay that only wraps the changed brands, and the version string gains
+# the last applied sequence number so caches and ETags move on. Workers poll
+# the log's high-water mark, and compaction periodically writes the log back
+# into the workbook, which then becomes the new base.
 
-                    logger.info(f"Found category match for barcode: '{category}' → '{best_category}'")
-                    return self._format_response(
-                        found=True,
-                        data=best_match,
-                        search_brand=brand,
-                        match_type="barcode_category_match",
-                        matched_category=best_category,
-                        note=f"Matched to {best_category} category based on product information."
-                    )
-                else:
-                    # No category match found - return unknown
-                    logger.info(f"No category match for '{brand}' with category '{category}'")
-                    return self._get_default_response(
-                        found=False,
-                        match_type="no_category_match",
-                        note=f"Product category '{category}' not found in database for this brand."
-                    )
 
-            # CASE C: Manual search with category provided but not exact match
-            elif category and category.strip():
-                # Try partial category match
-                best_match = self._find_best_category_match(brand_normalized, category)
-                if best_match:
-                    # Get the category from the matched product data
-                    best_category = best_match.get("category", "")
-                    if not best_category:
-                        best_row_data = best_match.get("row_data", {})
-                        best_category = best_row_data.get("Category", "") if best_row_data else ""
+@dataclass(frozen=True)
+class DatasetChange:
+    """One change-log entry: an upsert or delete of a (brand, category) record"""
 
-                    logger.info(f"Found partial category match for manual search: '{category}' → '{best_category}'")
-                    return self._format_response(
-                        found=True,
-                        data=best_match,
-                        search_brand=brand,
-                        match_type="partial_category_match",
-                        matched_category=best_category,
-                        note=f"Best match found in {best_category} category. Please verify."
-                    )
-                else:
-                    # No match - require category selection
-                    return self._get_default_response(
-                        found=False,
-                        match_type="category_required",
-                        note=f"This brand makes multiple product types. Please select a category: {', '.join(categories)}"
-                    )
+    seq: int
+    op: str  # "upsert" | "delete"
+    brand: str
+    category: str
+    fields: Dict[str, Any]  # original_brand, certifications, columns
+    created_at: float
+    author: str = ""
 
-            # CASE D: Manual search without category for multi-category brand
-            else:
-                logger.info(f"Brand '{matched_brand}' appears in {len(categories)} categories. Category required.")
-                return self._get_default_response(
-                    found=False,
-                    match_type="category_required",
-                    note=f"This brand makes multiple product types. Please select a category: {', '.join(categories)}"
-                )
+    @property
+    def brand_key(self) -> str:
+        return sys.intern(BrandNormalizer.normalize(self.brand))
 
-        # ===== STEP 3: Check parent company =====
-        parent_company = BrandNormalizer.find_parent_company(brand)
-        if parent_company:
-            parent_normalized = BrandNormalizer.normalize(parent_company)
-            if parent_normalized in self.data:
-                logger.info(f"Using parent company '{parent_company}' for '{brand}'")
-                # For parent company, get the first product
-                parent_products = self.data[parent_normalized]
-                parent_categories = [k for k in parent_products.keys() if k != "_default"]
-                if parent_categories:
-                    parent_data = parent_products[parent_categories[0]]
-                else:
-                    parent_data = parent_products.get("_default")
+    @property
+    def product_key(self) -> str:
+        return sys.intern(self.category) if self.category else "_default"
 
-                if parent_data:
-                    return self._format_response(
-                        found=True,
-                        data=parent_data,
-                        search_brand=brand,
-                        match_type="parent_company",
-                        note=f"Using parent company '{parent_company}' certifications."
-                    )
+    @property
+    def original_brand(self) -> Optional[str]:
+        return self.fields.get("original_brand")
 
-        # ===== STEP 4: No match found =====
-        logger.info(f"No match found for brand: '{brand}' with category: '{category}'")
-        return self._get_default_response(
-            found=False,
-            match_type="no_match",
-            note="Brand not found in certification database."
-        )
+    @property
+    def certifications(self) -> Dict[str, bool]:
+        return self.fields.get("certifications") or {}
 
-    def _get_default_response(self, found: bool = False, match_type: str = "no_match", note: str = None) -> Dict[str, Any]:
-        """Get default certification response with match metadata"""
+    @property
+    def columns(self) -> Dict[str, Any]:
+        return self.fields.get("columns") or {}
+
+    def to_dict(self) -> Dict[str, Any]:
         return {
-            "found": found,
-            "match_type": match_type,
-            "note": note,
-            "certifications": {
-                "b_corp": False,
-                "fair_trade": False,
-                "rainforest_alliance": False,
-                "leaping_bunny": False,
-                "research_complete": False,
-            },
-            "details": None,
+            "seq": self.seq,
+            "op": self.op,
+            "brand": self.brand,
+            "category": self.category,
+            "fields": self.fields,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "author": self.author,
         }
 
-    def _format_response(
-        self,
-        found: bool,
-        data: Dict,
-        search_brand: str = None,
-        match_type: str = "exact_match",
-        matched_category: str = None,
-        note: str = None
-    ) -> Dict[str, Any]:
-        """Format certification response with match metadata"""
-        response = {
-            "found": found,
-            "match_type": match_type,
-            "note": note,
-            "certifications": data["certifications"],
-            "details": {
-                "original_brand": data["original_brand"],
-                "row_data": data.get("row_data", {}),
-            },
-        }
 
-        if matched_category:
-            response["matched_category"] = matched_category
+class DatasetChangeLog:
+    """
+    Durable, ordered log of record changes shared by all workers.
 
-        # If we found a match and the original brand differs from search, include canonical
-        if (
-            found
-            and search_brand
-            and data["original_brand"].lower() != search_brand.lower()
-        ):
-            response["canonical_brand"] = data["original_brand"]
-            response["search_brand_used"] = search_brand
+    ``bases`` remembers, per workbook version, the last change already
+    contained in that workbook, so a worker loading it knows which entries
+    still have to be applied on top.
+    """
 
-        return response
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                brand TEXT NOT NULL,
+                category TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                author TEXT NOT NULL DEFAULT ''
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bases (
+                workbook_version TEXT PRIMARY KEY,
+                through_seq INTEGER NOT NULL
+            )
+            """
+        )
 
-# ==================== SCORING MANAGER ====================
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def append(self, op: str, brand: str, category: str, fields: Dict[str, Any], author: str = "") -> DatasetChange:
+        created_at = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO changes (op, brand, category, fields, created_at, author) VALUES (?, ?, ?, ?, ?, ?)",
+            (op, brand, category, json.dumps(fields), created_at, author),
+        )
+        return DatasetChange(cursor.lastrowid, op, brand, category, fields, created_at, author)
+
+    def last_seq(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def since(self, seq: int) -> List[DatasetChange]:
+        rows = self._connect().execute(
+            "SELECT seq, op, brand, category, fields, created_at, author FROM changes WHERE seq > ? ORDER BY seq",
+            (seq,),
+        ).fetchall()
+        return [
+            DatasetChange(seq, op, brand, category, json.loads(fields), created_at, author)
+            for seq, op, brand, category, fields, created_at, author in rows
+        ]
 
-class ScoringManager:
-    """Manage all scoring-related operations"""
+    def base_seq(self, workbook: str) -> int:
+        """Last change contained in a workbook version (unknown workbooks: the latest compaction)"""
+        conn = self._connect()
+        row = conn.execute("SELECT through_seq FROM bases WHERE workbook_version = ?", (workbook,)).fetchone()
+        if row is not None:
+            return row[0]
+        return conn.execute("SELECT COALESCE(MAX(through_seq), 0) FROM bases").fetchone()[0]
+
+    def set_base(self, workbook: str, through_seq: int, replace: bool = True):
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        self._connect().execute(
+            f"{verb} INTO bases (workbook_version, through_seq) VALUES (?, ?)", (workbook, through_seq)
+        )
 
-    @staticmethod
-    def calculate_brand_scores(brand: str, category: str = None) -> BrandData:
-        """
-        Calculate scores for a brand using priority order:
-        1. Parent company identification (for product search)
-        2. Dynamic calculation from certifications (Excel)
-        """
-        # Handle empty/unknown brand
-        if not brand or brand == "Unknown":
-            return BrandData(
-                brand=brand,  # Add this line
-                social=safe_float(ScoringConfig.BASE_SCORE),
-                environmental=safe_float(ScoringConfig.BASE_SCORE),
-                economic=safe_float(ScoringConfig.BASE_SCORE),
-                certifications=[],
-                scoring_method="base_score_only",
-                notes="Base score of 5.0 (no brand identified)",
-            )
 
-        brand_normalized = BrandNormalizer.normalize(brand)
+class ChangedRow:
+    """Row source for a record that comes from the change log, not the workbook"""
 
-        # Step 1: Check if this is a product that should inherit parent company scores
-        parent_company = BrandNormalizer.find_parent_company(brand)
-        if parent_company:
-            parent_normalized = BrandNormalizer.normalize(parent_company)
+    __slots__ = ("columns", "_row")
 
-            # Only skip inheritance for specific brands that should NOT inherit
-            # (like Digiorno, which has its own empty entry)
-            non_inheriting_brands = ["digiorno", "bai", "nestle pure life", "pure life"]
+    def __init__(self, columns, row: Dict[str, Any]):
+        self.columns = tuple(columns)
+        self._row = row
 
-            if brand_normalized in non_inheriting_brands:
-                logger.info(f"Brand {brand} in non-inheriting list, skipping parent inheritance")
-                # Fall through to dynamic calculation
-            else:
-                logger.info(f"Found parent company '{parent_company}' for '{brand}' - will use dynamic calculation")
-                # Fall through to dynamic calculation
+    def __len__(self) -> int:
+        return 1
 
-        # Step 2: Dynamic calculation from certifications - PASS THE CATEGORY
-        logger.info(
-            f"Brand '{brand_normalized}' calculating dynamically"
-        )
-        return ScoringManager._calculate_dynamic_scores(brand, category)
+    def get_row(self, index: int) -> Dict[str, Any]:
+        return dict(self._row)
 
-    @staticmethod
-    def _calculate_dynamic_scores(brand: str, category: str = None) -> BrandData:
-        """Calculate scores dynamically from certifications"""
-        # Start with base score
-        social_score = ScoringConfig.BASE_SCORE
-        environmental_score = ScoringConfig.BASE_SCORE
-        economic_score = ScoringConfig.BASE_SCORE
+    def get_json_row(self, index: int) -> Dict[str, Any]:
+        return sanitize_for_json(self._row)
 
-        # Get all certifications from combined sources
-        all_certifications = ScoringManager._get_all_certifications(brand, category)
 
-        # Apply certification bonuses
-        bonus_applied = False
-        for cert in all_certifications:
-            if cert in ScoringConfig.CERTIFICATION_BONUSES:
-                bonus = ScoringConfig.CERTIFICATION_BONUSES[cert]
-                social_score += bonus["social"]
-                environmental_score += bonus["environmental"]
-                economic_score += bonus["economic"]
-                bonus_applied = True
+class OverlayProductMap(Mapping):
+    """category -> CertificationRecord for a changed brand (None marks a deleted category)"""
 
-        # Apply multi-certification bonus if applicable
-        if bonus_applied and len(all_certifications) > 1:
-            multi_bonus = (len(all_certifications) - 1) * \
-                ScoringConfig.MULTI_CERT_BONUS
-            social_score += multi_bonus
-            environmental_score += multi_bonus
-            economic_score += multi_bonus
+    __slots__ = ("_base", "_changes")
 
-        # Cap scores at 10.0
-        social_score = min(10.0, social_score)
-        environmental_score = min(10.0, environmental_score)
-        economic_score = min(10.0, economic_score)
+    def __init__(self, base: Mapping, changes: Dict[str, Optional[CertificationRecord]]):
+        self._base = base
+        self._changes = changes
 
-        return BrandData(
-            brand=brand,  # Add this line
-            social=safe_float(social_score),
-            environmental=safe_float(environmental_score),
-            economic=safe_float(economic_score),
-            certifications=all_certifications,
-            scoring_method="dynamic_calculation",
-            multi_cert_bonus=safe_float(
-                (len(all_certifications) - 1) * ScoringConfig.MULTI_CERT_BONUS
-                if bonus_applied and len(all_certifications) > 1
-                else 0.0
-            ),
-            notes="Base 5.0 + certification bonuses + multi-cert bonus (capped at 10.0)",
-        )
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
 
-    @staticmethod
-    def _get_all_certifications(brand: str, category: str = None) -> List[str]:
-            """Get all certifications from Excel database only"""
-            brand_normalized = BrandNormalizer.normalize(brand)
+    def __iter__(self):
+        for product_key, _ in self._items():
+            yield product_key
 
-            # Get certifications from Excel database
-            excel_certs = certification_manager.get_certifications(brand, category)
+    def __getitem__(self, product_key: str) -> CertificationRecord:
+        if product_key in self._changes:
+            record = self._changes[product_key]
+            if record is None:
+                raise KeyError(product_key)
+            return record
+        return self._base[product_key]
 
-            # Build certification list from Excel data only
-            excel_cert_list = []
-            if excel_certs["certifications"]["b_corp"]:
-                excel_cert_list.append("B Corp")
-            if excel_certs["certifications"]["fair_trade"]:
-                excel_cert_list.append("Fair Trade")
-            if excel_certs["certifications"]["rainforest_alliance"]:
-                excel_cert_list.append("Rainforest Alliance")
-            if excel_certs["certifications"]["leaping_bunny"]:
-                excel_cert_list.append("Leaping Bunny")
+    def items(self):
+        return _SnapshotItems(self, self._items)
 
-            # Return Excel certifications only
-            return excel_cert_list
+    def _items(self):
+        changes = self._changes
+        for product_key, record in self._base.items():
+            if product_key in changes:
+                record = changes[product_key]
+                if record is None:
+                    continue
+            yield product_key, record
+        for product_key, record in changes.items():
+            if record is not None and product_key not in self._base:
+                yield product_key, record
+
+    def values(self):
+        return [record for _, record in self._items()]
+
+
+class OverlayBrandIndex(Mapping):
+    """normalized brand -> products: the workbook index with changed brands swapped in"""
+
+    def __init__(self, base: Mapping, changes: Dict[str, Dict[str, Optional[CertificationRecord]]]):
+        self._base = base
+        self._brands = {}
+        self._present = {}
+        added, removed = [], 0
+        for brand, products in changes.items():
+            in_base = brand in base
+            merged = OverlayProductMap(base[brand] if in_base else {}, products)
+            present = len(merged) > 0
+            self._brands[brand] = merged
+            self._present[brand] = present
+            if in_base and not present:
+                removed += 1
+            elif present and not in_base:
+                added.append(brand)
+        self._added = tuple(added)  # new brands go after the workbook's
+        self._length = len(base) - removed + len(added)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self):
+        for brand, _ in self._items():
+            yield brand
+
+    def __contains__(self, brand) -> bool:
+        if brand in self._present:
+            return self._present[brand]
+        return brand in self._base
+
+    def __getitem__(self, brand: str) -> Mapping:
+        if brand in self._present:
+            if not self._present[brand]:
+                raise KeyError(brand)
+            return self._brands[brand]
+        return self._base[brand]
+
+    def items(self):
+        return _SnapshotItems(self, self._items)
+
+    def _items(self):
+        brands, present = self._brands, self._present
+        for brand, products in self._base.items():
+            if brand in brands:
+                if not present[brand]:
+                    continue
+                products = brands[brand]
+            yield brand, products
+        for brand in self._added:
+            yield brand, brands[brand]
 
+    @property
+    def changed_brands(self):
+        return self._brands.keys()
 
-# ==================== OPEN FOOD FACTS CLIENT ====================
 
+class OverlayBrandCategories(Mapping):
+    """normalized brand -> set of categories, following an OverlayBrandIndex"""
 
-class OpenFoodFactsClient:
-    """Client for Open Food Facts API"""
+    def __init__(self, base: Mapping, data: OverlayBrandIndex):
+        self._base = base
+        self._data = data
+        self._changed = set(data.changed_brands)
 
-    @staticmethod
-    async def search_by_name(
-        product_name: str, max_results: int = 20
-    ) -> Dict[str, Any]:
-        """Enhanced search Open Food Facts by product name with better brand extraction"""
-        try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                encoded_name = quote(product_name)
-                url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={encoded_name}&search_simple=1&action=process&json=1&page_size={max_results}"
+    def __len__(self) -> int:
+        return len(self._data)
 
-                response = await client.get(
-                    url, headers={"User-Agent": "TBLGroceryScanner/1.0"}
-                )
+    def __iter__(self):
+        return iter(self._data)
 
-                if response.status_code == 200:
-                    data = response.json()
-                    products = data.get("products", [])
+    def __contains__(self, brand) -> bool:
+        return brand in self._data
 
-                    if not products:
-                        return {
-                            "found": False,
-                            "message": "No products found",
-                            "products": [],
-                            "brand_analysis": {},
-                        }
+    def __getitem__(self, brand: str) -> Set[str]:
+        if brand in self._changed:
+            return {record.category for record in self._data[brand].values() if record.category}
+        return self._base[brand]
 
-                    return OpenFoodFactsClient._analyze_products(products)
-                else:
-                    return {
-                        "found": False,
-                        "message": f"Open Food Facts API error: {response.status_code}",
-                        "products": [],
-                        "brand_analysis": {},
-                    }
-        except Exception as e:
-            logger.error(
-                f"Open Food Facts search error for '{product_name}': {e}")
-            return {
-                "found": False,
-                "message": f"Search error: {str(e)}",
-                "products": [],
-                "brand_analysis": {},
-            }
+
+class BrandPrefixIndex:
+    """
+    Workbook brand names sorted case-insensitively, for /search-brand suggestions.
+
+    Entries are (lowercased name, row, name, category) for every workbook
+    row, spelled exactly as in the sheet. The index is built on first use
+    per workbook; replace() swaps a brand's entries when a change is applied.
+    """
+
+    def __init__(self, rows):
+        entries = []
+        if "Product_Brand" in rows.columns:
+            names = rows.column_values("Product_Brand")
+            categories = rows.column_values("Category") if "Category" in rows.columns else [""] * len(names)
+            for row_index, (name, category) in enumerate(zip(names, categories)):
+                entry = self.entry(row_index, name, category)
+                if entry is not None:
+                    entries.append(entry)
+        entries.sort()
+        self._entries = entries
+        self._lock = threading.Lock()
 
     @staticmethod
-    def _analyze_products(products: List[Dict]) -> Dict[str, Any]:
-        """Analyze products to extract brand information"""
-        brand_candidates = []
-        brand_details = {}
+    def entry(row_index: int, name, category) -> Optional[tuple]:
+        if not isinstance(name, str) or not name.strip():
+            return None
+        return (name.lower(), row_index, name, category if isinstance(category, str) else "")
 
-        for product in products:
-            # Extract brand from multiple fields with priority
-            brand_fields_priority = [
-                ("brands", 2.0),
-                ("brand", 1.8),
-                ("brand_owner", 1.5),
-                ("manufacturer", 1.3),
-            ]
+    @classmethod
+    def entries_for(cls, records) -> List[tuple]:
+        entries = []
+        for record in records:
+            row = record.row_data
+            entry = cls.entry(record.row_index, row.get("Product_Brand"), row.get("Category"))
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def replace(self, old_records, new_records):
+        with self._lock:
+            entries = self._entries
+            for entry in self.entries_for(old_records):
+                position = bisect_left(entries, entry)
+                if position < len(entries) and entries[position] == entry:
+                    del entries[position]
+            for entry in self.entries_for(new_records):
+                insort(entries, entry)
+
+    def search(self, prefix: str, limit: int = 10) -> List[tuple]:
+        """First `limit` distinct (brand, category) starting with prefix, in workbook order"""
+        matches = []
+        with self._lock:
+            entries = self._entries
+            position = bisect_left(entries, (prefix,))
+            while position < len(entries) and entries[position][0].startswith(prefix):
+                matches.append(entries[position])
+                position += 1
+        matches.sort(key=lambda entry: entry[1])
+
+        seen, results = set(), []
+        for _, _, name, category in matches:
+            if name not in seen:
+                seen.add(name)
+                results.append((name, category))
+                if len(results) >= limit:
+                    break
+        return results
 
-            for field, weight in brand_fields_priority:
-                if field in product and product[field]:
-                    field_value = str(product[field]).strip()
-                    if field_value and field_value.lower() not in [
-                        "",
-                        "unknown",
-                        "n/a",
-                        "none",
-                    ]:
-                        # Split by common separators
-                        for separator in [",", ";", "/", "|", "&", "+"]:
-                            if separator in field_value:
-                                parts = [
-                                    p.strip()
-                                    for p in field_value.split(separator)
-                                    if p.strip()
-                                ]
-                                for part in parts:
-                                    if part and len(part) > 1:
-                                        # Add multiple times based on weight
-                                        for _ in range(int(weight)):
-                                            brand_candidates.append(part)
-                                break
-                        else:
-                            # No separator, add the whole value
-                            for _ in range(int(weight)):
-                                brand_candidates.append(field_value)
+    def __len__(self) -> int:
+        return len(self._entries)
 
-                        # Store details for the first occurrence
-                        normalized_brand = BrandNormalizer.normalize(
-                            field_value.split(",")[0]
-                            if "," in field_value
-                            else field_value
-                        )
-                        if normalized_brand not in brand_details:
-                            brand_details[normalized_brand] = {
-                                "original_brand": field_value, "product_name": product.get(
-                                    "product_name", ""), "product_id": product.get(
-                                    "code", ""), "categories": product.get(
-                                    "categories", ""), "countries": product.get(
-                                    "countries", ""), "source_field": field, }
-                        break
 
-        return OpenFoodFactsClient._analyze_brand_candidates(
-            brand_candidates, brand_details, products
-        )
+class CertificationManager:
+    """Manage all certification-related operations"""
 
-    @staticmethod
-    def _analyze_brand_candidates(
-        brand_candidates: List[str], brand_details: Dict, products: List[Dict]
-    ) -> Dict[str, Any]:
-        """Analyze brand candidates to determine best match"""
-        total_candidates = len(brand_candidates)
+    # Words that don't make a partial brand match meaningful on their own
+    PARTIAL_MATCH_GENERIC_WORDS: ClassVar[frozenset] = frozenset({
+        "value", "brand", "store", "market", "everyday", "organic",
+        "natural", "premium", "select", "choice", "essential",
+        "basic", "original", "classic", "traditional", "regular",
+        "quality", "fresh", "pure", "simple", "smart", "total",
+        "complete", "farm", "food", "house", "good", "great"
+    })
+    # Single words distinctive enough to trust a partial brand match
+    PARTIAL_MATCH_DISTINCTIVE_WORDS: ClassVar[frozenset] = frozenset({
+        "nestle", "unilever", "pepsico", "coca", "cola",
+        "mars", "hershey", "kellogg", "danone", "campbell",
+        "pepperidge", "smucker", "quaker", "kraft", "heinz"
+    })
+    # Accepted spellings of each certification column; the first one is
+    # used when a change adds the column to the workbook
+    CERTIFICATION_COLUMNS: ClassVar[Dict[str, List[str]]] = {
+        "b_corp": ["B_Corp", "B Corp", "b_corp", "B Corp Certification", "bcorp"],
+        "fair_trade": [
+            "Fair_Trade",
+            "Fair Trade",
+            "fair_trade",
+            "Fair Trade Certified",
+            "fairtrade",
+        ],
+        "rainforest_alliance": [
+            "Rainforest_Alliance",
+            "Rainforest Alliance",
+            "rainforest_alliance",
+            "Rainforest Alliance Certified",
+            "rainforest",
+        ],
+        "leaping_bunny": [
+            "Leaping_Bunny",
+            "Leaping Bunny",
+            "leaping_bunny",
+            "Cruelty Free",
+            "leapingbunny",
+        ],
+        "research_complete": [
+            "Research_Complete",
+            "Research Complete",
+            "research_complete",
+            "Research Done",
+            "research_done",
+        ],
+    }
 
-        if total_candidates == 0:
-            return {
-                "found": False,
-                "message": "No brands found in search results",
-                "products": products[:5],
-                "brand_analysis": {},
-            }
+    def __init__(self):
+        self.data = None
+        self.brand_categories = None  # NEW: Track categories per brand
+        self.row_table = None
+        self.last_loaded = None
+        self.snapshot = None
+        self.snapshot_store = (
+            DatasetSnapshotStore(FileConfig.DATASET_SNAPSHOT_FILE, FileConfig.CERTIFICATION_EXCEL_FILE)
+            if FileConfig.SHARED_DATASET
+            else None
+        )
+        self._last_snapshot_check = 0.0
+        self._taxonomy = None
+        self._prefix_index = None
+        self.dataset: Optional[DatasetVersion] = None
+        # Re-entrant: loading publishes, and publishing applies pending changes
+        self._lock = threading.RLock()
+        self.change_log = DatasetChangeLog(FileConfig.DATASET_CHANGES_FILE)
+        self._base: Optional[DatasetVersion] = None  # the workbook alone
+        self._changes: Dict[str, Dict[str, Optional[CertificationRecord]]] = {}
+        self._applied_seq = 0
+        self._last_change_check = 0.0
+        self._compacting = threading.Lock()
+        self._background_reload: Optional[threading.Thread] = None
+        self._reload_seconds: Optional[float] = None  # how long the last ensure_loaded reload took
+
+    def _read_workbook(self):
+        """Parse the workbook; returns (DataFrame, content version)"""
+        logger.info(
+            f"Loading certification data from {FileConfig.CERTIFICATION_EXCEL_FILE}"
+        )
 
-        # Calculate brand distribution
-        brand_counts = Counter(brand_candidates)
-        total_with_brands = sum(brand_counts.values())
+        # Hash and parse the same bytes so the version matches the data
+        with open(FileConfig.CERTIFICATION_EXCEL_FILE, "rb") as f:
+            content = f.read()
 
-        # Calculate percentages
-        brand_percentages = {}
-        for brand, count in brand_counts.items():
-            if count > 0:
-                percentage = (count / total_with_brands) * 100
-                brand_percentages[brand] = round(percentage, 1)
+        # First get pandas, then use it
+        pd = get_pandas()
+        df = pd.read_excel(io.BytesIO(content))
+        logger.info(f"Excel file loaded. Columns: {list(df.columns)}")
+        return df, workbook_version(content)
 
-        # Sort brands by frequency
+    def _publish(self, version: str, data, brand_categories, rows):
+        with self._lock:
+            self.row_table = rows
+            self._taxonomy = None
+            self._prefix_index = None
+            self.last_loaded = datetime.now()
+            self._base = DatasetVersion(
+                version=version,
+                data=data,
+                brand_categories=brand_categories,
+                rows=rows,
+                loaded_at=self.last_loaded,
+            )
+            self._changes = {}
+            self._applied_seq = self.change_log.base_seq(version)
+            pending = self.change_log.since(self._applied_seq)
+            for change in pending:
+                self._apply_change(change)
+            if pending:
+                self._applied_seq = pending[-1].seq
+                logger.info(f"Applied {len(pending)} pending dataset change(s) on top of workbook {version}")
+            self._last_change_check = time.monotonic()
+            self._publish_changes()
+
+    def _publish_changes(self):
+        """Publish the workbook with the applied changes as the current DatasetVersion"""
+        base = self._base
+        if self._changes:
+            changes = {brand: dict(products) for brand, products in self._changes.items()}
+            data = OverlayBrandIndex(base.data, changes)
+            brand_categories = OverlayBrandCategories(base.brand_categories, data)
+            version = f"{base.version}+{self._applied_seq}"
+        else:
+            data, brand_categories, version = base.data, base.brand_categories, base.version
+        self.data = data
+        self.brand_categories = brand_categories
+        self.dataset = DatasetVersion(
+            version=version,
+            data=data,
+            brand_categories=brand_categories,
+            rows=base.rows,
+            loaded_at=self.last_loaded,
+            base_version=base.version,
+        )
+
+    def _current_products(self, brand_key: str) -> Dict[str, CertificationRecord]:
+        products = dict(self._base.data[brand_key].items()) if brand_key in self._base.data else {}
+        for product_key, record in self._changes.get(brand_key, {}).items():
+            if record is None:
+                products.pop(product_key, None)
+            else:
+                products[product_key] = record
+        return products
+
+    def certification_column(self, certification: str, columns) -> str:
+        """Workbook column holding a certification flag (the canonical name if there is none yet)"""
+        names = self.CERTIFICATION_COLUMNS[certification]
+        return next((name for name in names if name in columns), names[0])
+
+    def _changed_record(self, current: Optional[CertificationRecord], change: DatasetChange) -> CertificationRecord:
+        columns = self._base.rows.columns
+        if current is not None:
+            row = current.row_data
+            certifications = current.certifications
+            original_brand = change.original_brand or current.original_brand
+            row_index = current.row_index
+            written = change.certifications
+        else:
+            row = {column: float("nan") for column in columns}
+            certifications = dict.fromkeys(CERTIFICATION_FLAGS, False)
+            original_brand = change.original_brand or change.brand
+            row_index = len(self._base.rows) + change.seq  # after the workbook rows
+            written = certifications
+        certifications.update(change.certifications)
+
+        row.update(change.columns)
+        for certification in written:
+            row[self.certification_column(certification, columns)] = certifications[certification]
+        row["Product_Brand"] = original_brand
+        if change.category:
+            row["Category"] = change.category
+
+        return CertificationRecord(
+            original_brand=original_brand,
+            category=change.category,
+            flags=CertificationRecord.pack_flags(certifications),
+            row_index=row_index,
+            rows=ChangedRow(columns, row),
+        )
+
+    def _apply_change(self, change: DatasetChange):
+        """Apply one change-log entry to the overlay and the derived indexes"""
+        brand_key, product_key = change.brand_key, change.product_key
+        before = self._current_products(brand_key)
+        if change.op == "delete":
+            record = None
+        else:
+            record = self._changed_record(before.get(product_key), change)
+        self._changes.setdefault(brand_key, {})[product_key] = record
+
+        if record is not None and self._taxonomy is not None:
+            self._taxonomy.add(product_key)
+        if self._prefix_index is not None:
+            self._prefix_index.replace(before.values(), self._current_products(brand_key).values())
+
+    def sync_changes(self, force: bool = False) -> int:
+        """Apply change-log entries written since the last look (by any worker); returns how many"""
+        if self._base is None:
+            return 0
+        if not force and time.monotonic() - self._last_change_check < FileConfig.DATASET_CHECK_SECONDS:
+            return 0
+        with self._lock:
+            self._last_change_check = time.monotonic()
+            changes = self.change_log.since(self._applied_seq)
+            if not changes:
+                return 0
+            for change in changes:
+                self._apply_change(change)
+            self._applied_seq = changes[-1].seq
+            self._publish_changes()
+        logger.info(f"Applied {len(changes)} dataset change(s); version {self.dataset.version}")
+        return len(changes)
+
+    def _record_key(self, brand: str, category: str):
+        brand = (brand or "").strip()
+        category = (category or "").strip()
+        brand_key = BrandNormalizer.normalize(brand)
+        if not brand_key:
+            raise ValueError("A brand name is required")
+        return brand, category, brand_key, category or "_default"
+
+    def upsert_record(
+        self,
+        brand: str,
+        category: str = "",
+        certifications: Optional[Dict[str, bool]] = None,
+        original_brand: Optional[str] = None,
+        columns: Optional[Dict[str, Any]] = None,
+        author: str = "",
+    ) -> DatasetChange:
+        """
+        Create or update one (brand, category) record through the change log.
+
+        Certifications not given keep their current value (False for a new
+        record); columns sets other workbook cells of the row.
+        """
+        if self.ensure_loaded() is None:
+            raise RuntimeError("Certification data not loaded")
+        brand, category, _, _ = self._record_key(brand, category)
+
+        certifications = dict(certifications or {})
+        unknown = set(certifications) - set(CERTIFICATION_FLAGS)
+        if unknown:
+            raise ValueError(f"Unknown certification(s): {', '.join(sorted(unknown))}")
+
+        columns = dict(columns or {})
+        reserved = {"Product_Brand", "Category"}.union(*self.CERTIFICATION_COLUMNS.values())
+        workbook_columns = set(self._base.rows.columns)
+        for column, value in columns.items():
+            if column in reserved:
+                raise ValueError(f"Column '{column}' is set through its own field")
+            if column not in workbook_columns:
+                raise ValueError(f"Unknown workbook column '{column}'")
+            if not isinstance(value, (str, int, float, bool, type(None))):
+                raise ValueError(f"Column '{column}' must be a plain value")
+
+        fields = {"certifications": {name: bool(value) for name, value in certifications.items()}}
+        if original_brand and original_brand.strip():
+            fields["original_brand"] = original_brand.strip()
+        if columns:
+            fields["columns"] = columns
+
+        change = self.change_log.append("upsert", brand, category, fields, author)
+        self.sync_changes(force=True)
+        logger.info(f"✏️ Upserted certification record {brand!r} / {category!r} (change {change.seq})")
+        return change
+
+    def delete_record(self, brand: str, category: str = "", author: str = "") -> Optional[DatasetChange]:
+        """Delete one (brand, category) record; None if there is no such record"""
+        if self.ensure_loaded() is None:
+            raise RuntimeError("Certification data not loaded")
+        brand, category, brand_key, product_key = self._record_key(brand, category)
+        with self._lock:
+            if product_key not in self._current_products(brand_key):
+                return None
+            change = self.change_log.append("delete", brand, category, {}, author)
+        self.sync_changes(force=True)
+        logger.info(f"🗑️ Deleted certification record {brand!r} / {category!r} (change {change.seq})")
+        return change
+
+    def pending_changes(self) -> List[DatasetChange]:
+        """Changes applied on top of the loaded workbook (not yet compacted into it)"""
+        if self._base is None:
+            return []
+        return self.change_log.since(self.change_log.base_seq(self._base.version))
+
+    @contextmanager
+    def _compaction_lock(self):
+        """Non-blocking: yields False if another thread or worker is already compacting"""
+        if not self._compacting.acquire(blocking=False):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            with open(f"{self.change_log.db_path}.compact.lock", "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._compacting.release()
+
+    def compact_changes(self) -> Dict[str, Any]:
+        """
+        Write pending changes into the workbook and make it the new base.
+
+        The workbook is rewritten with openpyxl (first sheet, rows matched by
+        normalized brand + category) to a temp file and swapped in with
+        os.replace; every worker then reloads it as for an upload.
+        """
+        path = FileConfig.CERTIFICATION_EXCEL_FILE
+        with self._compaction_lock() as acquired:
+            if not acquired:
+                return {"status": "busy", "message": "Compaction already running"}
+
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                content = f.read()
+            version = workbook_version(content)
+            through_seq = self.change_log.base_seq(version)
+            changes = self.change_log.since(through_seq)
+            if not changes:
+                return {"status": "up_to_date", "dataset_version": version, "applied": 0}
+
+            openpyxl = get_openpyxl()
+            workbook = openpyxl.load_workbook(io.BytesIO(content))
+            counts = self._write_changes(workbook.worksheets[0], changes)
+
+            temp_path = f"{path}.compact.tmp"
+            workbook.save(temp_path)
+            with open(temp_path, "rb") as f:
+                new_version = workbook_version(f.read())
+
+            current = os.stat(path)
+            if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                os.remove(temp_path)
+                return {"status": "conflict", "message": "Workbook was replaced during compaction"}
+
+            # Record the bases before the swap so no worker loads the new
+            # workbook and re-applies the changes it already contains
+            self.change_log.set_base(version, through_seq, replace=False)
+            self.change_log.set_base(new_version, changes[-1].seq)
+            os.replace(temp_path, path)
+
+        logger.info(f"🗜️ Compacted {len(changes)} dataset change(s) into {path} ({version} -> {new_version})")
+        self.load_certification_data()
+        return {
+            "status": "success",
+            "applied": len(changes),
+            "through_seq": changes[-1].seq,
+            "previous_version": version,
+            "dataset_version": new_version,
+            **counts,
+        }
+
+    def _write_changes(self, sheet, changes: List[DatasetChange]) -> Dict[str, int]:
+        """Apply change-log entries to a worksheet in place; returns row counts"""
+        columns = {str(cell.value): cell.column for cell in sheet[1] if cell.value is not None}
+
+        def column_for(name: str) -> int:
+            if name not in columns:
+                columns[name] = sheet.max_column + 1
+                sheet.cell(row=1, column=columns[name], value=name)
+            return columns[name]
+
+        brand_column = column_for("Product_Brand")
+        category_column = columns.get("Category")
+
+        rows = {}  # (normalized brand, category key) -> row numbers
+        for row_number in range(2, sheet.max_row + 1):
+            brand = sheet.cell(row=row_number, column=brand_column).value
+            if brand is None or not str(brand).strip():
+                continue
+            category = sheet.cell(row=row_number, column=category_column).value if category_column else None
+            category = str(category).strip() if category is not None else ""
+            key = (BrandNormalizer.normalize(str(brand).strip()), category or "_default")
+            rows.setdefault(key, []).append(row_number)
+
+        counts = {"updated": 0, "added": 0, "deleted": 0}
+        deleted = set()
+        for change in changes:
+            key = (change.brand_key, change.product_key)
+            if change.op == "delete":
+                deleted.update(rows.pop(key, ()))
+                continue
+
+            certifications = change.certifications
+            row_numbers = rows.get(key)
+            if row_numbers:
+                counts["updated"] += 1
+            else:
+                row_numbers = rows[key] = [sheet.max_row + 1]
+                certifications = {**dict.fromkeys(CERTIFICATION_FLAGS, False), **certifications}
+                sheet.cell(row=row_numbers[0], column=brand_column, value=change.original_brand or change.brand)
+                if change.category:
+                    sheet.cell(row=row_numbers[0], column=column_for("Category"), value=change.category)
+                counts["added"] += 1
+
+            for row_number in row_numbers:
+                if change.original_brand:
+                    sheet.cell(row=row_number, column=brand_column, value=change.original_brand)
+                for certification, value in certifications.items():
+                    column = column_for(self.certification_column(certification, columns))
+                    sheet.cell(row=row_number, column=column, value=value)
+                for name, value in change.columns.items():
+                    sheet.cell(row=row_number, column=column_for(name), value=value)
+
+        for row_number in sorted(deleted, reverse=True):
+            sheet.delete_rows(row_number)
+        counts["deleted"] = len(deleted)
+        return counts
+
+    def _load_shared_snapshot(self, parsed=None) -> bool:
+        """Map the workbook snapshot shared by all workers (building it if needed)"""
+        def build():
+            df, version = parsed or self._read_workbook()
+            cert_data, _, row_table = self.build_certification_index(df)
+            return cert_data, row_table, version
+
+        try:
+            snapshot = self.snapshot_store.load(build)
+        except Exception as e:
+            logger.warning(f"⚠️ Shared dataset snapshot unavailable, loading in-process: {e}")
+            return False
+
+        if snapshot is not self.snapshot:
+            self.snapshot = snapshot
+            self._publish(snapshot.version, snapshot.data, snapshot.brand_categories, snapshot.rows)
+            logger.info(f"✅ Mapped shared dataset snapshot: {len(self.data)} brands (version {snapshot.version})")
+        self.last_loaded = datetime.now()
+        self._last_snapshot_check = time.monotonic()
+        return len(self.data) > 0
+
+    def snapshot_changed(self) -> bool:
+        """Has another worker (or an upload) replaced the shared snapshot?"""
+        if self.snapshot_store is None or self.snapshot is None:
+            return False
+        if time.monotonic() - self._last_snapshot_check < FileConfig.DATASET_CHECK_SECONDS:
+            return False
+        self._last_snapshot_check = time.monotonic()
+        return self.snapshot_store.is_stale(self.snapshot)
+
+    @property
+    def category_taxonomy(self) -> CategoryTaxonomy:
+        """Category resolution for the loaded dataset (built on first use)"""
+        taxonomy = self._taxonomy
+        if taxonomy is None:
+            if self.snapshot is not None:
+                categories = self.snapshot.product_keys()
+            else:
+                base = self._base.data if self._base is not None else {}
+                categories = {key for products in base.values() for key in products}
+            # Deleted categories stay indexed until the next load; they just never match
+            categories |= {
+                key for products in self._changes.values() for key, record in products.items() if record is not None
+            }
+            taxonomy = self._taxonomy = CategoryTaxonomy(categories)
+            logger.info(f"Indexed {len(taxonomy.categories)} workbook categories for category resolution")
+        return taxonomy
+
+    @property
+    def brand_prefix_index(self) -> BrandPrefixIndex:
+        """Prefix index over original brand names (built on first use)"""
+        index = self._prefix_index
+        if index is None:
+            with self._lock:
+                index = self._prefix_index
+                if index is None:
+                    index = BrandPrefixIndex(self._base.rows)
+                    for brand_key, products in self._changes.items():
+                        base = self._base.data[brand_key].values() if brand_key in self._base.data else ()
+                        index.replace(base, self._current_products(brand_key).values())
+                    self._prefix_index = index
+        return index
+
+    def load_certification_data(self, parsed=None) -> bool:
+        """
+        Load certification data from Excel file and build category index.
+
+        parsed: optional (DataFrame, version) of the workbook on disk, when
+        the caller has already read it (upload validation)
+        """
+        try:
+            if os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE):
+                if self.snapshot_store is not None and self._load_shared_snapshot(parsed):
+                    return True
+
+                df, version = parsed or self._read_workbook()
+                cert_data, brand_categories, row_table = self.build_certification_index(df)
+
+                self.snapshot = None
+                self._publish(version, cert_data, brand_categories, row_table)
+
+                logger.info(f"Loaded {len(cert_data)} certification records")
+                logger.info(f"Loaded category index for {len(brand_categories)} brands")
+
+                # Log some sample data for debugging
+                sample_brands = list(cert_data.keys())[:3]
+                for brand in sample_brands:
+                    first_product = next(iter(cert_data[brand].values()))
+                    logger.info(
+                        f"Sample brand '{brand}': certs={first_product.certifications}, "
+                        f"categories={brand_categories.get(brand, set())}"
+                    )
+
+                # ✅ ADD THIS: Verify data is ready
+                if self.data is not None and len(self.data) > 0:
+                    logger.info(f"✅ Data verification: {len(self.data)} records ready")
+                    return True
+                else:
+                    logger.warning("⚠️ Data appears empty, retrying...")
+                    time.sleep(1)
+                    return self.load_certification_data()
+            else:
+                logger.warning(
+                    f"Certification Excel file {FileConfig.CERTIFICATION_EXCEL_FILE} not found"
+                )
+                return False
+        except Exception as e:
+            logger.error(f"Error loading certification data: {e}")
+            import traceback
+
+            logger.error(traceback.format_exc())
+            return False
+
+    def ensure_loaded(self, deadline: Optional["Deadline"] = None) -> Optional[DatasetVersion]:
+        """
+        Load or refresh the data if it is missing, old or replaced; return the
+        current version. With a deadline, a refresh of data that's already
+        loaded runs inline only if the last reload's time (plus a lookup)
+        fits in what's left; otherwise it runs in the background and this
+        request uses the current version (skipping the "dataset_reload" stage).
+        """
+        reload = self._background_reload
+        if reload is not None and reload.is_alive() and self.data is not None:
+            # Someone is already refreshing; don't queue up behind them
+            if deadline is not None:
+                deadline.skip("dataset_reload")
+            return self.dataset
+
+        # ===== CHECK DATA WITH LOCK (prevents reload failures) =====
+        with self._lock:
+            need_load = (
+                self.data is None
+                or self.last_loaded is None
+                or (datetime.now() - self.last_loaded).seconds > 300
+                or self.snapshot_changed()
+            )
+
+            if need_load and deadline is not None and self.data is not None and (
+                self._reload_seconds is None
+                or not deadline.allows(self._reload_seconds + DeadlineConfig.MIN_LOOKUP_SECONDS)
+            ):
+                self._reload_in_background()
+                deadline.skip("dataset_reload")
+            elif need_load:
+                logger.info("🔄 Loading/Reloading certification data...")
+                self._timed_load()
+            else:
+                self.sync_changes()
+
+        return self.dataset if self.data is not None else None
+
+    def _timed_load(self):
+        started = time.perf_counter()
+        self.load_certification_data()
+        self._reload_seconds = time.perf_counter() - started
+
+    def _reload_in_background(self):
+        """Start load_certification_data on a thread unless one is running (call with _lock held)"""
+        reload = self._background_reload
+        if reload is not None and reload.is_alive():
+            return
+        logger.info("🔄 Reloading certification data in the background...")
+
+        def run():
+            with self._lock:
+                self._timed_load()
+
+        self._background_reload = threading.Thread(target=run, name="dataset-reload", daemon=True)
+        self._background_reload.start()
+
+    def build_certification_index(self, df):
+        """
+        Build (brand -> category -> CertificationRecord, brand -> categories,
+        RowTable) from a workbook DataFrame.
+        """
+        pd = get_pandas()
+        columns = list(df.columns)
+        row_table = RowTable.from_dataframe(df)
+
+        cert_data = {}
+        brand_categories = {}  # NEW: Track categories per brand
+
+        for row_index, row in enumerate(df.to_dict("records")):
+            # Use "Product_Brand" column from new file
+            brand = None
+            if "Product_Brand" in columns:
+                brand_value = row.get("Product_Brand")
+                if not pd.isna(brand_value):
+                    brand = str(brand_value).strip()
+
+            if not brand:
+                continue
+
+            brand_normalized = sys.intern(BrandNormalizer.normalize(brand))
+
+            # NEW: Get category for this row
+            category = ""
+            if "Category" in columns:
+                category_value = row.get("Category")
+                if not pd.isna(category_value):
+                    category = str(category_value).strip()
+
+            # NEW: Track categories for this brand
+            if brand_normalized not in brand_categories:
+                brand_categories[brand_normalized] = set()
+            if category:
+                brand_categories[brand_normalized].add(sys.intern(category))
+
+            # Get certifications with exact column names
+            certifications = self._extract_certifications(row, columns)
+
+            # Store brand data with category as secondary key (store all products)
+            if brand_normalized not in cert_data:
+                cert_data[brand_normalized] = {}
+
+            # Use category as the key to store product-specific data
+            product_key = sys.intern(category) if category else "_default"
+
+            # Store this product's data
+            cert_data[brand_normalized][product_key] = CertificationRecord(
+                original_brand=brand,
+                category=category,
+                flags=CertificationRecord.pack_flags(certifications),
+                row_index=row_index,
+                rows=row_table,
+            )
+
+        return cert_data, brand_categories, row_table
+
+    def _extract_certifications(self, row, columns) -> Dict[str, bool]:
+        """Extract certifications from a row"""
+        cert_mapping = self.CERTIFICATION_COLUMNS
+
+        pd = get_pandas()
+
+        # ===== ADD DEBUGGING =====
+        logger.info(f"🔍 DEBUG: Columns in Excel: {columns}")
+        # Log the specific columns we care about
+        for cert_type, possible_names in cert_mapping.items():
+            for col_name in possible_names:
+                if col_name in columns:
+                    logger.info(f"🔍 DEBUG: Found column '{col_name}' for '{cert_type}'")
+                    cell_value = row.get(col_name)
+                    logger.info(f"🔍 DEBUG: Value for '{col_name}': {cell_value}, type: {type(cell_value)}")
+        # ===== END DEBUGGING =====
+
+        certifications = {}
+        for cert_type, possible_names in cert_mapping.items():
+            value = False
+            for col_name in possible_names:
+                if col_name in columns:
+                    cell_value = row.get(col_name)
+                    logger.info(f"Checking {cert_type} in column '{col_name}': cell_value={cell_value}, type={type(cell_value)}")
+                    if pd.isna(cell_value):
+                        value = False
+                    elif isinstance(cell_value, bool):
+                        value = cell_value
+                        logger.info(f"✅ {cert_type} is boolean: {value}")
+                    elif isinstance(cell_value, (int, float)):
+                        value = bool(cell_value)
+                        logger.info(f"✅ {cert_type} is number: {value}")
+                    elif isinstance(cell_value, str):
+                        cell_value_lower = cell_value.strip().lower()
+                        if cell_value_lower in ["true", "yes", "y", "1", "t"]:
+                            value = True
+                        elif cell_value_lower in ["false", "no", "n", "0", "f"]:
+                            value = False
+                        logger.info(f"✅ {cert_type} is string: {value}")
+                    break
+            certifications[cert_type] = value
+
+        logger.info(f"🔍 DEBUG: Extracted certifications: {certifications}")
+        return certifications
+
+    def _get_brand_categories(self, brand_normalized: str) -> List[str]:
+        """Get all categories a brand appears in"""
+        categories = set()
+
+        # Check exact match
+        if brand_normalized in self.data:
+            for product_key, product_data in self.data[brand_normalized].items():
+                if product_key != "_default":
+                    categories.add(product_key)
+
+        # Also check partial matches
+        for stored_brand, products in self.data.items():
+            if stored_brand != brand_normalized and self._improved_partial_match(brand_normalized, stored_brand):
+                for product_key, product_data in products.items():
+                    if product_key != "_default":
+                        categories.add(product_key)
+
+        return sorted(list(categories))
+
+    def _find_exact_brand_category_match(self, brand_normalized: str, category: str) -> Optional[Dict]:
+        """Find exact brand + category match in stored data"""
+        category_normalized = category.strip().lower()
+
+        # Check exact brand match
+        if brand_normalized in self.data:
+            # Look for exact category match in this brand's products
+            for product_key, product_data in self.data[brand_normalized].items():
+                if product_key.lower() == category_normalized:
+                    return product_data
+
+        # Check partial brand matches
+        for stored_brand, products in self.data.items():
+            if self._improved_partial_match(brand_normalized, stored_brand):
+                for product_key, product_data in products.items():
+                    if product_key.lower() == category_normalized:
+                        return product_data
+
+        return None
+
+    def _find_best_category_match(
+        self, brand_normalized: str, category: str, category_path: Optional[List[str]] = None
+    ) -> Optional[Dict]:
+        """Find best category match for barcode scans when exact match fails"""
+        # {workbook category: score}, memoized per OFF category
+        category_scores = self.category_taxonomy.resolve(category, category_path)
+        best_match = None
+        best_score = ()
+        match_confidence = "low"  # Track confidence level
+
+        # Check exact brand match (HIGHEST CONFIDENCE)
+        if brand_normalized in self.data:
+            match_confidence = "high"
+            for product_key, product_data in self.data[brand_normalized].items():
+                score = category_scores.get(product_key)
+                if score is not None and score > best_score:
+                    best_score = score
+                    best_match = product_data
+                    logger.info(f"Found exact brand category match: '{category}' → '{product_key}'")
+
+        # Check partial brand matches (LOWER CONFIDENCE - ONLY if exact brand not found)
+        if not best_match:
+            search_words = set(brand_normalized.split())
+            for stored_brand, products in self.data.items():
+                if self._improved_partial_match(brand_normalized, stored_brand):
+                    # Check if this is a high-confidence partial match (2+ words)
+                    stored_words = set(stored_brand.split())
+                    common_words = search_words & stored_words
+                    meaningful_common = [w for w in common_words if w not in self.PARTIAL_MATCH_GENERIC_WORDS]
+
+                    # Only use partial match if at least 2 meaningful words match
+                    if len(meaningful_common) >= 2:
+                        match_confidence = "medium"
+                    else:
+                        # Single word match - only use if it's a distinctive word
+                        if meaningful_common and meaningful_common[0] in self.PARTIAL_MATCH_DISTINCTIVE_WORDS:
+                            match_confidence = "medium"
+                        else:
+                            match_confidence = "low"
+                            continue  # Skip low-confidence partial matches
+
+                    for product_key, product_data in products.items():
+                        score = category_scores.get(product_key)
+                        if score is not None and score > best_score:
+                            best_score = score
+                            best_match = product_data
+                            logger.info(
+                                f"Found partial category match via partial brand: '{category}' → '{product_key}'"
+                            )
+
+        # ===== SAFETY CHECK: Only return match if confidence is high enough =====
+        if best_match and match_confidence in ["high", "medium"]:
+            return best_match
+
+        # If match_confidence is "low", don't return anything (prevents false positives)
+        logger.info(f"Rejected low-confidence brand match for '{brand_normalized}' → category '{category}'")
+        return None
+
+    @staticmethod
+    def _improved_partial_match(search_brand: str, stored_brand: str) -> bool:
+        """Improved brand matching with hybrid approach to prevent generic word mismatches"""
+
+        # ===== DEFINED AT TOP (available everywhere) =====
+        distinctive_words = {
+            "nespresso", "dannon", "activia", "oikos", "evian",
+            "volvic", "starbucks", "cadbury", "dunkin", "hershey",
+            "coca", "cola", "pepsi", "kraft", "heinz", "general",
+            "mills", "kellogg", "mondelez", "unilever", "procter",
+            "gamble", "johnson", "campbell", "tyson", "hormel",
+            "danone", "nestle", "mars", "pepperidge", "smucker",
+            "quaker", "kroger", "safeway", "traders", "joes"
+        }
+
+        # Generic words that shouldn't trigger matches alone
+        GENERIC_WORDS = {
+            "value", "brand", "store", "market", "everyday", "organic",
+            "natural", "premium", "select", "choice", "essential",
+            "basic", "original", "classic", "traditional", "regular",
+            "quality", "fresh", "pure", "simple", "smart", "total",
+            "complete", "farm", "food", "house", "good", "great",
+            "best", "finest", "fresh", "home", "family", "country",
+            "american", "old", "new", "world", "nature", "harvest"
+        }
+
+        # ===== STEP 1: EXACT MATCH =====
+        if search_brand == stored_brand:
+            return True
+
+        # ===== STEP 2: SUBSTRING CHECK WITH SAFEGUARDS =====
+        if stored_brand in search_brand or search_brand in stored_brand:
+            # Split into words
+            search_words = set(search_brand.split())
+            stored_words = set(stored_brand.split())
+            common_words = search_words & stored_words
+
+            # Remove generic words from consideration
+            meaningful_common = [w for w in common_words if w not in GENERIC_WORDS]
+
+            # Rule 1: At least 2 meaningful words match - SAFE
+            if len(meaningful_common) >= 2:
+                return True
+
+            # Rule 2: Single meaningful word match - require it to be distinctive
+            if len(meaningful_common) == 1:
+                word = next(iter(meaningful_common))
+
+                # Reject if word is short and generic
+                if len(word) < 5 and word not in distinctive_words:
+                    return False
+
+                if word in distinctive_words:
+                    return True
+
+                # For single-word brands, use similarity with high threshold
+                if len(search_words) == 1 and len(stored_words) == 1:
+                    similarity = SequenceMatcher(None, search_brand, stored_brand).ratio()
+                    return similarity >= 0.85
+
+            # Substring match with only generic words = NO MATCH
+            return False
+
+        # ===== STEP 3: WORD OVERLAP CHECK =====
+        search_words = set(search_brand.split())
+        stored_words = set(stored_brand.split())
+        common_words = search_words & stored_words
+        meaningful_common = [w for w in common_words if w not in GENERIC_WORDS]
+
+        # Rule 3: At least 2 meaningful words overlap - SAFE
+        if len(meaningful_common) >= 2:
+            return True
+
+        # Rule 4: Single meaningful word overlap - require distinctiveness
+        if len(meaningful_common) == 1:
+            word = meaningful_common[0]
+
+            # Reject short/generic words
+            if len(word) < 4 and word not in {"coca", "cola", "pepsi", "mars"}:
+                return False
+
+            # Get remaining words for fuzzy matching
+            search_remaining = [w for w in search_words if w not in GENERIC_WORDS and w != word]
+            stored_remaining = [w for w in stored_words if w not in GENERIC_WORDS and w != word]
+
+            # If we have one word remaining in each, check similarity
+            if len(search_remaining) == 1 and len(stored_remaining) == 1:
+                word1 = search_remaining[0]
+                word2 = stored_remaining[0]
+                similarity = SequenceMatcher(None, word1, word2).ratio()
+                if similarity >= 0.75 and (len(word1) >= 4 or len(word2) >= 4):
+                    return True
+
+            # Also check if one contains the other
+            if search_remaining and stored_remaining:
+                for s_word in search_remaining:
+                    for t_word in stored_remaining:
+                        if s_word in t_word or t_word in s_word:
+                            if len(s_word) >= 4 or len(t_word) >= 4:
+                                return True
+
+        # ===== STEP 4: SINGLE-WORD BRAND MATCH (STRICT) =====
+        if len(search_words) == 1 and len(stored_words) == 1:
+            word1 = search_brand
+            word2 = stored_brand
+
+            # Exact single word match
+            if word1 == word2:
+                return True
+
+            # Similarity check with high threshold (85%)
+            similarity = SequenceMatcher(None, word1, word2).ratio()
+            if similarity >= 0.85:
+                return True
+
+            # Also allow if the word is distinctive and matches partially
+            if word1 in distinctive_words or word2 in distinctive_words:
+                if word1 in word2 or word2 in word1:
+                    return True
+
+            return False
+
+        # ===== NO MATCH =====
+        return False
+
+    def get_certifications(
+        self,
+        brand: str,
+        category: str = None,
+        source: str = "manual",
+        include_details: bool = True,
+        category_path: Optional[List[str]] = None,
+        deadline: Optional["Deadline"] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get certifications for a brand from Excel data, filtered by category.
+
+        Args:
+            brand: Brand name to look up
+            category: Product category (required for multi-category brands unless source is "barcode")
+            source: "barcode" (OFF provided category) or "manual" (user selected)
+            include_details: Include the raw spreadsheet row (skip it when only scoring)
+            category_path: OFF category hierarchy for barcode scans, broadest first
+            deadline: Request budget; a due reload won't hold up this lookup
+        """
+        if self.ensure_loaded(deadline) is None:
+            logger.error("❌ Data still None after load attempt")
+            return self._get_default_response(
+                found=False,
+                match_type="data_not_loaded",
+                note="Certification data is loading. Please try again in a moment."
+            )
+
+        if not brand or brand.lower() in ["unknown", "n/a", ""]:
+            logger.info("Empty brand requested, returning default certifications")
+            return self._get_default_response(found=False, match_type="no_brand")
+
+        brand_normalized = BrandNormalizer.normalize(brand)
+        logger.info(f"Looking for certifications for brand: '{brand_normalized}', category: '{category}', source: '{source}'")
+
+        # ===== STEP 1: Try exact brand + category match if category provided =====
+        if category and category.strip():
+            exact_match = self._find_exact_brand_category_match(brand_normalized, category)
+            if exact_match:
+                logger.info(f"Found exact match: brand='{brand_normalized}', category='{category}'")
+                return self._format_response(
+                    found=True,
+                    data=exact_match,
+                    search_brand=brand,
+                    match_type="exact_product",
+                    include_details=include_details
+                )
+
+        # ===== STEP 2: Check if brand exists in our data =====
+        brand_exists = False
+        matched_brand = None
+        matched_products = None
+
+        # Check exact brand match
+        if brand_normalized in self.data:
+            brand_exists = True
+            matched_brand = brand_normalized
+            matched_products = self.data[brand_normalized]  # This is now a dict of products by category
+        else:
+            # Check partial brand match
+            for stored_brand, products in self.data.items():
+                if self._improved_partial_match(brand_normalized, stored_brand):
+                    brand_exists = True
+                    matched_brand = stored_brand
+                    matched_products = products
+                    break
+
+        if brand_exists and matched_products:
+            # Get categories this brand appears in
+            categories = [k for k in matched_products.keys() if k != "_default"]
+            is_single_category = len(categories) == 1
+
+            # Get the first product's category for single-category case
+            first_category = categories[0] if categories else None
+            first_product_data = matched_products.get(first_category) if first_category else matched_products.get("_default")
+
+            # CASE A: Single-category brand - safe to use brand-only match
+            if is_single_category:
+                single_category = categories[0]
+                product_data = matched_products[single_category]
+                logger.info(f"Brand '{matched_brand}' appears only in category '{single_category}' - using brand-only match")
+                return self._format_response(
+                    found=True,
+                    data=product_data,
+                    search_brand=brand,
+                    match_type="brand_only_single_category",
+                    matched_category=single_category,
+                    note=f"This brand only produces {single_category} products.",
+                    include_details=include_details
+                )
+
+            # CASE B: Barcode scan with category from OFF
+            elif source == "barcode" and category:
+                # Try to find best category match
+                best_match = self._find_best_category_match(brand_normalized, category, category_path)
+                if best_match:
+                    # Get the category from the matched product data
+                    best_category = best_match.category
+
+                    logger.info(f"Found category match for barcode: '{category}' → '{best_category}'")
+                    return self._format_response(
+                        found=True,
+                        data=best_match,
+                        search_brand=brand,
+                        match_type="barcode_category_match",
+                        matched_category=best_category,
+                        note=f"Matched to {best_category} category based on product information.",
+                        include_details=include_details
+                    )
+                else:
+                    # No category match found - return unknown
+                    logger.info(f"No category match for '{brand}' with category '{category}'")
+                    return self._get_default_response(
+                        found=False,
+                        match_type="no_category_match",
+                        note=f"Product category '{category}' not found in database for this brand."
+                    )
+
+            # CASE C: Manual search with category provided but not exact match
+            elif category and category.strip():
+                # Try partial category match
+                best_match = self._find_best_category_match(brand_normalized, category)
+                if best_match:
+                    # Get the category from the matched product data
+                    best_category = best_match.category
+
+                    logger.info(f"Found partial category match for manual search: '{category}' → '{best_category}'")
+                    return self._format_response(
+                        found=True,
+                        data=best_match,
+                        search_brand=brand,
+                        match_type="partial_category_match",
+                        matched_category=best_category,
+                        note=f"Best match found in {best_category} category. Please verify.",
+                        include_details=include_details
+                    )
+                else:
+                    # No match - require category selection
+                    return self._get_default_response(
+                        found=False,
+                        match_type="category_required",
+                        note=f"This brand makes multiple product types. Please select a category: {', '.join(categories)}"
+                    )
+
+            # CASE D: Manual search without category for multi-category brand
+            else:
+                logger.info(f"Brand '{matched_brand}' appears in {len(categories)} categories. Category required.")
+                return self._get_default_response(
+                    found=False,
+                    match_type="category_required",
+                    note=f"This brand makes multiple product types. Please select a category: {', '.join(categories)}"
+                )
+
+        # ===== STEP 3: Check parent company =====
+        parent_company = BrandNormalizer.find_parent_company(brand)
+        if parent_company:
+            parent_normalized = BrandNormalizer.normalize(parent_company)
+            if parent_normalized in self.data:
+                logger.info(f"Using parent company '{parent_company}' for '{brand}'")
+                # For parent company, get the first product
+                parent_products = self.data[parent_normalized]
+                parent_categories = [k for k in parent_products.keys() if k != "_default"]
+                if parent_categories:
+                    parent_data = parent_products[parent_categories[0]]
+                else:
+                    parent_data = parent_products.get("_default")
+
+                if parent_data:
+                    return self._format_response(
+                        found=True,
+                        data=parent_data,
+                        search_brand=brand,
+                        match_type="parent_company",
+                        note=f"Using parent company '{parent_company}' certifications.",
+                        include_details=include_details
+                    )
+
+        # ===== STEP 4: No match found =====
+        logger.info(f"No match found for brand: '{brand}' with category: '{category}'")
+        return self._get_default_response(
+            found=False,
+            match_type="no_match",
+            note="Brand not found in certification database."
+        )
+
+    def _get_default_response(self, found: bool = False, match_type: str = "no_match", note: str = None) -> Dict[str, Any]:
+        """Get default certification response with match metadata"""
+        return {
+            "found": found,
+            "match_type": match_type,
+            "note": note,
+            "certifications": {
+                "b_corp": False,
+                "fair_trade": False,
+                "rainforest_alliance": False,
+                "leaping_bunny": False,
+                "research_complete": False,
+            },
+            "details": None,
+        }
+
+    def _format_response(
+        self,
+        found: bool,
+        data: CertificationRecord,
+        search_brand: str = None,
+        match_type: str = "exact_match",
+        matched_category: str = None,
+        note: str = None,
+        include_details: bool = True
+    ) -> Dict[str, Any]:
+        """Format certification response with match metadata"""
+        response = {
+            "found": found,
+            "match_type": match_type,
+            "note": note,
+            "certifications": data.certifications,
+            # Raw row data is only materialized when the caller shows it
+            "details": {
+                "original_brand": data.original_brand,
+                "row_data": data.json_row_data,
+            } if include_details else None,
+        }
+
+        if matched_category:
+            response["matched_category"] = matched_category
+
+        # If we found a match and the original brand differs from search, include canonical
+        if (
+            found
+            and search_brand
+            and data.original_brand.lower() != search_brand.lower()
+        ):
+            response["canonical_brand"] = data.original_brand
+            response["search_brand_used"] = search_brand
+
+        return response
+
+# ==================== SCORING MANAGER ====================
+
+class ScoringManager:
+    """Manage all scoring-related operations"""
+
+    @staticmethod
+    def calculate_brand_scores(brand: str, category: str = None) -> BrandData:
+        """
+        Calculate scores for a brand using priority order:
+        1. Parent company identification (for product search)
+        2. Dynamic calculation from certifications (Excel)
+        """
+        # Handle empty/unknown brand
+        if not brand or brand == "Unknown":
+            return BrandData(
+                brand=brand,  # Add this line
+                social=safe_float(ScoringConfig.BASE_SCORE),
+                environmental=safe_float(ScoringConfig.BASE_SCORE),
+                economic=safe_float(ScoringConfig.BASE_SCORE),
+                certifications=[],
+                scoring_method="base_score_only",
+                notes="Base score of 5.0 (no brand identified)",
+            )
+
+        brand_normalized = BrandNormalizer.normalize(brand)
+
+        # Step 1: Check if this is a product that should inherit parent company scores
+        parent_company = BrandNormalizer.find_parent_company(brand)
+        if parent_company:
+            parent_normalized = BrandNormalizer.normalize(parent_company)
+
+            # Only skip inheritance for specific brands that should NOT inherit
+            # (like Digiorno, which has its own empty entry)
+            non_inheriting_brands = ["digiorno", "bai", "nestle pure life", "pure life"]
+
+            if brand_normalized in non_inheriting_brands:
+                logger.info(f"Brand {brand} in non-inheriting list, skipping parent inheritance")
+                # Fall through to dynamic calculation
+            else:
+                logger.info(f"Found parent company '{parent_company}' for '{brand}' - will use dynamic calculation")
+                # Fall through to dynamic calculation
+
+        # Step 2: Dynamic calculation from certifications - PASS THE CATEGORY
+        logger.info(
+            f"Brand '{brand_normalized}' calculating dynamically"
+        )
+        return ScoringManager._calculate_dynamic_scores(brand, category)
+
+    @staticmethod
+    def _calculate_dynamic_scores(brand: str, category: str = None) -> BrandData:
+        """Calculate scores dynamically from certifications"""
+        # Start with base score
+        social_score = ScoringConfig.BASE_SCORE
+        environmental_score = ScoringConfig.BASE_SCORE
+        economic_score = ScoringConfig.BASE_SCORE
+
+        # Get all certifications from combined sources
+        all_certifications = ScoringManager._get_all_certifications(brand, category)
+
+        # Apply certification bonuses
+        bonus_applied = False
+        for cert in all_certifications:
+            if cert in ScoringConfig.CERTIFICATION_BONUSES:
+                bonus = ScoringConfig.CERTIFICATION_BONUSES[cert]
+                social_score += bonus["social"]
+                environmental_score += bonus["environmental"]
+                economic_score += bonus["economic"]
+                bonus_applied = True
+
+        # Apply multi-certification bonus if applicable
+        if bonus_applied and len(all_certifications) > 1:
+            multi_bonus = (len(all_certifications) - 1) * \
+                ScoringConfig.MULTI_CERT_BONUS
+            social_score += multi_bonus
+            environmental_score += multi_bonus
+            economic_score += multi_bonus
+
+        # Cap scores at 10.0
+        social_score = min(10.0, social_score)
+        environmental_score = min(10.0, environmental_score)
+        economic_score = min(10.0, economic_score)
+
+        return BrandData(
+            brand=brand,  # Add this line
+            social=safe_float(social_score),
+            environmental=safe_float(environmental_score),
+            economic=safe_float(economic_score),
+            certifications=all_certifications,
+            scoring_method="dynamic_calculation",
+            multi_cert_bonus=safe_float(
+                (len(all_certifications) - 1) * ScoringConfig.MULTI_CERT_BONUS
+                if bonus_applied and len(all_certifications) > 1
+                else 0.0
+            ),
+            notes="Base 5.0 + certification bonuses + multi-cert bonus (capped at 10.0)",
+        )
+
+    @staticmethod
+    def _get_all_certifications(brand: str, category: str = None) -> List[str]:
+            """Get all certifications from Excel database only"""
+            brand_normalized = BrandNormalizer.normalize(brand)
+
+            # Get certifications from Excel database
+            excel_certs = certification_manager.get_certifications(brand, category, include_details=False)
+
+            # Build certification list from Excel data only
+            excel_cert_list = []
+            if excel_certs["certifications"]["b_corp"]:
+                excel_cert_list.append("B Corp")
+            if excel_certs["certifications"]["fair_trade"]:
+                excel_cert_list.append("Fair Trade")
+            if excel_certs["certifications"]["rainforest_alliance"]:
+                excel_cert_list.append("Rainforest Alliance")
+            if excel_certs["certifications"]["leaping_bunny"]:
+                excel_cert_list.append("Leaping Bunny")
+
+            # Return Excel certifications only
+            return excel_cert_list
+
+
+# ==================== BARCODES ====================
+# Every barcode entry point (/scan, /product, /validate/barcode) reduces a
+# read to one canonical GTIN before any cache or Open Food Facts lookup, so
+# the same product scanned as UPC-A, as EAN-13 with a leading zero, as UPC-E
+# or typed with spaces is one cache entry and one upstream call. Reads whose
+# check digit doesn't match (the usual camera misread) are rejected locally.
+#
+# Canonical keys follow Open Food Facts' own convention: EAN-8 stays 8
+# digits, anything else that fits in 13 digits is EAN-13 (UPC-A gains a
+# leading zero, UPC-E is expanded first), GTIN-14 case codes stay 14.
+
+
+class InvalidBarcodeError(ValueError):
+    """A read that can't be a GTIN: wrong characters, length or check digit"""
+
+
+@dataclass(frozen=True)
+class CanonicalBarcode:
+    """A validated GTIN and how it was read"""
+
+    code: str  # canonical key (EAN-8, EAN-13 or GTIN-14 digits)
+    symbology: str  # EAN-8, UPC-E, UPC-A, EAN-13 or GTIN-14
+    raw: str
+    # Other valid readings of an ambiguous 8-digit read, to try after `code`
+    alternates: tuple = ()
+
+    @property
+    def gtin14(self) -> str:
+        return self.code.zfill(14)
+
+
+class Gtin:
+    """GTIN-8/12/13/14 normalization, UPC-E expansion and check digits"""
+
+    SEPARATORS: ClassVar[str] = " -"
+    # Html5Qrcode formats that aren't GTINs, for /validate/barcode
+    OTHER_FORMATS: ClassVar[tuple] = (
+        ("Code 128", re.compile(r"[\x00-\x7F]+")),
+        ("Code 39", re.compile(r"[A-Z0-9\-\.\ \$\/\+\%]+")),
+        ("Code 93", re.compile(r"[A-Z0-9\-\.\ \$\/\+\%]+")),
+        ("Codabar", re.compile(r"[0-9\-\$\:\.\+\/]+")),
+        ("ITF", re.compile(r"\d+")),  # Interleaved 2 of 5
+        ("PDF417", re.compile(r".+")),
+        ("Data Matrix", re.compile(r".+")),
+        ("QR Code", re.compile(r".+")),
+    )
+
+    @staticmethod
+    def check_digit(body: str) -> str:
+        """Mod-10 check digit for a GTIN without its last digit (weights 3,1,3,... from the right)"""
+        total = 0
+        weight = 3
+        for ch in reversed(body):
+            total += (ord(ch) - 48) * weight
+            weight = 4 - weight
+        return str(-total % 10)
+
+    @staticmethod
+    def is_valid(code: str) -> bool:
+        return len(code) >= 2 and Gtin.check_digit(code[:-1]) == code[-1]
+
+    @staticmethod
+    def expand_upce(code: str) -> Optional[str]:
+        """UPC-E (number system, six digits, check digit) to UPC-A; None if it isn't one"""
+        if len(code) != 8 or code[0] not in "01":
+            return None
+        ns, d, check = code[0], code[1:7], code[7]
+        last = d[5]
+        if last in "012":
+            body = ns + d[0:2] + last + "0000" + d[2:5]
+        elif last == "3":
+            body = ns + d[0:3] + "00000" + d[3:5]
+        elif last == "4":
+            body = ns + d[0:4] + "00000" + d[4]
+        else:
+            body = ns + d[0:5] + "0000" + last
+        return body + check
+
+    @staticmethod
+    def canonicalize(raw: str) -> CanonicalBarcode:
+        """
+        The canonical GTIN for a scanned or typed barcode. Raises
+        InvalidBarcodeError for anything that can't be looked up.
+
+        8 digits starting with 0 read as UPC-E first (GTIN-8s starting with
+        0 are restricted-circulation numbers), others as EAN-8 first; when
+        both check digits hold, the other reading is kept in `alternates`.
+        7 digits are an 8-digit read that lost its leading zero, 6 digits a
+        UPC-E body without number system or check digit (typed off a pack),
+        and 9-14 digits GTINs that lost leading zeros.
+        """
+        text = (raw or "").strip()
+        digits = text
+        for sep in Gtin.SEPARATORS:
+            digits = digits.replace(sep, "")
+        if not digits:
+            raise InvalidBarcodeError("Empty barcode")
+        if not (digits.isascii() and digits.isdigit()):
+            raise InvalidBarcodeError(f"Barcode {text!r} is not numeric, so it isn't a product GTIN")
+
+        length = len(digits)
+        if length == 6:
+            upca = Gtin.expand_upce("0" + digits + "0")
+            upca = upca[:-1] + Gtin.check_digit(upca[:-1])
+            return CanonicalBarcode(code="0" + upca, symbology="UPC-E", raw=text)
+        if length == 7:
+            digits, length = "0" + digits, 8
+        if length == 8:
+            upca = Gtin.expand_upce(digits)
+            readings = [
+                ("UPC-E", "0" + upca if upca is not None and Gtin.is_valid(upca) else None),
+                ("EAN-8", digits if Gtin.is_valid(digits) else None),
+            ]
+            if digits[0] != "0":
+                readings.reverse()
+            readings = [(symbology, code) for symbology, code in readings if code is not None]
+            if not readings:
+                raise InvalidBarcodeError(
+                    f"Barcode {text!r} fails the EAN-8 and UPC-E check digits (likely a misread)"
+                )
+            (symbology, code), others = readings[0], readings[1:]
+            return CanonicalBarcode(
+                code=code, symbology=symbology, raw=text, alternates=tuple(code for _, code in others)
+            )
+        if not 9 <= length <= 14:
+            raise InvalidBarcodeError(f"Barcode {text!r} has {length} digits; GTINs have 8, 12, 13 or 14")
+        if not Gtin.is_valid(digits):
+            raise InvalidBarcodeError(f"Barcode {text!r} fails its check digit (likely a misread)")
+
+        gtin14 = digits.zfill(14)
+        if gtin14.startswith("000000"):
+            # GS1 reserves this prefix for GTIN-8s carried in longer fields
+            return CanonicalBarcode(code=gtin14[6:], symbology="EAN-8", raw=text)
+        if gtin14[0] == "0":
+            symbology = "UPC-A" if gtin14[1] == "0" else "EAN-13"
+            return CanonicalBarcode(code=gtin14[1:], symbology=symbology, raw=text)
+        return CanonicalBarcode(code=gtin14, symbology="GTIN-14", raw=text)
+
+
+# ==================== REQUEST DEADLINES ====================
+# /scan and /product get an overall time budget. The Deadline is passed down
+# to every stage that can wait (Open Food Facts calls, brand extraction
+# searches, dataset reloads); each stage caps its own timeout at what's
+# left and skips itself when too little is left. Skipped stages are
+# recorded, and the response carries "degraded": true with the list, rather
+# than the request running into the worker timeout.
+
+
+@dataclass
+class DeadlineConfig:
+    """Per-endpoint request budgets (seconds) and the least time worth starting a stage with"""
+
+    SCAN_SECONDS: ClassVar[float] = float(os.getenv("SCAN_DEADLINE_SECONDS", "8"))
+    PRODUCT_SECONDS: ClassVar[float] = float(os.getenv("PRODUCT_DEADLINE_SECONDS", "6"))
+    MIN_LOOKUP_SECONDS: ClassVar[float] = 0.5
+    MIN_SEARCH_SECONDS: ClassVar[float] = 1.0
+
+
+class Deadline:
+    """Time budget for one request"""
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def allows(self, seconds: float) -> bool:
+        """At least `seconds` left"""
+        return self.remaining() >= seconds
+
+    def timeout(self, limit: float) -> float:
+        """A stage's own timeout, capped at the remaining budget"""
+        return min(limit, self.remaining())
+
+    def skip(self, stage: str):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+    def fork(self) -> "Deadline":
+        """Same expiry, own skip list: for work whose outcome may be thrown away"""
+        child = Deadline(0)
+        child.budget, child.expires_at = self.budget, self.expires_at
+        return child
+
+    def merge(self, child: "Deadline"):
+        for stage in child.skipped:
+            self.skip(stage)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.skipped)
+
+
+# ==================== OPEN FOOD FACTS CIRCUIT BREAKERS ====================
+# One breaker per OFF host. A breaker opens when, over the last
+# WINDOW_SECONDS, enough calls failed (errors, timeouts, 5xx/429) or were
+# slow; while open, calls to that host are refused without touching the
+# network. After OPEN_SECONDS a few probe calls are let through (half-open):
+# if they succeed the breaker closes, otherwise it opens again. While the
+# main Open Food Facts host is open the app runs degraded: /scan and
+# /product use the product cache, the workbook and brand text extraction
+# only. Breakers are per worker process.
+
+
+@dataclass
+class BreakerConfig:
+    """Thresholds for the Open Food Facts circuit breakers"""
+
+    WINDOW_SECONDS: ClassVar[float] = float(os.getenv("OFF_BREAKER_WINDOW_SECONDS", "60"))
+    # Don't judge a host on fewer calls than this
+    MIN_CALLS: ClassVar[int] = int(os.getenv("OFF_BREAKER_MIN_CALLS", "5"))
+    ERROR_RATE: ClassVar[float] = float(os.getenv("OFF_BREAKER_ERROR_RATE", "0.5"))
+    SLOW_SECONDS: ClassVar[float] = float(os.getenv("OFF_BREAKER_SLOW_SECONDS", "3"))
+    SLOW_RATE: ClassVar[float] = float(os.getenv("OFF_BREAKER_SLOW_RATE", "0.8"))
+    OPEN_SECONDS: ClassVar[float] = float(os.getenv("OFF_BREAKER_OPEN_SECONDS", "30"))
+    HALF_OPEN_PROBES: ClassVar[int] = 2
+    PRIMARY_HOST: ClassVar[str] = "world.openfoodfacts.org"
+
+
+class OffUnavailableError(Exception):
+    """The host's breaker is open; the call was not made"""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a sliding window of call outcomes"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = self.CLOSED
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._opened_at = 0.0
+        self._probes = 0  # half-open calls in flight
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = None
+
+    def _prune(self, now: float):
+        cutoff = now - BreakerConfig.WINDOW_SECONDS
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.trips += 1
+        logger.warning(f"Circuit breaker for {self.host} opened ({self.last_error or 'slow responses'})")
+
+    def _cooling(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < BreakerConfig.OPEN_SECONDS
+
+    def refusing(self) -> bool:
+        """
+        Open and still cooling down, so admit() would say no; callers check
+        this to skip work up front. Doesn't start probing or count a rejection.
+        """
+        with self._lock:
+            return self._cooling()
+
+    def refuse(self) -> bool:
+        """refusing(), counting a rejection when it's true; for the caller that drops the call"""
+        with self._lock:
+            if self._cooling():
+                self.rejected += 1
+                return True
+            return False
+
+    def admit(self) -> Optional[str]:
+        """
+        The state a call goes out under (CLOSED, or HALF_OPEN for a probe),
+        or None if it must not go out now.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if self._cooling():
+                    self.rejected += 1
+                    return None
+                self.state = self.HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= BreakerConfig.HALF_OPEN_PROBES:
+                    self.rejected += 1
+                    return None
+                self._probes += 1
+            return self.state
+
+    def record(self, admitted: str, ok: bool, elapsed: float, error: str = None):
+        """Outcome of a call admit() let through under the `admitted` state"""
+        now = time.monotonic()
+        slow = elapsed >= BreakerConfig.SLOW_SECONDS
+        with self._lock:
+            if not ok:
+                self.last_error = error
+            if admitted != self.state:
+                return  # the breaker moved on while this call was out
+            if self.state == self.HALF_OPEN:
+                if not ok or slow:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= BreakerConfig.HALF_OPEN_PROBES:
+                        self.state = self.CLOSED
+                        logger.info(f"Circuit breaker for {self.host} closed")
+                return
+            self._calls.append((now, not ok, slow))
+            self._prune(now)
+            calls = len(self._calls)
+            if calls < BreakerConfig.MIN_CALLS:
+                return
+            failed = sum(1 for _, f, _ in self._calls if f)
+            slow_calls = sum(1 for _, _, s in self._calls if s)
+            if failed / calls >= BreakerConfig.ERROR_RATE or slow_calls / calls >= BreakerConfig.SLOW_RATE:
+                self._open(now)
+
+    def cancel(self, admitted: str):
+        """A call admit() let through was abandoned by its caller; no verdict on the host"""
+        with self._lock:
+            if admitted == self.HALF_OPEN and self.state == self.HALF_OPEN:
+                self._probes -= 1  # let another probe take its place
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_failures": sum(1 for _, f, _ in self._calls if f),
+                "window_slow": sum(1 for _, _, s in self._calls if s),
+                "retry_in_seconds": (
+                    round(max(0.0, BreakerConfig.OPEN_SECONDS - (now - self._opened_at)), 1)
+                    if self.state == self.OPEN else None
+                ),
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+class OffBreakers:
+    """Breakers for every Open Food Facts host the app calls"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker(host))
+        return breaker
+
+    @property
+    def degraded(self) -> bool:
+        """True while the main OFF host's breaker is open (or probing)"""
+        return self.for_host(BreakerConfig.PRIMARY_HOST).state != CircuitBreaker.CLOSED
+
+    def refusing(self, host: str = BreakerConfig.PRIMARY_HOST) -> bool:
+        return self.for_host(host).refusing()
+
+    def refuse(self, host: str = BreakerConfig.PRIMARY_HOST) -> bool:
+        return self.for_host(host).refuse()
+
+    async def get(self, client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+        """client.get through the host's breaker; OffUnavailableError if it's open"""
+        breaker = self.for_host(urlsplit(url).hostname)
+        admitted = breaker.admit()
+        if admitted is None:
+            raise OffUnavailableError(f"{breaker.host} is unavailable (circuit open)")
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, **kwargs)
+        except asyncio.CancelledError:
+            # The caller lost interest (e.g. a speculative search); says nothing about the host
+            breaker.cancel(admitted)
+            raise
+        except Exception as e:
+            # Timeouts and connection errors count against the host
+            breaker.record(admitted, False, time.perf_counter() - started, f"{type(e).__name__}: {e}"[:200])
+            raise
+        ok = response.status_code < 500 and response.status_code != 429
+        breaker.record(admitted, ok, time.perf_counter() - started, None if ok else f"HTTP {response.status_code}")
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "degraded": self.degraded,
+            "hosts": {host: breaker.stats() for host, breaker in sorted(self._breakers.items())},
+        }
+
+
+off_breakers = OffBreakers()
+
+
+# ==================== OPEN FOOD FACTS OUTBOUND SCHEDULER ====================
+# Every OFF request waits here for a slot on its host: at most
+# MAX_CONCURRENCY calls in flight per host, and a token from the host's
+# bucket. OFF asks API clients for at most 100 product reads and 10
+# searches a minute, split here across the worker processes. Waiters are
+# served interactive lane first, then batch, then background, and in
+# arrival order within a lane. A waiter gives up after its lane's queue
+# timeout or when its request deadline runs out, and doesn't queue at all
+# when the bucket can't refill for it in that time. Like the breakers, this
+# is per worker process.
+
+
+@dataclass
+class OutboundConfig:
+    """Limits for outbound Open Food Facts traffic"""
+
+    MAX_CONCURRENCY: ClassVar[int] = int(os.getenv("OFF_MAX_CONCURRENCY", "8"))
+    # Deployment-wide rates; each worker gets its share (gunicorn runs 2, see Procfile)
+    WORKER_PROCESSES: ClassVar[int] = max(1, int(os.getenv("WEB_CONCURRENCY", "2")))
+    PRODUCT_RATE_PER_MINUTE: ClassVar[float] = float(os.getenv("OFF_PRODUCT_RATE_PER_MINUTE", "100"))
+    SEARCH_RATE_PER_MINUTE: ClassVar[float] = float(os.getenv("OFF_SEARCH_RATE_PER_MINUTE", "10"))
+    SEARCH_PATHS: ClassVar[List[str]] = ["/cgi/search.pl", "/api/v2/search"]
+    # Highest priority first
+    LANES: ClassVar[List[str]] = ["interactive", "batch", "background"]
+    QUEUE_TIMEOUT_SECONDS: ClassVar[Dict[str, float]] = {"interactive": 5.0, "batch": 30.0, "background": 120.0}
+    QUEUE_SAMPLES: ClassVar[int] = 512
+
+
+class OffBusyError(OffUnavailableError):
+    """No slot for the host within the lane's queue timeout or the request deadline"""
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` tokens are available"""
+        self._refill()
+        return 0.0 if self.tokens >= tokens else (tokens - self.tokens) / self.rate
+
+
+class OutboundLane:
+    """Queue-time metrics for one priority lane"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.waits = deque(maxlen=OutboundConfig.QUEUE_SAMPLES)
+
+    def record(self, waited: float):
+        self.requests += 1
+        if waited > 0:
+            self.queued += 1
+        self.waits.append(waited)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def percentile(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else None
+
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "queue_ms_p50": percentile(0.5),
+            "queue_ms_p99": percentile(0.99),
+            "queue_ms_max": round(waits[-1] * 1000, 2) if waits else None,
+        }
+
+
+class HostSlots:
+    """Concurrency limit, token bucket and priority queue for one OFF host (and request kind)"""
+
+    def __init__(self, name: str, rate_per_minute: float):
+        self.name = name
+        rate = rate_per_minute / 60.0 / OutboundConfig.WORKER_PROCESSES
+        # A burst of about ten seconds' worth, so a page of scans doesn't queue
+        self.bucket = TokenBucket(rate, max(1.0, rate * 10))
+        self.active = 0
+        self._waiters = []  # heap of (lane rank, seq, future)
+        self._seq = 0
+        self._timer = None
+        self._timer_loop = None
+
+    def _grant(self) -> bool:
+        if self.active < OutboundConfig.MAX_CONCURRENCY and self.bucket.take():
+            self.active += 1
+            return True
+        return False
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters, best lane first; arm a timer if tokens ran out"""
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():  # gave up waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._grant():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        if self._waiters and self.active < OutboundConfig.MAX_CONCURRENCY:
+            loop = asyncio.get_running_loop()
+            if self._timer is None or self._timer_loop is not loop:
+                self._timer = loop.call_later(self.bucket.wait_time(), self._on_timer)
+                self._timer_loop = loop
+
+    async def acquire(self, lane: str, timeout: float) -> float:
+        """
+        Wait for a slot; returns the seconds spent queued. Raises
+        asyncio.TimeoutError straight away when the bucket can't refill for
+        this waiter and those queued ahead of it within `timeout`.
+        """
+        if not self._waiters and self._grant():
+            return 0.0
+        rank = OutboundConfig.LANES.index(lane)
+        ahead = sum(1 for r, _, f in self._waiters if r <= rank and not f.done())
+        if self.bucket.wait_time(ahead + 1.0) > timeout:
+            raise asyncio.TimeoutError()
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (rank, self._seq, future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just as we gave up
+            else:
+                future.cancel()
+            raise
+        return time.monotonic() - started
+
+    def release(self):
+        self.active -= 1
+        if self._waiters:
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": sum(1 for _, _, f in self._waiters if not f.done()),
+            "tokens": round(self.bucket.tokens, 2),
+            "rate_per_minute": round(self.bucket.rate * 60, 2),
+        }
+
+
+class OutboundScheduler:
+    """Shared gate for all outbound Open Food Facts requests"""
+
+    def __init__(self):
+        self._hosts: Dict[str, HostSlots] = {}
+        self.lanes = {lane: OutboundLane() for lane in OutboundConfig.LANES}
+
+    def slots_for(self, url: str) -> HostSlots:
+        parts = urlsplit(url)
+        search = any(parts.path.startswith(p) for p in OutboundConfig.SEARCH_PATHS)
+        key = f"{parts.hostname} search" if search else parts.hostname
+        slots = self._hosts.get(key)
+        if slots is None:
+            rate = OutboundConfig.SEARCH_RATE_PER_MINUTE if search else OutboundConfig.PRODUCT_RATE_PER_MINUTE
+            slots = self._hosts[key] = HostSlots(key, rate)
+        return slots
+
+    @asynccontextmanager
+    async def slot(self, url: str, lane: str = "interactive", deadline: Optional[Deadline] = None):
+        """Hold one of the host's slots for the duration of a request"""
+        slots = self.slots_for(url)
+        timeout = OutboundConfig.QUEUE_TIMEOUT_SECONDS[lane]
+        if deadline is not None:
+            timeout = deadline.timeout(timeout)
+        try:
+            waited = await slots.acquire(lane, timeout)
+        except asyncio.TimeoutError:
+            self.lanes[lane].timeouts += 1
+            raise OffBusyError(f"{slots.name}: no slot within {timeout:.1f}s ({lane})")
+        self.lanes[lane].record(waited)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": OutboundConfig.MAX_CONCURRENCY,
+            "lanes": {lane: metrics.stats() for lane, metrics in self.lanes.items()},
+            "hosts": {name: slots.stats() for name, slots in sorted(self._hosts.items())},
+        }
+
+
+off_scheduler = OutboundScheduler()
+
+
+# ==================== OPEN FOOD FACTS CLIENT ====================
+
+
+class OpenFoodFactsClient:
+    """Client for Open Food Facts API"""
+
+    # Without fields= OFF sends the whole product document (every language,
+    # image set and nutrient table, often hundreds of KB); ask only for what
+    # _extract_product_info and _analyze_products read.
+    PRODUCT_FIELDS = ",".join([
+        "code", "product_name", "product_name_en", "product_name_fr",
+        "brands", "brand", "brand_owner", "manufacturer",
+        "categories", "categories_tags", "countries",
+        "ecoscore_grade", "ecoscore_score", "nutriscore_grade", "nutriscore_score",
+        "ingredients_text", "allergens", "image_url", "nutriments", "last_modified_t",
+    ])
+    SEARCH_FIELDS = ",".join([
+        "code", "product_name", "brands", "brand", "brand_owner", "manufacturer",
+        "categories", "countries", "image_small_url",
+    ])
+    PRODUCT_SOURCES = [
+        ("world.openfoodfacts.org", "Open Food Facts"),
+        ("world.openpetfoodfacts.org", "Open Pet Food Facts"),
+        ("world.openproductsfacts.org", "Open Products Facts"),
+        ("world.openbeautyfacts.org", "Open Beauty Facts"),
+    ]
+
+    @staticmethod
+    def product_url(host: str, barcode: str) -> str:
+        return f"https://{host}/api/v2/product/{barcode}?fields={OpenFoodFactsClient.PRODUCT_FIELDS}"
+
+    @staticmethod
+    async def get(
+        client: httpx.AsyncClient,
+        url: str,
+        timeout: float,
+        lane: str = "interactive",
+        deadline: Optional[Deadline] = None,
+    ) -> httpx.Response:
+        """
+        Every OFF request goes through here: wait for a scheduler slot on the
+        host, then call it through the host's breaker, with the timeout capped
+        at what's left of the deadline once the slot is granted. Raises
+        OffUnavailableError (or OffBusyError) when the call isn't made.
+        """
+        host = urlsplit(url).hostname
+        if off_breakers.refuse(host):
+            raise OffUnavailableError(f"{host} is unavailable (circuit open)")
+        async with off_scheduler.slot(url, lane, deadline):
+            return await off_breakers.get(
+                client,
+                url,
+                headers={"User-Agent": "TBLGroceryScanner/1.0"},
+                timeout=deadline.timeout(timeout) if deadline is not None else timeout,
+            )
+
+    @staticmethod
+    async def search_by_name(
+        product_name: str,
+        max_results: int = 20,
+        deadline: Optional[Deadline] = None,
+        lane: str = "interactive",
+    ) -> Dict[str, Any]:
+        """Enhanced search Open Food Facts by product name with better brand extraction"""
+        if off_breakers.refusing() or (
+            deadline is not None and not deadline.allows(DeadlineConfig.MIN_SEARCH_SECONDS)
+        ):
+            return OpenFoodFactsClient._unavailable_search(deadline)
+        try:
+            async with httpx.AsyncClient(timeout=15.0) as client:
+                encoded_name = quote(product_name)
+                url = (
+                    f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={encoded_name}"
+                    f"&search_simple=1&action=process&json=1&page_size={max_results}"
+                    f"&fields={OpenFoodFactsClient.SEARCH_FIELDS}"
+                )
+
+                response = await OpenFoodFactsClient.get(client, url, 15.0, lane, deadline)
+
+                if response.status_code == 200:
+                    data = response.json()
+                    products = data.get("products", [])
+
+                    if not products:
+                        return {
+                            "found": False,
+                            "message": "No products found",
+                            "products": [],
+                            "brand_analysis": {},
+                        }
+
+                    return OpenFoodFactsClient._analyze_products(products)
+                else:
+                    return {
+                        "found": False,
+                        "message": f"Open Food Facts API error: {response.status_code}",
+                        "products": [],
+                        "brand_analysis": {},
+                    }
+        except OffUnavailableError:
+            return OpenFoodFactsClient._unavailable_search(deadline)
+        except Exception as e:
+            logger.error(
+                f"Open Food Facts search error for '{product_name}': {e}")
+            if deadline is not None and not deadline.allows(DeadlineConfig.MIN_SEARCH_SECONDS):
+                return OpenFoodFactsClient._unavailable_search(deadline)
+            return {
+                "found": False,
+                "message": f"Search error: {str(e)}",
+                "products": [],
+                "brand_analysis": {},
+            }
+
+    @staticmethod
+    def _unavailable_search(deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Search skipped: breaker open or no budget left"""
+        if deadline is not None:
+            deadline.skip("open_food_facts_search")
+        return {
+            "found": False,
+            "message": "Open Food Facts search skipped (unavailable or out of time)",
+            "products": [],
+            "brand_analysis": {},
+            "degraded": True,
+        }
+
+    @staticmethod
+    def _analyze_products(products: List[Dict]) -> Dict[str, Any]:
+        """Analyze products to extract brand information"""
+        brand_candidates = []
+        brand_details = {}
+
+        for product in products:
+            # Extract brand from multiple fields with priority
+            brand_fields_priority = [
+                ("brands", 2.0),
+                ("brand", 1.8),
+                ("brand_owner", 1.5),
+                ("manufacturer", 1.3),
+            ]
+
+            for field, weight in brand_fields_priority:
+                if field in product and product[field]:
+                    field_value = str(product[field]).strip()
+                    if field_value and field_value.lower() not in [
+                        "",
+                        "unknown",
+                        "n/a",
+                        "none",
+                    ]:
+                        # Split by common separators
+                        for separator in [",", ";", "/", "|", "&", "+"]:
+                            if separator in field_value:
+                                parts = [
+                                    p.strip()
+                                    for p in field_value.split(separator)
+                                    if p.strip()
+                                ]
+                                for part in parts:
+                                    if part and len(part) > 1:
+                                        # Add multiple times based on weight
+                                        for _ in range(int(weight)):
+                                            brand_candidates.append(part)
+                                break
+                        else:
+                            # No separator, add the whole value
+                            for _ in range(int(weight)):
+                                brand_candidates.append(field_value)
+
+                        # Store details for the first occurrence
+                        normalized_brand = BrandNormalizer.normalize(
+                            field_value.split(",")[0]
+                            if "," in field_value
+                            else field_value
+                        )
+                        if normalized_brand not in brand_details:
+                            brand_details[normalized_brand] = {
+                                "original_brand": field_value, "product_name": product.get(
+                                    "product_name", ""), "product_id": product.get(
+                                    "code", ""), "categories": product.get(
+                                    "categories", ""), "countries": product.get(
+                                    "countries", ""), "source_field": field, }
+                        break
+
+        return OpenFoodFactsClient._analyze_brand_candidates(
+            brand_candidates, brand_details, products
+        )
+
+    @staticmethod
+    def _analyze_brand_candidates(
+        brand_candidates: List[str], brand_details: Dict, products: List[Dict]
+    ) -> Dict[str, Any]:
+        """Analyze brand candidates to determine best match"""
+        total_candidates = len(brand_candidates)
+
+        if total_candidates == 0:
+            return {
+                "found": False,
+                "message": "No brands found in search results",
+                "products": products[:5],
+                "brand_analysis": {},
+            }
+
+        # Calculate brand distribution
+        brand_counts = Counter(brand_candidates)
+        total_with_brands = sum(brand_counts.values())
+
+        # Calculate percentages
+        brand_percentages = {}
+        for brand, count in brand_counts.items():
+            if count > 0:
+                percentage = (count / total_with_brands) * 100
+                brand_percentages[brand] = round(percentage, 1)
+
+        # Sort brands by frequency
         sorted_brands = sorted(
             brand_counts.items(),
             key=lambda x: x[1],
             reverse=True)
         top_brand = sorted_brands[0][0] if sorted_brands else None
 
-        return {
-            "found": True,
-            "message": f"Found {len(products)} products",
-            "products": products[: min(10, len(products))],
-            "brand_analysis": {
-                "total_products": len(products),
-                "total_brand_candidates": total_candidates,
-                "brand_counts": dict(sorted_brands[:10]),
-                "brand_percentages": brand_percentages,
-                "top_brand": top_brand,
-                "brand_details": brand_details,
-            },
+        return {
+            "found": True,
+            "message": f"Found {len(products)} products",
+            "products": products[: min(10, len(products))],
+            "brand_analysis": {
+                "total_products": len(products),
+                "total_brand_candidates": total_candidates,
+                "brand_counts": dict(sorted_brands[:10]),
+                "brand_percentages": brand_percentages,
+                "top_brand": top_brand,
+                "brand_details": brand_details,
+            },
+        }
+
+    @staticmethod
+    async def lookup_barcode(
+        barcode: str, deadline: Optional[Deadline] = None, lane: str = "interactive", alternates: tuple = ()
+    ) -> Dict[str, Any]:
+        """
+        Lookup product from Open Food Facts with comprehensive data extraction.
+        `barcode` is a canonical GTIN (Gtin.canonicalize), which is also the cache key;
+        `alternates` (other readings of an ambiguous read) are tried in turn when it isn't found.
+        With a deadline, each source gets at most the remaining budget and
+        sources are skipped once it runs low (the result is then marked degraded).
+        Batch and background callers pass their lane so scans go first.
+        """
+        if alternates:
+            first = None
+            for code in (barcode, *alternates):
+                result = await OpenFoodFactsClient.lookup_barcode(code, deadline, lane)
+                if result.get("found") or result.get("degraded"):
+                    return result
+                first = first or result
+            return first
+
+        cached = PRODUCT_CACHE.get(barcode)
+        if cached is not None:
+            return cached
+
+        # Degraded: don't wait on Open Food Facts, callers fall back to local data
+        degraded = off_breakers.refusing()
+        try:
+            if degraded:
+                raise OffUnavailableError(BreakerConfig.PRIMARY_HOST)
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                # List of APIs to check in order (v2, projected to the fields we read)
+                apis = [
+                    {"url": OpenFoodFactsClient.product_url(host, barcode), "name": name}
+                    for host, name in OpenFoodFactsClient.PRODUCT_SOURCES
+                ]
+
+                for api in apis:
+                    if deadline is not None and not deadline.allows(DeadlineConfig.MIN_LOOKUP_SECONDS):
+                        degraded = True
+                        break
+                    try:
+                        response = await OpenFoodFactsClient.get(client, api["url"], 10.0, lane, deadline)
+                    except OffUnavailableError:
+                        if api is apis[0]:
+                            degraded = True
+                            raise
+                        continue  # skip just this source
+
+                    if response.status_code == 200:
+                        data = response.json()
+                        if data.get("status") == 1:
+                            product = data.get("product", {})
+                            logger.info(f"Product found in {api['name']} for barcode: {barcode}")
+                            return OpenFoodFactsClient._extract_product_info(
+                                barcode, product
+                            )
+
+        except OffUnavailableError:
+            logger.info(f"Open Food Facts unavailable, skipped lookup for barcode {barcode}")
+        except Exception as e:
+            logger.error(
+                f"Open Food Facts lookup error for barcode {barcode}: {e}")
+            # Timed out because the request's budget ran out, not because OFF said no
+            if deadline is not None and not deadline.allows(DeadlineConfig.MIN_LOOKUP_SECONDS):
+                degraded = True
+
+        result = {
+            "barcode": barcode,
+            "found": False,
+            "brand": "Unknown",
+            "name": "Unknown",
+            "category": "Unknown",
+        }
+        if degraded:
+            result["degraded"] = True
+            if deadline is not None:
+                deadline.skip("open_food_facts_lookup")
+        return result
+
+    @staticmethod
+    def _extract_product_info(barcode: str, product: Dict) -> Dict[str, Any]:
+        """Extract product information from Open Food Facts data"""
+        # Enhanced brand extraction
+        brand = "Unknown"
+        brand_fields = ["brands", "brand", "brand_owner", "manufacturer"]
+
+        for field in brand_fields:
+            if field in product and product[field]:
+                brand_value = str(product[field]).strip()
+                if brand_value and brand_value.lower() not in [
+                        "", "unknown", "n/a"]:
+                    brand = (
+                        brand_value.split(",")[0].strip()
+                        if "," in brand_value
+                        else brand_value
+                    )
+                    break
+
+        # Try to extract brand from product name if still unknown
+        if brand == "Unknown":
+            name = product.get("product_name", "")
+            if name:
+                extracted = BrandNormalizer.extract_brand_from_product_text(
+                    name)
+                if extracted:
+                    brand = extracted
+
+        # Extract product name
+        name = product.get("product_name", "")
+        if not name:
+            name = product.get(
+                "product_name_en", product.get("product_name_fr", "Unknown")
+            )
+
+        # Extract category
+        categories = product.get("categories", "")
+        category = "Unknown"
+        category_list = []
+        if categories:
+            category_list = [c.strip()
+                             for c in categories.split(",") if c.strip()]
+            if category_list:
+                category = category_list[-1]
+        # Full hierarchy for category resolution; tags are language-neutral
+        category_path = product.get("categories_tags") or category_list
+
+        product_info = {
+            "barcode": barcode,
+            "name": name if name else "Unknown",
+            "brand": brand,
+            "category": category,
+            "category_path": category_path,
+            "eco_score": product.get("ecoscore_grade", "Unknown"),
+            "eco_score_value": product.get("ecoscore_score", None),
+            "nutriscore": product.get("nutriscore_grade", "Unknown"),
+            "nutriscore_value": product.get("nutriscore_score", None),
+            "found": True,
+            "ingredients": product.get("ingredients_text", ""),
+            "allergens": product.get("allergens", ""),
+            "image_url": product.get("image_url", ""),
+            "countries": product.get("countries", ""),
+            "energy_kcal": product.get("nutriments", {}).get("energy-kcal_100g", None),
+            "fat": product.get("nutriments", {}).get("fat_100g", None),
+            "carbohydrates": product.get("nutriments", {}).get(
+                "carbohydrates_100g", None
+            ),
+            "proteins": product.get("nutriments", {}).get("proteins_100g", None),
+            "salt": product.get("nutriments", {}).get("salt_100g", None),
+            "last_updated": product.get("last_modified_t"),
+        }
+
+        PRODUCT_CACHE[barcode] = product_info
+        return product_info
+
+
+# ==================== BRAND EXTRACTION MANAGER ====================
+# Multi-word names go through the local strategies (direct match, then text
+# extraction) and, if those fail, an Open Food Facts search. In speculative
+# mode the search is started alongside the local strategies rather than
+# after them, so a miss costs max(local, search) instead of the sum. A
+# confident local answer still wins and cancels the search. The search
+# waits HEDGE_SECONDS before going out: local strategies normally answer
+# within a few ms, and every search sent spends one of OFF's ten search
+# tokens a minute.
+
+
+@dataclass
+class BrandExtractionConfig:
+    """Speculative brand extraction"""
+
+    SPECULATIVE: ClassVar[bool] = os.getenv("BRAND_EXTRACTION_SPECULATIVE", "1").lower() not in ("0", "false", "no")
+    HEDGE_SECONDS: ClassVar[float] = float(os.getenv("BRAND_EXTRACTION_HEDGE_SECONDS", "0.05"))
+    # Local answers at least this confident win outright; every local strategy
+    # answers with 80+, so results match the sequential order
+    MIN_LOCAL_CONFIDENCE: ClassVar[int] = 80
+
+
+class BrandExtractionManager:
+    """Manager for brand extraction from product names"""
+
+    @staticmethod
+    async def extract_brand_from_product_name(
+            product_name: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Main function to extract brand from product name using multiple strategies.
+        The Open Food Facts search strategy is skipped when the deadline is nearly spent.
+        The result's "execution" says which strategy won and how long each side took.
+        """
+        logger.info(
+            f"Attempting to extract brand from product name: '{product_name}'")
+
+        # Strategy 3 (Open Food Facts search) only applies to product-like names
+        searchable = len(product_name.split()) > 1
+        if searchable and BrandExtractionConfig.SPECULATIVE:
+            return await BrandExtractionManager._extract_speculatively(product_name, deadline)
+
+        started = time.perf_counter()
+        result = BrandExtractionManager._run_local_strategies(product_name)
+        if result is not None:
+            return BrandExtractionManager._with_execution(result, "sequential", "local", started)
+
+        # Strategy 3: Search Open Food Facts for product-like names
+        if searchable:
+            result = await BrandExtractionManager._search_open_food_facts(product_name, deadline)
+            return BrandExtractionManager._with_execution(result, "sequential", "open_food_facts", started)
+
+        # Strategy 4: Single word input - likely a brand name
+        result = await BrandExtractionManager._handle_single_word_input(product_name)
+        return BrandExtractionManager._with_execution(result, "sequential", "fuzzy_match", started)
+
+    @staticmethod
+    async def _extract_speculatively(product_name: str, deadline: Optional[Deadline]) -> Dict[str, Any]:
+        """Local strategies on a thread while the (hedged) OFF search runs; see the section comment"""
+        started = time.perf_counter()
+        remote = {}  # "sent" once the search goes out, "ms" when it's back
+        # Stages the search skips only count if its answer is used
+        search_deadline = deadline.fork() if deadline is not None else None
+
+        async def search():
+            if BrandExtractionConfig.HEDGE_SECONDS > 0:
+                await asyncio.sleep(BrandExtractionConfig.HEDGE_SECONDS)
+            remote["sent"] = time.perf_counter()
+            result = await BrandExtractionManager._search_open_food_facts(product_name, search_deadline)
+            remote["ms"] = round((time.perf_counter() - remote["sent"]) * 1000, 2)
+            return result
+
+        task = asyncio.create_task(search())
+        try:
+            local = await asyncio.to_thread(BrandExtractionManager._run_local_strategies, product_name)
+        except BaseException:
+            task.cancel()
+            raise
+        local_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        if local is not None and local["confidence"] >= BrandExtractionConfig.MIN_LOCAL_CONFIDENCE:
+            task.cancel()
+            return BrandExtractionManager._with_execution(
+                local, "speculative", "local", started,
+                local_ms=local_ms, remote_cancelled=True, remote_sent="sent" in remote,
+            )
+
+        result = await task
+        winner = "open_food_facts"
+        if local is not None and not result["success"]:
+            result, winner = local, "local"  # a less confident local answer beats a failed search
+        elif deadline is not None:
+            deadline.merge(search_deadline)
+        return BrandExtractionManager._with_execution(
+            result, "speculative", winner, started,
+            local_ms=local_ms, remote_ms=remote.get("ms"), remote_cancelled=False, remote_sent=True,
+        )
+
+    @staticmethod
+    def _with_execution(result: Dict[str, Any], mode: str, winner: str, started: float, **details) -> Dict[str, Any]:
+        result["execution"] = {
+            "mode": mode,
+            "winner": winner,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+            **details,
+        }
+        return result
+
+    @staticmethod
+    def _run_local_strategies(product_name: str) -> Optional[Dict[str, Any]]:
+        """Strategies 1 and 2, in order; the first success, or None"""
+        # Strategy 1: Direct brand name check
+        result = BrandExtractionManager._check_direct_brand_match(product_name)
+        if result["success"]:
+            return result
+
+        # Strategy 2: Try to extract brand directly from product name text
+        direct_brand = BrandNormalizer.extract_brand_from_product_text(
+            product_name)
+        if direct_brand:
+            logger.info(
+                f"Direct extraction found brand: '{direct_brand}' from product name"
+            )
+            return BrandExtractionManager._format_result(
+                success=True,
+                message=f"Brand '{direct_brand}' extracted directly from input",
+                extracted_brand=direct_brand,
+                confidence=85,
+                method="direct_extraction",
+                reason=f"Found '{direct_brand}' directly in input text",
+            )
+
+        return None
+
+    @staticmethod
+    def _check_direct_brand_match(product_name: str) -> Dict[str, Any]:
+        """Check if input is already a known brand (from Excel data only)"""
+        brand_normalized = BrandNormalizer.normalize(product_name)
+
+        # Check if the input is in the Excel data
+        if certification_manager.data is not None:
+            # Check exact match
+            if brand_normalized in certification_manager.data:
+                first_product = next(iter(certification_manager.data[brand_normalized].values()))
+                original_brand = first_product.original_brand
+                logger.info(
+                    f"Input is a known brand in Excel: '{original_brand}'"
+                )
+                return BrandExtractionManager._format_result(
+                    success=True,
+                    message=f"Input recognized as brand: '{original_brand}'",
+                    extracted_brand=original_brand,
+                    confidence=90,
+                    method="direct_brand_recognition",
+                    reason=f"'{original_brand}' found in Excel certification database",
+                )
+
+            # Check for brand synonyms and aliases
+            if brand_normalized in BrandNormalizer.BRAND_SYNONYMS:
+                canonical_brand = BrandNormalizer.BRAND_SYNONYMS[brand_normalized]
+                # Only use if canonical brand exists in Excel
+                if canonical_brand in certification_manager.data:
+                    logger.info(
+                        f"Input matches brand synonym: '{brand_normalized}' → '{canonical_brand}'"
+                    )
+                    return BrandExtractionManager._format_result(
+                        success=True,
+                        message=f"Brand synonym recognized: '{canonical_brand}'",
+                        extracted_brand=canonical_brand.title(),
+                        confidence=85,
+                        method="brand_synonym_match",
+                        reason=f"'{brand_normalized}' is a synonym for '{canonical_brand}'",
+                    )
+
+            # Check for brand aliases
+            for alias, canonical in BrandNormalizer.BRAND_ALIASES.items():
+                if alias == brand_normalized and canonical in certification_manager.data:
+                    logger.info(
+                        f"Input matches brand alias: '{brand_normalized}' → '{canonical}'"
+                    )
+                    return BrandExtractionManager._format_result(
+                        success=True,
+                        message=f"Brand alias recognized: '{canonical}'",
+                        extracted_brand=canonical.title(),
+                        confidence=85,
+                        method="brand_alias_match",
+                        reason=f"'{brand_normalized}' is an alias for '{canonical}'",
+                    )
+
+            # Check if the input contains a known brand name - find the longest match
+            longest_match = None
+            longest_match_key = None
+            for brand_key in certification_manager.data.keys():
+                brand_key_normalized = brand_key  # Already normalized from Excel
+                if brand_key_normalized and len(brand_key_normalized) > 2:
+                    if brand_key_normalized in brand_normalized:
+                        if longest_match is None or len(brand_key_normalized) > len(longest_match):
+                            longest_match = brand_key_normalized
+                            longest_match_key = brand_key
+
+            if longest_match_key:
+                first_product = next(iter(certification_manager.data[longest_match_key].values()))
+                original_brand = first_product.original_brand
+                logger.info(
+                    f"Found brand '{original_brand}' in input: '{product_name}'")
+                return BrandExtractionManager._format_result(
+                    success=True,
+                    message=f"Brand '{original_brand}' found in input",
+                    extracted_brand=original_brand,
+                    confidence=80,
+                    method="brand_in_input",
+                    reason=f"Brand '{original_brand}' found within input text",
+                )
+
+        return BrandExtractionManager._format_result(
+            success=False,
+            message="No direct brand match found",
+            extracted_brand=None,
+            confidence=0,
+            method="direct_check",
+        )
+
+    @staticmethod
+    async def _search_open_food_facts(product_name: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Search Open Food Facts for brand information"""
+        search_result = await OpenFoodFactsClient.search_by_name(
+            product_name, max_results=20, deadline=deadline
+        )
+
+        if not search_result["found"]:
+            # OFF was skipped (breaker open or out of time): say so, the caller answered from local data only
+            degraded = {"degraded": True} if search_result.get("degraded") else {}
+            # Fallback to parent company mapping
+            parent_company = BrandNormalizer.find_parent_company(product_name)
+            if parent_company:
+                logger.info(
+                    f"Fallback to parent company: '{parent_company}' for product '{product_name}'"
+                )
+                return BrandExtractionManager._format_result(
+                    success=True,
+                    message=f"Using parent company '{parent_company}' for product",
+                    extracted_brand=parent_company.title(),
+                    confidence=75,
+                    method="parent_company_mapping",
+                    parent_company=parent_company,
+                    warning="Using parent company mapping (not from Open Food Facts)",
+                    reason=f"Product '{product_name}' belongs to parent company '{parent_company}'",
+                    **degraded,
+                )
+
+            return BrandExtractionManager._format_result(
+                success=False,
+                message=search_result["message"],
+                extracted_brand=None,
+                confidence=0,
+                method="search_failed",
+                search_results=search_result,
+                **degraded,
+            )
+
+        # Get top brand from search results
+        brand_analysis = search_result["brand_analysis"]
+        top_brand = brand_analysis.get("top_brand")
+
+        if not top_brand:
+            # Try parent company as fallback
+            parent_company = BrandNormalizer.find_parent_company(product_name)
+            if parent_company:
+                return BrandExtractionManager._format_result(
+                    success=True,
+                    message=f"Using parent company '{parent_company}' (no clear brand from search)",
+                    extracted_brand=parent_company.title(),
+                    confidence=70,
+                    method="parent_company_fallback",
+                    parent_company=parent_company,
+                    warning="Using parent company as fallback",
+                    reason=f"Product '{product_name}' belongs to parent company '{parent_company}'",
+                )
+
+            return BrandExtractionManager._format_result(
+                success=False,
+                message="No brand could be determined from search results",
+                extracted_brand=None,
+                confidence=0,
+                method="search_failed",
+                parent_company=None,
+                search_results=search_result,
+            )
+
+        # Successfully extracted brand from search
+        return BrandExtractionManager._process_search_result(
+            product_name, top_brand, search_result
+        )
+
+    @staticmethod
+    def _process_search_result(
+        product_name: str, extracted_brand: str, search_result: Dict
+    ) -> Dict[str, Any]:
+        """Process search result to determine final brand"""
+        parent_company = BrandNormalizer.find_parent_company(product_name)
+
+        if parent_company:
+            normalized_extracted = BrandNormalizer.normalize(extracted_brand)
+            normalized_parent = BrandNormalizer.normalize(parent_company)
+
+            # If parent company is different, consider using it
+            if normalized_extracted != normalized_parent:
+                # Check if parent company is a known national brand
+                if normalized_parent in BrandNormalizer.NATIONAL_BRANDS:
+                    logger.info(
+                        f"Using parent company '{parent_company}' instead of extracted '{extracted_brand}'"
+                    )
+                    extracted_brand = parent_company.title()
+                    confidence = 80
+                    method = "parent_company_override"
+                    reason = (
+                        f"Parent company '{parent_company}' is a known national brand"
+                    )
+                else:
+                    confidence = 70
+                    method = "search_extraction"
+                    reason = f"Brand '{extracted_brand}' extracted from search results"
+            else:
+                confidence = 75
+                method = "search_extraction"
+                reason = f"Brand '{extracted_brand}' extracted from search results"
+        else:
+            confidence = 70
+            method = "search_extraction"
+            reason = f"Brand '{extracted_brand}' extracted from search results"
+
+        return BrandExtractionManager._format_result(
+            success=True,
+            message=f"Brand '{extracted_brand}' extracted from Open Food Facts",
+            extracted_brand=extracted_brand,
+            confidence=confidence,
+            method=method,
+            parent_company=parent_company,
+            reason=reason,
+            search_results={
+                "total_products": search_result["brand_analysis"].get(
+                    "total_products",
+                    0),
+                "total_brand_candidates": search_result["brand_analysis"].get(
+                    "total_brand_candidates",
+                    0),
+            },
+        )
+
+    @staticmethod
+    async def _handle_single_word_input(product_name: str) -> Dict[str, Any]:
+        """Handle single word input - likely a brand name (from Excel data only)"""
+        brand_normalized = BrandNormalizer.normalize(product_name)
+
+        # Check for fuzzy matches with brands from Excel
+        best_match = None
+        best_score = 0.0
+
+        if certification_manager.data is not None:
+            for brand_key in certification_manager.data.keys():
+                brand_key_normalized = brand_key  # Already normalized from Excel
+                similarity = SequenceMatcher(
+                    None, brand_normalized, brand_key_normalized
+                ).ratio()
+
+                if (
+                    similarity > best_score and similarity >= 0.7
+                ):  # 70% similarity threshold
+                    best_score = similarity
+                    best_match = brand_key
+
+            if best_match:
+                first_product = next(iter(certification_manager.data[best_match].values()))
+                original_brand = first_product.original_brand
+                logger.info(
+                    f"Fuzzy match found: '{brand_normalized}' → '{original_brand}' ({best_score:.1%} similarity)"
+                )
+                confidence = int(best_score * 100)
+                return BrandExtractionManager._format_result(
+                    success=True,
+                    message=f"Fuzzy match found for '{product_name}'",
+                    extracted_brand=original_brand,
+                    confidence=confidence,
+                    method="fuzzy_match",
+                    warning=f"Using fuzzy match ({best_score:.1%} similarity)",
+                    reason=f"'{product_name}' closely matches known brand '{original_brand}'",
+                )
+
+        # If we get here, we couldn't identify the brand
+        return BrandExtractionManager._format_result(
+            success=False,
+            message=f"Could not identify brand from '{product_name}'",
+            extracted_brand=None,
+            confidence=0,
+            method="failed",
+            warning="Input could not be identified as a brand or product",
+            reason="No matches found in Excel certification database or product search",
+        )
+
+    @staticmethod
+    def _format_result(
+        success: bool,
+        message: str,
+        extracted_brand: Optional[str],
+        confidence: int,
+        method: str,
+        parent_company: Optional[str] = None,
+        warning: Optional[str] = None,
+        reason: Optional[str] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Format brand extraction result"""
+        result = {
+            "success": success,
+            "message": message,
+            "extracted_brand": extracted_brand,
+            "original_extracted_brand": extracted_brand,
+            "confidence": confidence,
+            "method": method,
+            "parent_company": parent_company,
+            "alternative_brands": [],
+            "warning": warning,
+            "reason": reason,
         }
 
+        # Add any additional keyword arguments
+        result.update(kwargs)
+        return result
+
+
+# ==================== PASSWORD UTILITIES ====================
+# bcrypt costs ~250 ms of CPU per call at cost 12. Running it inline in an
+# async handler stalls every request on the worker, so hashing and checking
+# go to a small process pool and the event loop only awaits the result.
+
+
+@dataclass
+class PasswordConfig:
+    """Configuration for password hashing and login throttling"""
+
+    BCRYPT_ROUNDS: ClassVar[int] = DEFAULT_BCRYPT_ROUNDS
+    POOL_WORKERS: ClassVar[int] = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    MAX_PENDING: ClassVar[int] = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+    # Token buckets: capacity = burst size, refill = tokens per second
+    LOGIN_USER_CAPACITY: ClassVar[float] = float(os.getenv("LOGIN_USER_BURST", "5"))
+    LOGIN_USER_REFILL: ClassVar[float] = float(os.getenv("LOGIN_USER_PER_MINUTE", "5")) / 60.0
+    LOGIN_IP_CAPACITY: ClassVar[float] = float(os.getenv("LOGIN_IP_BURST", "20"))
+    LOGIN_IP_REFILL: ClassVar[float] = float(os.getenv("LOGIN_IP_PER_MINUTE", "20")) / 60.0
+    # Proxies in front of the app that append to X-Forwarded-For (Render: 1; 0 = ignore the header)
+    TRUSTED_PROXY_HOPS: ClassVar[int] = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+
+class PasswordHasher:
+    """Run bcrypt in a bounded process pool so the event loop never blocks on it"""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pending = asyncio.Semaphore(max(1, max_pending))
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn, not fork: children start clean rather than copying this
+                # worker's threads and SQLite connections. The pool targets live in
+                # auth.py; under gunicorn that's all a child imports. Run as
+                # `python elegant_app.py`, spawn also re-imports this module as
+                # __mp_main__ in each child, repeating the module-level setup
+                # (stores, dataset snapshot, product cache) but not the server.
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"Started password hashing pool with {self.workers} workers")
+            return self._pool
+
+    async def _run(self, func, *args):
+        from concurrent.futures.process import BrokenProcessPool
+
+        loop = asyncio.get_running_loop()
+        # Bound the queue so a login burst can't pile up unbounded bcrypt work
+        async with self._pending:
+            try:
+                return await loop.run_in_executor(self._get_pool(), func, *args)
+            except (BrokenProcessPool, OSError) as e:
+                logger.error(f"Password pool unavailable ({e}), hashing in a thread")
+                self.shutdown()
+                return await asyncio.to_thread(func, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password_sync, password, PasswordConfig.BCRYPT_ROUNDS)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password_sync, password, hashed_password)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets (e.g. one per username, one per client IP)"""
+
+    def __init__(self, capacity: float, refill_per_second: float, max_keys: int = 10000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key: str, tokens: float = 1.0) -> float:
+        """Take tokens for key; returns 0 on success or seconds until allowed"""
+        now = time.monotonic()
+        with self._lock:
+            available, last = self._buckets.pop(key, (self.capacity, now))
+            available = min(self.capacity, available + (now - last) * self.refill_per_second)
+
+            if available >= tokens:
+                wait = 0.0
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.refill_per_second if self.refill_per_second else float("inf")
+
+            self._buckets[key] = (available, now)
+            # Drop the least recently seen keys so memory stays bounded
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+password_hasher = PasswordHasher(PasswordConfig.POOL_WORKERS, PasswordConfig.MAX_PENDING)
+login_user_limiter = TokenBucketLimiter(
+    PasswordConfig.LOGIN_USER_CAPACITY, PasswordConfig.LOGIN_USER_REFILL
+)
+login_ip_limiter = TokenBucketLimiter(
+    PasswordConfig.LOGIN_IP_CAPACITY, PasswordConfig.LOGIN_IP_REFILL
+)
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    Client IP for rate limiting. Earlier X-Forwarded-For entries are
+    whatever the client sent, so only the address our own proxies appended
+    (TRUSTED_PROXY_HOPS from the end) can be trusted.
+    """
+    hops = PasswordConfig.TRUSTED_PROXY_HOPS
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and hops > 0:
+        entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()]
+        if entries:
+            return entries[-min(hops, len(entries))]
+    return request.client.host if request.client else "unknown"
+
+
+# ==================== PROFILING ====================
+# Opt-in (PROFILER_ENABLED=true) and admin-only. The sampler is a daemon
+# thread that snapshots every thread's stack with sys._current_frames() a few
+# hundred times a second; nothing is hooked into the interpreter, so the
+# worker runs at full speed between samples. ?profile=1 instead runs one
+# request under cProfile and attaches the top functions to its JSON body.
+
+
+@dataclass
+class ProfilerConfig:
+    """Configuration for the sampling profiler and ?profile=1"""
+
+    ENABLED: ClassVar[bool] = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    MAX_SECONDS: ClassVar[float] = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+    DEFAULT_INTERVAL_MS: ClassVar[float] = 5.0
+    REQUEST_TOP_FUNCTIONS: ClassVar[int] = 25
+
+
+# Leaf frames of a thread that is just waiting (event loop select, pool workers)
+IDLE_FRAMES: Set[str] = {"select", "poll", "epoll", "kqueue", "wait", "_worker", "accept"}
+
+
+class SamplingProfiler:
+    """Collapsed-stack sampler (output is flamegraph.pl / speedscope compatible)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
     @staticmethod
-    async def lookup_barcode(barcode: str) -> Dict[str, Any]:
-        """Lookup product from Open Food Facts with comprehensive data extraction"""
-        if barcode in PRODUCT_CACHE:
-            return PRODUCT_CACHE[barcode]
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+    def _collapse(self, frame, thread_name: str) -> str:
+        labels = []
+        while frame is not None:
+            labels.append(self._frame_label(frame))
+            frame = frame.f_back
+        labels.append(thread_name)
+        return ";".join(reversed(labels))
+
+    def sample(self, seconds: float, interval: float, include_idle: bool = False) -> Dict[str, Any]:
+        """Blocking: sample all other threads for `seconds` (run it off the event loop)"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            me = threading.get_ident()
+            counts = Counter()
+            samples = idle = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if not include_idle and frame.f_code.co_name in IDLE_FRAMES:
+                        idle += 1
+                        continue
+                    counts[self._collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+                samples += 1
+                time.sleep(interval)
+            return {"samples": samples, "idle_samples": idle, "stacks": counts}
+        finally:
+            self._lock.release()
+
+
+sampling_profiler = SamplingProfiler()
+_request_profile_lock = threading.Lock()
+
 
+def summarize_cprofile(profile, limit: int) -> Dict[str, Any]:
+    """Top functions by cumulative time from a cProfile.Profile"""
+    import pstats
+
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": nc,
+            "total_ms": round(tt * 1000, 3),
+            "cumulative_ms": round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return {"total_ms": round(stats.total_tt * 1000, 3), "top": rows[:limit]}
+
+
+@app.middleware("http")
+async def profile_request_middleware(request: Request, call_next):
+    """Run one request under cProfile when called with ?profile=1"""
+    if request.query_params.get("profile") != "1" or not ProfilerConfig.ENABLED:
+        return await call_next(request)
+
+    try:
+        verify_auth(request.headers.get("Authorization"))
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+
+    # cProfile is per thread and only one can run at a time; it also sees
+    # any other request interleaved on this loop while we await.
+    if not _request_profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Profile"] = "skipped: another profile is running"
+        return response
+
+    import cProfile
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # List of APIs to check in order
-                apis = [
-                    {
-                        "url": f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json",
-                        "name": "Open Food Facts"
-                    },
-                    {
-                        "url": f"https://world.openpetfoodfacts.org/api/v0/product/{barcode}.json",
-                        "name": "Open Pet Food Facts"
-                    },
-                    {
-                        "url": f"https://world.openproductsfacts.org/api/v0/product/{barcode}.json",
-                        "name": "Open Products Facts"
-                    },
-                    {
-                        "url": f"https://world.openbeautyfacts.org/api/v0/product/{barcode}.json",
-                        "name": "Open Beauty Facts"
-                    }
-                ]
+            response = await call_next(request)
+            body = b"".join([chunk async for chunk in response.body_iterator])
+        finally:
+            profile.disable()
+    finally:
+        _request_profile_lock.release()
+
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    if response.media_type == "application/json" or headers.get("content-type", "").startswith("application/json"):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            payload["_profile"] = summarize_cprofile(profile, ProfilerConfig.REQUEST_TOP_FUNCTIONS)
+            headers.pop("content-type", None)
+            return JSONResponse(payload, status_code=response.status_code, headers=headers)
 
-                for api in apis:
-                    response = await client.get(
-                        api["url"],
-                        headers={"User-Agent": "TBLGroceryScanner/1.0"},
-                    )
+    headers["X-Profile"] = "skipped: response is not a JSON object"
+    return Response(content=body, status_code=response.status_code, headers=headers)
 
-                    if response.status_code == 200:
-                        data = response.json()
-                        if data.get("status") == 1:
-                            product = data.get("product", {})
-                            logger.info(f"Product found in {api['name']} for barcode: {barcode}")
-                            return OpenFoodFactsClient._extract_product_info(
-                                barcode, product
-                            )
 
-        except Exception as e:
-            logger.error(
-                f"Open Food Facts lookup error for barcode {barcode}: {e}")
+# ==================== HTTP RESPONSE CACHE ====================
+# Read-mostly endpoints serialize their body once per version of what they
+# are built from (the dataset version, a file signature) and keep the bytes.
+# Every response carries a strong ETag of those bytes; a client that sends it
+# back in If-None-Match gets a 304 with no body.
+
+
+@dataclass
+class HttpCacheConfig:
+    """Configuration for cached read-only responses"""
+
+    MAX_AGE: ClassVar[int] = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+    MAX_ENTRIES: ClassVar[int] = 512
+    # /test/scoring pages, one per (brand, category) asked for; crawlers walk many
+    SCORE_PAGE_ENTRIES: ClassVar[int] = int(os.getenv("SCORE_PAGE_CACHE_SIZE", "256"))
+    # Memoized /scan and /product results (a few KB each)
+    RESULT_ENTRIES: ClassVar[int] = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+    RESULT_MAX_BYTES: ClassVar[int] = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
 
+@dataclass(frozen=True)
+class CachedBody:
+    """Serialized response body with its ETag"""
+
+    body: bytes
+    media_type: str
+    etag: str
+
+    @classmethod
+    def from_bytes(cls, body: bytes, media_type: str, etag: str = None) -> "CachedBody":
+        return cls(body, media_type, etag or f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+class ResponseCache:
+    """
+    Serialized bodies keyed by (name, version, *args).
+
+    When a name is requested under a new version, its entries for older
+    versions are dropped, so a reload never leaves stale copies behind.
+    """
+
+    def __init__(self, max_entries: int = HttpCacheConfig.MAX_ENTRIES, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._by_name = {}  # name -> [hits, misses]
+
+    @staticmethod
+    def _size(value) -> int:
+        body = getattr(value, "body", None)
+        return len(body) if isinstance(body, bytes) else 0
+
+    def get(self, name: str, version: str, *args):
+        """The cached value, or None (counted as a miss)"""
+        key = (name, version, *args)
+        with self._lock:
+            counts = self._by_name.setdefault(name, [0, 0])
+            cached = self._entries.get(key)
+            if cached is not None:
+                self.hits += 1
+                counts[0] += 1
+                self._entries.move_to_end(key)
+                return cached
+            self.misses += 1
+            counts[1] += 1
+            return None
+
+    def put(self, name: str, version: str, value, *args):
+        key = (name, version, *args)
+        with self._lock:
+            if self._versions.get(name) != version:
+                self._versions[name] = version
+                for stale in [k for k in self._entries if k[0] == name and k[1] != version]:
+                    self.bytes -= self._size(self._entries.pop(stale))
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self._size(previous)
+            self._entries[key] = value
+            self.bytes += self._size(value)
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 1
+            ):
+                self.bytes -= self._size(self._entries.popitem(last=False)[1])
+
+    def get_or_build(self, name: str, version: str, build, *args) -> CachedBody:
+        """Return the cached body, calling build() -> CachedBody on a miss"""
+        cached = self.get(name, version, *args)
+        if cached is None:
+            cached = build()
+            self.put(name, version, cached, *args)
+        return cached
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
         return {
-            "barcode": barcode,
-            "found": False,
-            "brand": "Unknown",
-            "name": "Unknown",
-            "category": "Unknown",
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "by_name": {
+                name: {"hits": h, "misses": m, "hit_rate": round(h / (h + m), 4) if h + m else 0.0}
+                for name, (h, m) in sorted(self._by_name.items())
+            },
         }
 
-    @staticmethod
-    def _extract_product_info(barcode: str, product: Dict) -> Dict[str, Any]:
-        """Extract product information from Open Food Facts data"""
-        # Enhanced brand extraction
-        brand = "Unknown"
-        brand_fields = ["brands", "brand", "brand_owner", "manufacturer"]
 
-        for field in brand_fields:
-            if field in product and product[field]:
-                brand_value = str(product[field]).strip()
-                if brand_value and brand_value.lower() not in [
-                        "", "unknown", "n/a"]:
-                    brand = (
-                        brand_value.split(",")[0].strip()
-                        if "," in brand_value
-                        else brand_value
-                    )
-                    break
+def cached_json(content: Any, etag: str = None) -> CachedBody:
+    return CachedBody.from_bytes(encode_json(content), "application/json", etag)
 
-        # Try to extract brand from product name if still unknown
-        if brand == "Unknown":
-            name = product.get("product_name", "")
-            if name:
-                extracted = BrandNormalizer.extract_brand_from_product_text(
-                    name)
-                if extracted:
-                    brand = extracted
 
-        # Extract product name
-        name = product.get("product_name", "")
-        if not name:
-            name = product.get(
-                "product_name_en", product.get("product_name_fr", "Unknown")
-            )
+@dataclass(frozen=True)
+class MemoizedResult:
+    """
+    A /scan or /product result, encoded once without its volatile fields
+    (timestamps). Each response appends them with the current time, so a
+    hit costs a bytes concatenation rather than the whole pipeline.
+    """
+
+    body: bytes
+    volatile: tuple
+
+    @classmethod
+    def from_content(cls, content: Dict[str, Any], volatile) -> "MemoizedResult":
+        # Only stamp fields that carry a time; a None stays as it is
+        stamped = tuple(k for k in volatile if content.get(k) is not None)
+        return cls(encode_json({k: v for k, v in content.items() if k not in stamped}), stamped)
+
+    def response(self, cache_status: str) -> Response:
+        now = datetime.utcnow().isoformat().encode()
+        stamps = b",".join(b'"%s":"%s"' % (k.encode(), now) for k in self.volatile)
+        body = self.body
+        if stamps:
+            body = body[:-1] + (b"," if len(body) > 2 else b"") + stamps + b"}"
+        return Response(content=body, media_type="application/json", headers={"X-Result-Cache": cache_status})
+
+
+def result_cache_version(dataset: Optional["DatasetVersion"]) -> Optional[str]:
+    """Memoized results are valid for one dataset version and one scoring configuration"""
+    return f"{dataset.version}:{ScoringConfig.version()}" if dataset is not None else None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/"x" matches "x" """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == opaque for tag in candidates)
+
+
+def cache_headers(etag: str, max_age: int = None) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={HttpCacheConfig.MAX_AGE if max_age is None else max_age}",
+    }
+
+
+def conditional_response(request: Request, cached: CachedBody, max_age: int = None) -> Response:
+    """200 with the cached body, or 304 when the client already has it"""
+    headers = cache_headers(cached.etag, max_age)
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type=cached.media_type, headers=headers)
+
+
+def file_signature(path: str) -> str:
+    """Version string for a file on disk (changes when it is rewritten)"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# ==================== STATIC ASSETS ====================
+# The HTML pages are read once, compressed once (gzip, and brotli when it is
+# installed) and served from memory with a strong ETag per encoding. A stat
+# every few seconds notices when a file is edited or redeployed.
+
+
+@dataclass
+class StaticAssetConfig:
+    """Caching and compression for the HTML pages"""
+
+    MAX_AGE: ClassVar[int] = int(os.getenv("STATIC_MAX_AGE", "300"))
+    CHECK_SECONDS: ClassVar[float] = float(os.getenv("STATIC_CHECK_SECONDS", "2"))
+    MIN_COMPRESS_BYTES: ClassVar[int] = 1024
+    GZIP_LEVEL: ClassVar[int] = 9
+    BROTLI_QUALITY: ClassVar[int] = 11
+    # Rendered pages are compressed on a cache miss, so trade ratio for speed
+    RENDERED_GZIP_LEVEL: ClassVar[int] = 6
+    RENDERED_BROTLI_QUALITY: ClassVar[int] = 5
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding -> {coding: q}; '*' stands for any coding not listed"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+@dataclass(frozen=True)
+class CompressedBody:
+    """One response body in every content coding worth sending, each with its own strong ETag"""
+
+    # Preferred first
+    ENCODINGS: ClassVar[tuple] = ("br", "gzip")
+
+    variants: Dict[str, CachedBody]  # content coding ("identity", "gzip", "br") -> body
+
+    @classmethod
+    def from_bytes(
+        cls,
+        body: bytes,
+        media_type: str,
+        gzip_level: int = StaticAssetConfig.GZIP_LEVEL,
+        brotli_quality: int = StaticAssetConfig.BROTLI_QUALITY,
+    ) -> "CompressedBody":
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {"identity": CachedBody(body, media_type, f'"{digest}"')}
+        if len(body) >= StaticAssetConfig.MIN_COMPRESS_BYTES:
+            compressed = {"gzip": gzip.compress(body, gzip_level, mtime=0)}
+            brotli = get_brotli()
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=brotli_quality)
+            for coding, data in compressed.items():
+                if len(data) < len(body):
+                    variants[coding] = CachedBody(data, media_type, f'"{digest}-{coding}"')
+        return cls(variants)
+
+    @classmethod
+    def rendered_html(cls, content: str) -> "CompressedBody":
+        return cls.from_bytes(
+            content.encode("utf-8"),
+            "text/html; charset=utf-8",
+            StaticAssetConfig.RENDERED_GZIP_LEVEL,
+            StaticAssetConfig.RENDERED_BROTLI_QUALITY,
+        )
+
+    def choose(self, accept_encoding: Optional[str]) -> tuple:
+        """(content coding, CachedBody) to send for an Accept-Encoding header"""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in self.ENCODINGS:
+            if coding in self.variants and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+                return coding, self.variants[coding]
+        return "identity", self.variants["identity"]
+
+    def response(self, request: Request, max_age: int = None) -> Response:
+        """200 with the best encoding the client accepts, or 304 if it has this content"""
+        coding, cached = self.choose(request.headers.get("accept-encoding"))
+        headers = cache_headers(cached.etag, max_age)
+        headers["Vary"] = "Accept-Encoding"
+        if_none_match = request.headers.get("if-none-match")
+        # Any variant's tag means the client holds the current content
+        if any(etag_matches(if_none_match, variant.etag) for variant in self.variants.values()):
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=cached.body, media_type=cached.media_type, headers=headers)
+
+    def sizes(self) -> str:
+        return ", ".join(f"{coding} {len(v.body)}" for coding, v in self.variants.items())
+
+
+class StaticAsset:
+    """One file served from memory, with precompressed variants"""
+
+    def __init__(self, path: str, media_type: str):
+        self.path = path
+        self.media_type = media_type
+        self.signature = None
+        self.body: Optional[CompressedBody] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, signature: str):
+        with open(self.path, "rb") as f:
+            self.body = CompressedBody.from_bytes(f.read(), self.media_type)
+        self.signature = signature
+        logger.info(f"📦 Cached static asset {self.path} ({self.body.sizes()} bytes)")
+
+    def refresh(self):
+        """Reload if the file changed on disk (checked at most every CHECK_SECONDS)"""
+        now = time.monotonic()
+        if self.body is not None and now - self._checked < StaticAssetConfig.CHECK_SECONDS:
+            return
+        with self._lock:
+            if self.body is not None and now - self._checked < StaticAssetConfig.CHECK_SECONDS:
+                return
+            try:
+                signature = file_signature(self.path)
+            except FileNotFoundError:
+                self.body, self.signature = None, None
+                raise
+            if signature != self.signature:
+                self._load(signature)
+            self._checked = now
+
+    def response(self, request: Request) -> Response:
+        self.refresh()
+        return self.body.response(request, StaticAssetConfig.MAX_AGE)
+
+
+class StaticAssets:
+    """StaticAsset per path, created on first request"""
+
+    def __init__(self):
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, media_type: str = "text/html") -> StaticAsset:
+        asset = self._assets.get(path)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.setdefault(path, StaticAsset(path, media_type))
+        return asset
+
+    def response(self, request: Request, path: str, media_type: str = "text/html") -> Response:
+        return self.get(path, media_type).response(request)
+
+
+# ==================== CERTIFICATION EXPORT ====================
+# /certifications/export streams one row per (brand, category) record straight
+# from the dataset in batches, so memory stays flat however big the workbook
+# is. A page boundary is found with a cheap first pass over the packed flags
+# (no raw rows are read), which lets the next-page cursor go out as a header
+# before the body starts.
+
+
+@dataclass
+class ExportConfig:
+    """Configuration for /certifications/export"""
+
+    BATCH_ROWS: ClassVar[int] = 1000
+    PARQUET_ROW_GROUP: ClassVar[int] = 10000
+    MEDIA_TYPES: ClassVar[Dict[str, str]] = {
+        "json": "application/json",
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv; charset=utf-8",
+        "parquet": "application/vnd.apache.parquet",
+    }
+
+
+class ExportCursorError(ValueError):
+    """Cursor is malformed"""
+
+
+class StaleCursorError(ExportCursorError):
+    """Cursor was issued for another dataset version"""
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class CertificationExport:
+    """
+    One export request over a DatasetVersion.
+
+    Records come out in workbook order: brands as loaded, then each brand's
+    categories. A cursor is the (brand index, category offset) position of
+    the next matching record, tied to the dataset version it was issued for.
+    The brand order is listed once per version, so a page seeks straight to
+    its brand instead of walking the index from the start.
+    """
+
+    _brand_order: ClassVar[tuple] = (None, ())  # (dataset version, brand keys)
+
+    def __init__(
+        self,
+        dataset: DatasetVersion,
+        fmt: str = "json",
+        category: str = None,
+        certifications: List[str] = None,
+        research_complete: bool = None,
+        include_row_data: bool = True,
+        limit: int = None,
+        cursor: str = None,
+    ):
+        self.dataset = dataset
+        self.format = fmt
+        self.category = category.strip().lower() if category and category.strip() else None
+        self.required_flags = 0
+        for name in certifications or []:
+            self.required_flags |= CERTIFICATION_FLAGS[name]
+        self.research_complete = research_complete
+        self.include_row_data = include_row_data
+        self.limit = limit
+        self.start = self.decode_cursor(cursor) if cursor else (0, 0)
+        self.columns = list(dataset.rows.columns) if include_row_data else []
+
+    # ----- cursors -----
+
+    def encode_cursor(self, position) -> str:
+        raw = f"{self.dataset.version}:{position[0]}:{position[1]}"
+        return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii").rstrip("=")
+
+    def decode_cursor(self, cursor: str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+            version, brand_index, offset = raw.split(":")
+            position = (int(brand_index), int(offset))
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ExportCursorError("Malformed cursor") from e
+        if version != self.dataset.version:
+            raise StaleCursorError("The dataset changed since this cursor was issued; restart the export")
+        return position
+
+    @property
+    def etag(self) -> str:
+        """The output is a pure function of the dataset version and the request"""
+        request_key = json.dumps([
+            self.format, self.category, self.required_flags, self.research_complete,
+            self.include_row_data, self.limit, self.start,
+        ])
+        return f'"{self.dataset.version}-{hashlib.sha256(request_key.encode()).hexdigest()[:16]}"'
+
+    # ----- record selection -----
+
+    def matches(self, record: CertificationRecord) -> bool:
+        if self.required_flags and record.flags & self.required_flags != self.required_flags:
+            return False
+        if self.research_complete is not None and record.research_complete != self.research_complete:
+            return False
+        if self.category is not None and record.category.lower() != self.category:
+            return False
+        return True
+
+    def brand_keys(self) -> tuple:
+        version, keys = CertificationExport._brand_order
+        if version != self.dataset.version:
+            keys = tuple(self.dataset.data)
+            CertificationExport._brand_order = (self.dataset.version, keys)
+        return keys
+
+    def _positions(self):
+        """(position, brand_key, product_key, record) for matching records from the cursor on"""
+        brand_index, offset = self.start
+        data, keys = self.dataset.data, self.brand_keys()
+        for brand_index in range(brand_index, len(keys)):
+            brand_key = keys[brand_index]
+            products = data[brand_key]
+            for key_offset, (product_key, record) in enumerate(
+                islice(products.items(), offset, None), start=offset
+            ):
+                if self.matches(record):
+                    yield (brand_index, key_offset), brand_key, product_key, record
+            offset = 0
+
+    def next_cursor(self) -> Optional[str]:
+        """Cursor for the page after this one (None on the last page)"""
+        if self.limit is None:
+            return None
+        for position, *_ in islice(self._positions(), self.limit, self.limit + 1):
+            return self.encode_cursor(position)
+        return None
+
+    def records(self):
+        records = ((brand_key, product_key, record) for _, brand_key, product_key, record in self._positions())
+        return records if self.limit is None else islice(records, self.limit)
+
+    # ----- output -----
+
+    def row(self, brand_key: str, record: CertificationRecord) -> Dict[str, Any]:
+        row = {"brand": brand_key, "original_brand": record.original_brand, "category": record.category}
+        row.update(record.certifications)
+        return row
+
+    def stream(self):
+        """Yield the body in batches"""
+        writer = getattr(self, f"_stream_{self.format}")
+        return writer()
+
+    def _batches(self):
+        batch = []
+        for item in self.records():
+            batch.append(item)
+            if len(batch) >= ExportConfig.BATCH_ROWS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _stream_json(self):
+        """The original nested {brand: {category: record}} object, written brand by brand"""
+        def dumps(value) -> str:
+            # Same encoding as JSONResponse
+            return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+        yield b"{"
+        first = True
+        current_brand, products = None, {}
+        for batch in self._batches():
+            parts = []
+            for brand_key, product_key, record in batch:
+                if brand_key != current_brand and products:
+                    parts.append(("" if first else ",") + dumps(current_brand) + ":" + dumps(products))
+                    first = False
+                    products = {}
+                current_brand = brand_key
+                products[product_key] = record.to_dict(self.include_row_data)
+            yield "".join(parts).encode("utf-8")
+        if products:
+            yield (("" if first else ",") + dumps(current_brand) + ":" + dumps(products)).encode("utf-8")
+        yield b"}"
+
+    def _stream_ndjson(self):
+        for batch in self._batches():
+            lines = []
+            for brand_key, _, record in batch:
+                row = self.row(brand_key, record)
+                if self.include_row_data:
+                    row["row_data"] = record.json_row_data
+                lines.append(json.dumps(row, ensure_ascii=False, allow_nan=False, separators=(",", ":")))
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _cell_text(value) -> Optional[str]:
+        """Raw cell as text for CSV/Parquet; missing values stay missing"""
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return None
+        text = str(value)
+        return None if text == "NaT" else text
+
+    def _flat_rows(self, batch):
+        for brand_key, _, record in batch:
+            row = self.row(brand_key, record)
+            if self.include_row_data:
+                raw = record.row_data
+                for column in self.columns:
+                    row[f"row_data.{column}"] = self._cell_text(raw.get(column))
+            yield row
+
+    def _field_names(self) -> List[str]:
+        return (
+            ["brand", "original_brand", "category", *CERTIFICATION_FLAGS]
+            + [f"row_data.{column}" for column in self.columns]
+        )
+
+    def _stream_csv(self):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self._field_names())
+        writer.writeheader()
+        for batch in self._batches():
+            writer.writerows(self._flat_rows(batch))
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    def _stream_parquet(self):
+        pa = lazy_import("pyarrow")
+        pq = lazy_import("pyarrow.parquet")
+        fields = [pa.field(name, pa.string()) for name in ("brand", "original_brand", "category")]
+        fields += [pa.field(name, pa.bool_()) for name in CERTIFICATION_FLAGS]
+        fields += [pa.field(f"row_data.{column}", pa.string()) for column in self.columns]
+        schema = pa.schema(fields)
+
+        sink = _ChunkSink()
+        with pq.ParquetWriter(sink, schema) as writer:
+            rows = []
+            for batch in self._batches():
+                rows.extend(self._flat_rows(batch))
+                if len(rows) >= ExportConfig.PARQUET_ROW_GROUP:
+                    writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                    rows = []
+                    yield sink.drain()
+            if rows:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+
+
+# ==================== WORKBOOK UPLOADS ====================
+# An upload is streamed to a temp file next to the live workbook and the
+# request returns a job id straight away. A single background thread then
+# parses and validates the file, and only a workbook that passes replaces
+# the live one (os.replace, so readers see the old file or the new one,
+# never half of each). Job state lives in SQLite so any worker can answer
+# GET /certifications/upload/{job_id}.
 
-        # Extract category
-        categories = product.get("categories", "")
-        category = "Unknown"
-        if categories:
-            category_list = [c.strip()
-                             for c in categories.split(",") if c.strip()]
-            if category_list:
-                category = category_list[-1]
 
-        product_info = {
-            "barcode": barcode,
-            "name": name if name else "Unknown",
-            "brand": brand,
-            "category": category,
-            "eco_score": product.get("ecoscore_grade", "Unknown"),
-            "eco_score_value": product.get("ecoscore_score", None),
-            "nutriscore": product.get("nutriscore_grade", "Unknown"),
-            "nutriscore_value": product.get("nutriscore_score", None),
-            "found": True,
-            "ingredients": product.get("ingredients_text", ""),
-            "allergens": product.get("allergens", ""),
-            "image_url": product.get("image_url", ""),
-            "countries": product.get("countries", ""),
-            "energy_kcal": product.get("nutriments", {}).get("energy-kcal_100g", None),
-            "fat": product.get("nutriments", {}).get("fat_100g", None),
-            "carbohydrates": product.get("nutriments", {}).get(
-                "carbohydrates_100g", None
-            ),
-            "proteins": product.get("nutriments", {}).get("proteins_100g", None),
-            "salt": product.get("nutriments", {}).get("salt_100g", None),
-            "last_updated": product.get("last_modified_t"),
-        }
+@dataclass
+class UploadConfig:
+    """Limits for workbook uploads"""
 
-        PRODUCT_CACHE[barcode] = product_info
-        return product_info
+    CHUNK_BYTES: ClassVar[int] = 1024 * 1024
+    MAX_BYTES: ClassVar[int] = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    # Refuse a workbook with fewer than this fraction of the current rows (unless forced)
+    MIN_ROW_RATIO: ClassVar[float] = float(os.getenv("UPLOAD_MIN_ROW_RATIO", "0.5"))
+    KEEP_JOBS: ClassVar[int] = 50
+    SAMPLE_SIZE: ClassVar[int] = 10
 
 
-# ==================== BRAND EXTRACTION MANAGER ====================
+class WorkbookValidationError(ValueError):
+    """The uploaded workbook can't replace the live one"""
 
 
-class BrandExtractionManager:
-    """Manager for brand extraction from product names"""
+class UploadTooLargeError(WorkbookValidationError):
+    """The upload is over UploadConfig.MAX_BYTES"""
 
-    @staticmethod
-    async def extract_brand_from_product_name(
-            product_name: str) -> Dict[str, Any]:
-        """Main function to extract brand from product name using multiple strategies"""
-        logger.info(
-            f"Attempting to extract brand from product name: '{product_name}'")
 
-        # Strategy 1: Direct brand name check
-        result = BrandExtractionManager._check_direct_brand_match(product_name)
-        if result["success"]:
-            return result
+class WorkbookUploads:
+    """Background validation and atomic swap of uploaded workbooks"""
 
-        # Strategy 2: Try to extract brand directly from product name text
-        direct_brand = BrandNormalizer.extract_brand_from_product_text(
-            product_name)
-        if direct_brand:
-            logger.info(
-                f"Direct extraction found brand: '{direct_brand}' from product name"
-            )
-            return BrandExtractionManager._format_result(
-                success=True,
-                message=f"Brand '{direct_brand}' extracted directly from input",
-                extracted_brand=direct_brand,
-                confidence=85,
-                method="direct_extraction",
-                reason=f"Found '{direct_brand}' directly in input text",
+    def __init__(self, manager: "CertificationManager", db_path: str):
+        self.manager = manager
+        self.db_path = db_path
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_jobs (
+                job_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
             )
+            """
+        )
 
-        # Strategy 3: Search Open Food Facts for product-like names
-        words = product_name.split()
-        if len(words) > 1:
-            return await BrandExtractionManager._search_open_food_facts(product_name)
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ----- job records -----
+
+    def _save(self, job: Dict[str, Any]):
+        job["updated_at"] = datetime.now().isoformat()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO upload_jobs (job_id, data, updated_at) VALUES (?, ?, ?)",
+            (job["job_id"], json.dumps(job, default=str), time.time()),
+        )
 
-        # Strategy 4: Single word input - likely a brand name
-        return await BrandExtractionManager._handle_single_word_input(product_name)
+    def _update(self, job: Dict[str, Any], status: str, progress: float, message: str, **fields):
+        job.update(status=status, progress=round(progress, 2), message=message, **fields)
+        self._save(job)
+        logger.info(f"📤 Upload {job['job_id']}: {status} ({message})")
+
+    def fail(self, job: Dict[str, Any], message: str, error: str):
+        self._update(job, "failed", 1.0, message, error=error)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT data FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, filename: str) -> Dict[str, Any]:
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "filename": filename,
+            "status": "receiving",
+            "progress": 0.0,
+            "message": "Receiving upload",
+            "bytes_received": 0,
+            "created_at": datetime.now().isoformat(),
+            "report": None,
+            "error": None,
+        }
+        self._save(job)
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM upload_jobs WHERE job_id NOT IN "
+            "(SELECT job_id FROM upload_jobs ORDER BY updated_at DESC LIMIT ?)",
+            (UploadConfig.KEEP_JOBS,),
+        )
+        return job
+
+    def temp_path(self, job: Dict[str, Any]) -> str:
+        # Same directory as the live workbook so the final rename is atomic
+        return f"{FileConfig.CERTIFICATION_EXCEL_FILE}.upload-{job['job_id']}.tmp"
+
+    async def receive(self, job: Dict[str, Any], file: UploadFile) -> str:
+        """Stream the upload to the job's temp file; returns the workbook version (content hash)"""
+        digest = hashlib.sha256()
+        received = 0
+        path = self.temp_path(job)
+        try:
+            with open(path, "wb") as out:
+                while True:
+                    chunk = await file.read(UploadConfig.CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    if received > UploadConfig.MAX_BYTES:
+                        raise UploadTooLargeError(
+                            f"Upload exceeds {UploadConfig.MAX_BYTES // (1024 * 1024)} MiB"
+                        )
+                    digest.update(chunk)
+                    await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            self._discard(path)
+            raise
+        if received == 0:
+            self._discard(path)
+            raise WorkbookValidationError("Uploaded file is empty")
+        job["bytes_received"] = received
+        return digest.hexdigest()[:16]
 
     @staticmethod
-    def _check_direct_brand_match(product_name: str) -> Dict[str, Any]:
-        """Check if input is already a known brand (from Excel data only)"""
-        brand_normalized = BrandNormalizer.normalize(product_name)
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # ----- background processing -----
+
+    def submit(self, job: Dict[str, Any], version: str, force: bool = False):
+        self._update(job, "queued", 0.1, "Waiting for validation")
+        with self._executor_lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                # One at a time: uploads are swapped in the order they arrive
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workbook-upload")
+            self._executor.submit(self._process, job, version, force)
+
+    def _process(self, job: Dict[str, Any], version: str, force: bool):
+        path = self.temp_path(job)
+        try:
+            self._update(job, "validating", 0.2, "Parsing workbook")
+            pd = get_pandas()
+            try:
+                df = pd.read_excel(path)
+            except Exception as e:
+                raise WorkbookValidationError(f"Not a readable Excel workbook: {e}")
+
+            self._update(job, "validating", 0.5, f"Validating {len(df)} rows")
+            with self._swap_lock():
+                self.manager.ensure_loaded()  # compare against the live workbook, not a stale copy
+                report = self.validate(df, force)
+                self._update(job, "swapping", 0.7, "Replacing the live workbook", report=report)
+
+                # Anything applied through the admin API predates this upload
+                change_log = self.manager.change_log
+                change_log.set_base(version, change_log.last_seq())
+                os.replace(path, FileConfig.CERTIFICATION_EXCEL_FILE)
+
+                self._update(job, "loading", 0.85, "Loading the new workbook", report=report)
+                if not self.manager.load_certification_data(parsed=(df, version)):
+                    raise RuntimeError("Workbook was swapped in but failed to load; see logs")
+
+            self._update(
+                job, "succeeded", 1.0, "Workbook uploaded", report=report,
+                dataset_version=self.manager.dataset.version,
+                total_records=len(self.manager.data),
+            )
+        except WorkbookValidationError as e:
+            self._discard(path)
+            self.fail(job, "Validation failed", str(e))
+        except Exception as e:
+            self._discard(path)
+            logger.error(f"Error processing upload {job['job_id']}: {e}")
+            self.fail(job, "Upload failed", str(e))
+
+    @contextmanager
+    def _swap_lock(self):
+        """Serialize validate-and-swap across workers"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{FileConfig.CERTIFICATION_EXCEL_FILE}.upload.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        # Check if the input is in the Excel data
-        if certification_manager.data is not None:
-            # Check exact match
-            if brand_normalized in certification_manager.data:
-                first_product = next(iter(certification_manager.data[brand_normalized].values()))
-                original_brand = first_product.get("original_brand", brand_normalized.title())
-                logger.info(
-                    f"Input is a known brand in Excel: '{original_brand}'"
+    def validate(self, df, force: bool = False) -> Dict[str, Any]:
+        """
+        Check an uploaded workbook against what the app needs and what is live.
+
+        Raises WorkbookValidationError for a workbook that would break
+        lookups; returns a report (column mapping, duplicates, row deltas,
+        warnings) otherwise.
+        """
+        pd = get_pandas()
+        columns = [str(col) for col in df.columns]
+        warnings = []
+
+        # Schema and column aliases
+        if "Product_Brand" not in columns:
+            raise WorkbookValidationError("Missing required column 'Product_Brand'")
+        if "Category" not in columns:
+            warnings.append("No 'Category' column: every brand gets a single _default record")
+        mapping = {}
+        for certification, names in CertificationManager.CERTIFICATION_COLUMNS.items():
+            present = [name for name in names if name in columns]
+            if not present:
+                raise WorkbookValidationError(
+                    f"No column for {certification} (expected one of: {', '.join(names)})"
                 )
-                return BrandExtractionManager._format_result(
-                    success=True,
-                    message=f"Input recognized as brand: '{original_brand}'",
-                    extracted_brand=original_brand,
-                    confidence=90,
-                    method="direct_brand_recognition",
-                    reason=f"'{original_brand}' found in Excel certification database",
+            mapping[certification] = present[0]
+            if len(present) > 1:
+                warnings.append(f"{certification}: using '{present[0]}', ignoring {present[1:]}")
+
+        brands = df["Product_Brand"]
+        categories = df["Category"] if "Category" in columns else pd.Series([""] * len(df))
+        keys = []
+        for brand, category in zip(brands.tolist(), categories.tolist()):
+            if pd.isna(brand) or not str(brand).strip():
+                continue
+            category = "" if pd.isna(category) else str(category).strip()
+            keys.append((BrandNormalizer.normalize(str(brand).strip()), category or "_default"))
+        if not keys:
+            raise WorkbookValidationError("Workbook has no rows with a Product_Brand")
+
+        # Duplicate (brand, category) keys: the last row wins on load
+        key_counts = Counter(keys)
+        duplicates = [key for key, count in key_counts.items() if count > 1]
+        if duplicates:
+            warnings.append(f"{len(duplicates)} duplicate brand/category keys (the last row wins)")
+
+        # Flag cells that don't read as yes/no
+        unreadable = {}
+        for certification, column in mapping.items():
+            values = df[column]
+            bad = sum(
+                1 for value in values.tolist()
+                if isinstance(value, str)
+                and value.strip().lower() not in ("true", "yes", "y", "1", "t", "false", "no", "n", "0", "f")
+            )
+            if bad:
+                unreadable[column] = bad
+        if unreadable:
+            warnings.append(f"Cells read as 'no' because they aren't yes/no: {unreadable}")
+
+        # Row and brand deltas against the live dataset
+        delta = None
+        dataset = self.manager.dataset
+        if dataset is not None:
+            current_rows = len(dataset.rows)
+            new_brands = {brand for brand, _ in key_counts}
+            current_brands = set(dataset.data.keys())
+            delta = {
+                "current_rows": current_rows,
+                "new_rows": len(df),
+                "row_change": len(df) - current_rows,
+                "brands_added": len(new_brands - current_brands),
+                "brands_removed": len(current_brands - new_brands),
+                "sample_removed_brands": sorted(current_brands - new_brands)[:UploadConfig.SAMPLE_SIZE],
+            }
+            if current_rows and len(df) < current_rows * UploadConfig.MIN_ROW_RATIO:
+                message = (
+                    f"Workbook has {len(df)} rows, fewer than {UploadConfig.MIN_ROW_RATIO:.0%} "
+                    f"of the current {current_rows}"
                 )
+                if not force:
+                    raise WorkbookValidationError(f"{message}; re-upload with force=true to accept")
+                warnings.append(f"{message} (forced)")
 
-            # Check for brand synonyms and aliases
-            if brand_normalized in BrandNormalizer.BRAND_SYNONYMS:
-                canonical_brand = BrandNormalizer.BRAND_SYNONYMS[brand_normalized]
-                # Only use if canonical brand exists in Excel
-                if canonical_brand in certification_manager.data:
-                    logger.info(
-                        f"Input matches brand synonym: '{brand_normalized}' → '{canonical_brand}'"
-                    )
-                    return BrandExtractionManager._format_result(
-                        success=True,
-                        message=f"Brand synonym recognized: '{canonical_brand}'",
-                        extracted_brand=canonical_brand.title(),
-                        confidence=85,
-                        method="brand_synonym_match",
-                        reason=f"'{brand_normalized}' is a synonym for '{canonical_brand}'",
-                    )
+        return {
+            "rows": len(df),
+            "records": len(key_counts),
+            "brands": len({brand for brand, _ in key_counts}),
+            "columns": columns,
+            "certification_columns": mapping,
+            "duplicate_keys": len(duplicates),
+            "sample_duplicate_keys": [list(key) for key in duplicates[:UploadConfig.SAMPLE_SIZE]],
+            "delta": delta,
+            "warnings": warnings,
+        }
 
-            # Check for brand aliases
-            for alias, canonical in BrandNormalizer.BRAND_ALIASES.items():
-                if alias == brand_normalized and canonical in certification_manager.data:
-                    logger.info(
-                        f"Input matches brand alias: '{brand_normalized}' → '{canonical}'"
-                    )
-                    return BrandExtractionManager._format_result(
-                        success=True,
-                        message=f"Brand alias recognized: '{canonical}'",
-                        extracted_brand=canonical.title(),
-                        confidence=85,
-                        method="brand_alias_match",
-                        reason=f"'{brand_normalized}' is an alias for '{canonical}'",
-                    )
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
 
-            # Check if the input contains a known brand name - find the longest match
-            longest_match = None
-            longest_match_key = None
-            for brand_key in certification_manager.data.keys():
-                brand_key_normalized = brand_key  # Already normalized from Excel
-                if brand_key_normalized and len(brand_key_normalized) > 2:
-                    if brand_key_normalized in brand_normalized:
-                        if longest_match is None or len(brand_key_normalized) > len(longest_match):
-                            longest_match = brand_key_normalized
-                            longest_match_key = brand_key
 
-            if longest_match_key:
-                first_product = next(iter(certification_manager.data[longest_match_key].values()))
-                original_brand = first_product.get("original_brand", longest_match_key.title())
-                logger.info(
-                    f"Found brand '{original_brand}' in input: '{product_name}'")
-                return BrandExtractionManager._format_result(
-                    success=True,
-                    message=f"Brand '{original_brand}' found in input",
-                    extracted_brand=original_brand,
-                    confidence=80,
-                    method="brand_in_input",
-                    reason=f"Brand '{original_brand}' found within input text",
-                )
+# ==================== GLOBAL STATE ====================
 
-        return BrandExtractionManager._format_result(
-            success=False,
-            message="No direct brand match found",
-            extracted_brand=None,
-            confidence=0,
-            method="direct_check",
-        )
+# Initialize managers
+brand_normalizer = BrandNormalizer()
+certification_manager = CertificationManager()
+scoring_manager = ScoringManager()
+food_facts_client = OpenFoodFactsClient()
+brand_extraction_manager = BrandExtractionManager()
+response_cache = ResponseCache()
+score_page_cache = ResponseCache(HttpCacheConfig.SCORE_PAGE_ENTRIES)
+result_cache = ResponseCache(HttpCacheConfig.RESULT_ENTRIES, HttpCacheConfig.RESULT_MAX_BYTES)
+static_assets = StaticAssets()
+workbook_uploads = WorkbookUploads(certification_manager, FileConfig.DATASET_CHANGES_FILE)
 
-    @staticmethod
-    async def _search_open_food_facts(product_name: str) -> Dict[str, Any]:
-        """Search Open Food Facts for brand information"""
-        search_result = await OpenFoodFactsClient.search_by_name(
-            product_name, max_results=20
-        )
+# ==================== PERSISTENT STORAGE SETUP ====================
 
-        if not search_result["found"]:
-            # Fallback to parent company mapping
-            parent_company = BrandNormalizer.find_parent_company(product_name)
-            if parent_company:
-                logger.info(
-                    f"Fallback to parent company: '{parent_company}' for product '{product_name}'"
+
+# Legacy JSON file (read once for migration into SQLite)
+USER_DATA_FILE = "user_data.json"
+
+
+def load_user_data(path: str = USER_DATA_FILE):
+    """Load user data from the legacy JSON file"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                logger.info(f"Loaded user data from {path}")
+                return data
+    except Exception as e:
+        logger.error(f"Error loading user data: {e}")
+
+    # Return empty structure if file doesn't exist or has errors
+    return {"users": {}, "purchases": {}}
+
+
+class UserStore:
+    """
+    SQLite-backed user and purchase storage.
+
+    Runs in WAL mode so readers never block the writer, and every gunicorn
+    worker talks to the same database file instead of holding its own copy.
+    Each purchase is a single INSERT; nothing is rewritten on save.
+
+    Per-user aggregates (count, score sum, grade / certification counts and
+    monthly buckets) are updated in the same transaction as the INSERT, so
+    history stats never need to scan a user's purchases.
+    """
+
+    PURCHASE_FIELDS: ClassVar[List[str]] = [
+        "barcode",
+        "brand",
+        "product_name",
+        "category",
+        "price",
+        "tbl_score",
+        "certifications",
+        "scoring_method",
+        "timestamp",
+        "scoring_methodology",
+    ]
+
+    def __init__(self, db_path: str, legacy_json_path: str = None):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_schema()
+        if legacy_json_path:
+            self._migrate_from_json(legacy_json_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection (SQLite connections are not thread-safe)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _init_schema(self):
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    email TEXT NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TEXT NOT NULL
                 )
-                return BrandExtractionManager._format_result(
-                    success=True,
-                    message=f"Using parent company '{parent_company}' for product",
-                    extracted_brand=parent_company.title(),
-                    confidence=75,
-                    method="parent_company_mapping",
-                    parent_company=parent_company,
-                    warning="Using parent company mapping (not from Open Food Facts)",
-                    reason=f"Product '{product_name}' belongs to parent company '{parent_company}'",
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS purchases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL REFERENCES users(username),
+                    barcode TEXT,
+                    brand TEXT,
+                    product_name TEXT,
+                    category TEXT,
+                    price REAL,
+                    tbl_score REAL,
+                    certifications TEXT,
+                    scoring_method TEXT,
+                    timestamp TEXT,
+                    scoring_methodology TEXT
                 )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(username, id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
 
-            return BrandExtractionManager._format_result(
-                success=False,
-                message=search_result["message"],
-                extracted_brand=None,
-                confidence=0,
-                method="search_failed",
-                search_results=search_result,
+            # ===== RUNNING AGGREGATES (maintained on write) =====
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    username TEXT PRIMARY KEY REFERENCES users(username),
+                    purchase_count INTEGER NOT NULL DEFAULT 0,
+                    score_sum REAL NOT NULL DEFAULT 0,
+                    first_purchase TEXT,
+                    last_purchase TEXT
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_grade_counts (
+                    username TEXT NOT NULL,
+                    grade TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (username, grade)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_certification_counts (
+                    username TEXT NOT NULL,
+                    certification TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (username, certification)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_monthly_stats (
+                    username TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    purchase_count INTEGER NOT NULL DEFAULT 0,
+                    score_sum REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (username, month)
+                )
+                """
             )
 
-        # Get top brand from search results
-        brand_analysis = search_result["brand_analysis"]
-        top_brand = brand_analysis.get("top_brand")
+            # Databases created before aggregates existed get a one-time backfill
+            built = conn.execute(
+                "SELECT value FROM meta WHERE key = 'aggregates_built'"
+            ).fetchone()
+            if not built:
+                rows = conn.execute("SELECT * FROM purchases ORDER BY id").fetchall()
+                for row in rows:
+                    self._update_aggregates(conn, row["username"], self._row_to_purchase(row))
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('aggregates_built', ?)",
+                    (datetime.utcnow().isoformat(),),
+                )
 
-        if not top_brand:
-            # Try parent company as fallback
-            parent_company = BrandNormalizer.find_parent_company(product_name)
-            if parent_company:
-                return BrandExtractionManager._format_result(
-                    success=True,
-                    message=f"Using parent company '{parent_company}' (no clear brand from search)",
-                    extracted_brand=parent_company.title(),
-                    confidence=70,
-                    method="parent_company_fallback",
-                    parent_company=parent_company,
-                    warning="Using parent company as fallback",
-                    reason=f"Product '{product_name}' belongs to parent company '{parent_company}'",
+    def _migrate_from_json(self, json_path: str):
+        """One-time import of the legacy user_data.json file"""
+        if not os.path.exists(json_path):
+            return
+
+        with self._transaction() as conn:
+            # Checked inside the write lock so only one worker migrates
+            already = conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+            if already:
+                return
+
+            data = load_user_data(json_path)
+            users = data.get("users", {}) or {}
+            purchases = data.get("purchases", {}) or {}
+
+            for username, user in users.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                    (
+                        username,
+                        user.get("email", ""),
+                        user.get("password_hash", ""),
+                        user.get("created_at") or datetime.utcnow().isoformat(),
+                    ),
                 )
 
-            return BrandExtractionManager._format_result(
-                success=False,
-                message="No brand could be determined from search results",
-                extracted_brand=None,
-                confidence=0,
-                method="search_failed",
-                parent_company=None,
-                search_results=search_result,
+            purchase_count = 0
+            for username, history in purchases.items():
+                if username not in users:
+                    continue
+                for purchase in history or []:
+                    conn.execute(
+                        self._insert_purchase_sql(),
+                        self._purchase_params(username, purchase),
+                    )
+                    self._update_aggregates(conn, username, purchase)
+                    purchase_count += 1
+
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.utcnow().isoformat(),),
             )
 
-        # Successfully extracted brand from search
-        return BrandExtractionManager._process_search_result(
-            product_name, top_brand, search_result
+        logger.info(
+            f"Migrated {len(users)} users and {purchase_count} purchases from {json_path} to {self.db_path}"
         )
 
+    def _insert_purchase_sql(self) -> str:
+        columns = ", ".join(["username"] + self.PURCHASE_FIELDS)
+        placeholders = ", ".join(["?"] * (len(self.PURCHASE_FIELDS) + 1))
+        return f"INSERT INTO purchases ({columns}) VALUES ({placeholders})"
+
+    def _purchase_params(self, username: str, purchase: Dict[str, Any]) -> tuple:
+        params = [username]
+        for field in self.PURCHASE_FIELDS:
+            value = purchase.get(field)
+            if field == "certifications":
+                value = json.dumps(list(value or []))
+            elif field in ("price", "tbl_score"):
+                value = safe_float(value)
+            elif value is not None:
+                value = str(value)
+            params.append(value)
+        return tuple(params)
+
+    def _row_to_purchase(self, row: sqlite3.Row) -> Dict[str, Any]:
+        purchase = {field: row[field] for field in self.PURCHASE_FIELDS}
+        try:
+            purchase["certifications"] = json.loads(row["certifications"] or "[]")
+        except ValueError:
+            purchase["certifications"] = []
+        return purchase
+
     @staticmethod
-    def _process_search_result(
-        product_name: str, extracted_brand: str, search_result: Dict
-    ) -> Dict[str, Any]:
-        """Process search result to determine final brand"""
-        parent_company = BrandNormalizer.find_parent_company(product_name)
+    def _update_aggregates(conn: sqlite3.Connection, username: str, purchase: Dict[str, Any]):
+        """Fold one purchase into the user's running aggregates"""
+        score = safe_float(purchase.get("tbl_score"))
+        timestamp = str(purchase.get("timestamp") or datetime.utcnow().isoformat())
+        month = timestamp[:7]
+
+        conn.execute(
+            """
+            INSERT INTO user_stats (username, purchase_count, score_sum, first_purchase, last_purchase)
+            VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET
+                purchase_count = purchase_count + 1,
+                score_sum = score_sum + excluded.score_sum,
+                first_purchase = MIN(COALESCE(first_purchase, excluded.first_purchase), excluded.first_purchase),
+                last_purchase = MAX(COALESCE(last_purchase, excluded.last_purchase), excluded.last_purchase)
+            """,
+            (username, score, timestamp, timestamp),
+        )
+        conn.execute(
+            """
+            INSERT INTO user_grade_counts (username, grade, count) VALUES (?, ?, 1)
+            ON CONFLICT(username, grade) DO UPDATE SET count = count + 1
+            """,
+            (username, get_grade(score)),
+        )
+        for cert in set(purchase.get("certifications") or []):
+            conn.execute(
+                """
+                INSERT INTO user_certification_counts (username, certification, count) VALUES (?, ?, 1)
+                ON CONFLICT(username, certification) DO UPDATE SET count = count + 1
+                """,
+                (username, str(cert)),
+            )
+        conn.execute(
+            """
+            INSERT INTO user_monthly_stats (username, month, purchase_count, score_sum) VALUES (?, ?, 1, ?)
+            ON CONFLICT(username, month) DO UPDATE SET
+                purchase_count = purchase_count + 1,
+                score_sum = score_sum + excluded.score_sum
+            """,
+            (username, month, score),
+        )
 
-        if parent_company:
-            normalized_extracted = BrandNormalizer.normalize(extracted_brand)
-            normalized_parent = BrandNormalizer.normalize(parent_company)
+    # ----- users -----
 
-            # If parent company is different, consider using it
-            if normalized_extracted != normalized_parent:
-                # Check if parent company is a known national brand
-                if normalized_parent in BrandNormalizer.NATIONAL_BRANDS:
-                    logger.info(
-                        f"Using parent company '{parent_company}' instead of extracted '{extracted_brand}'"
-                    )
-                    extracted_brand = parent_company.title()
-                    confidence = 80
-                    method = "parent_company_override"
-                    reason = (
-                        f"Parent company '{parent_company}' is a known national brand"
-                    )
-                else:
-                    confidence = 70
-                    method = "search_extraction"
-                    reason = f"Brand '{extracted_brand}' extracted from search results"
-            else:
-                confidence = 75
-                method = "search_extraction"
-                reason = f"Brand '{extracted_brand}' extracted from search results"
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT username, email, password_hash, created_at FROM users WHERE username = ?",
+            (username,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def user_exists(self, username: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return row is not None
+
+    def create_user(self, username: str, email: str, password_hash: str) -> bool:
+        """Insert a new user; returns False if the username is already taken"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                    (username, email, password_hash, datetime.utcnow().isoformat()),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update_password_hash(self, username: str, password_hash: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE users SET password_hash = ? WHERE username = ?",
+                (password_hash, username),
+            )
+
+    def list_usernames(self) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT username FROM users ORDER BY created_at"
+        ).fetchall()
+        return [row["username"] for row in rows]
+
+    def count_users(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # ----- purchases -----
+
+    def add_purchase(self, username: str, purchase: Dict[str, Any]) -> int:
+        """Append one purchase row and update aggregates; returns its id"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                self._insert_purchase_sql(),
+                self._purchase_params(username, purchase),
+            )
+            self._update_aggregates(conn, username, purchase)
+            return cursor.lastrowid
+
+    def get_purchase_page(
+        self, username: str, limit: int = 50, before_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        One page of purchases, walking backwards from the newest.
+
+        Uses the (username, id) index, so cost is O(limit) regardless of
+        how many purchases the user has. Purchases in the page are returned
+        in chronological order, matching the old history[-limit:] slice.
+        """
+        limit = max(0, int(limit))
+        if before_id is None:
+            rows = self._connect().execute(
+                "SELECT * FROM purchases WHERE username = ? ORDER BY id DESC LIMIT ?",
+                (username, limit + 1),
+            ).fetchall()
         else:
-            confidence = 70
-            method = "search_extraction"
-            reason = f"Brand '{extracted_brand}' extracted from search results"
+            rows = self._connect().execute(
+                "SELECT * FROM purchases WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (username, int(before_id), limit + 1),
+            ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        purchases = []
+        for row in reversed(rows):
+            purchase = self._row_to_purchase(row)
+            purchase["purchase_id"] = row["id"]
+            purchases.append(purchase)
 
-        return BrandExtractionManager._format_result(
-            success=True,
-            message=f"Brand '{extracted_brand}' extracted from Open Food Facts",
-            extracted_brand=extracted_brand,
-            confidence=confidence,
-            method=method,
-            parent_company=parent_company,
-            reason=reason,
-            search_results={
-                "total_products": search_result["brand_analysis"].get(
-                    "total_products",
-                    0),
-                "total_brand_candidates": search_result["brand_analysis"].get(
-                    "total_brand_candidates",
-                    0),
+        return {
+            "purchases": purchases,
+            "next_cursor": str(rows[-1]["id"]) if has_more and rows else None,
+        }
+
+    def get_recent_purchases(self, username: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent purchases in chronological order"""
+        return self.get_purchase_page(username, limit)["purchases"]
+
+    def get_purchase_summary(self, username: str) -> Dict[str, Any]:
+        """Count and mean TBL score from the running aggregates (O(1))"""
+        row = self._connect().execute(
+            "SELECT purchase_count, score_sum FROM user_stats WHERE username = ?",
+            (username,),
+        ).fetchone()
+        if not row or not row["purchase_count"]:
+            return {"total": 0, "sum": 0.0, "average": 0.0}
+        return {
+            "total": row["purchase_count"],
+            "sum": safe_float(row["score_sum"]),
+            "average": safe_float(row["score_sum"]) / row["purchase_count"],
+        }
+
+    def get_purchase_stats(self, username: str) -> Dict[str, Any]:
+        """Full statistics built from the running aggregates"""
+        conn = self._connect()
+        summary = self.get_purchase_summary(username)
+        stats_row = conn.execute(
+            "SELECT first_purchase, last_purchase FROM user_stats WHERE username = ?",
+            (username,),
+        ).fetchone()
+
+        grade_counts = {grade: 0 for grade in ScoringConfig.GRADE_THRESHOLDS}
+        for row in conn.execute(
+            "SELECT grade, count FROM user_grade_counts WHERE username = ?", (username,)
+        ):
+            grade_counts[row["grade"]] = row["count"]
+
+        certification_counts = {
+            row["certification"]: row["count"]
+            for row in conn.execute(
+                "SELECT certification, count FROM user_certification_counts WHERE username = ? ORDER BY count DESC",
+                (username,),
+            )
+        }
+
+        monthly = [
+            {
+                "month": row["month"],
+                "purchases": row["purchase_count"],
+                "average_tbl_score": round(
+                    safe_float(row["score_sum"]) / row["purchase_count"], 2
+                ) if row["purchase_count"] else 0.0,
+            }
+            for row in conn.execute(
+                "SELECT month, purchase_count, score_sum FROM user_monthly_stats WHERE username = ? ORDER BY month",
+                (username,),
+            )
+        ]
+
+        total = summary["total"]
+        certified = grade_counts.get("EXCELLENT", 0) + grade_counts.get("GREAT", 0)
+        return {
+            "total_purchases": total,
+            "tbl_score_sum": round(summary["sum"], 2),
+            "average_tbl_score": round(summary["average"], 2),
+            "grade_counts": grade_counts,
+            "grade_percentages": {
+                grade: round(count / total * 100, 1) if total else 0.0
+                for grade, count in grade_counts.items()
             },
-        )
+            "great_or_better_percentage": round(certified / total * 100, 1) if total else 0.0,
+            "certification_counts": certification_counts,
+            "monthly": monthly,
+            "first_purchase": stats_row["first_purchase"] if stats_row else None,
+            "last_purchase": stats_row["last_purchase"] if stats_row else None,
+        }
 
-    @staticmethod
-    async def _handle_single_word_input(product_name: str) -> Dict[str, Any]:
-        """Handle single word input - likely a brand name (from Excel data only)"""
-        brand_normalized = BrandNormalizer.normalize(product_name)
+    def purchase_counts(self) -> Dict[str, int]:
+        rows = self._connect().execute(
+            """
+            SELECT u.username AS username, COALESCE(s.purchase_count, 0) AS total
+            FROM users u LEFT JOIN user_stats s ON s.username = u.username
+            """
+        ).fetchall()
+        return {row["username"]: row["total"] for row in rows}
+
+    def count_purchases(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM purchases").fetchone()[0]
+
+    def purchase_barcodes_since(self, after_id: int, limit: int) -> List[tuple]:
+        """(id, barcode, brand) of purchases after `after_id`, oldest first"""
+        return [
+            tuple(row)
+            for row in self._connect().execute(
+                "SELECT id, barcode, brand FROM purchases WHERE id > ? AND barcode != '' ORDER BY id LIMIT ?",
+                (int(after_id), int(limit)),
+            )
+        ]
 
-        # Check for fuzzy matches with brands from Excel
-        best_match = None
-        best_score = 0.0
 
-        if certification_manager.data is not None:
-            for brand_key in certification_manager.data.keys():
-                brand_key_normalized = brand_key  # Already normalized from Excel
-                similarity = SequenceMatcher(
-                    None, brand_normalized, brand_key_normalized
-                ).ratio()
+user_store = UserStore(FileConfig.USER_DATABASE_FILE, legacy_json_path=USER_DATA_FILE)
 
-                if (
-                    similarity > best_score and similarity >= 0.7
-                ):  # 70% similarity threshold
-                    best_score = similarity
-                    best_match = brand_key
 
-            if best_match:
-                first_product = next(iter(certification_manager.data[best_match].values()))
-                original_brand = first_product.get("original_brand", best_match.title())
-                logger.info(
-                    f"Fuzzy match found: '{brand_normalized}' → '{original_brand}' ({best_score:.1%} similarity)"
-                )
-                confidence = int(best_score * 100)
-                return BrandExtractionManager._format_result(
-                    success=True,
-                    message=f"Fuzzy match found for '{product_name}'",
-                    extracted_brand=original_brand,
-                    confidence=confidence,
-                    method="fuzzy_match",
-                    warning=f"Using fuzzy match ({best_score:.1%} similarity)",
-                    reason=f"'{product_name}' closely matches known brand '{original_brand}'",
-                )
+class ProductCache:
+    """
+    Open Food Facts lookups shared by all workers.
 
-        # If we get here, we couldn't identify the brand
-        return BrandExtractionManager._format_result(
-            success=False,
-            message=f"Could not identify brand from '{product_name}'",
-            extracted_brand=None,
-            confidence=0,
-            method="failed",
-            warning="Input could not be identified as a brand or product",
-            reason="No matches found in Excel certification database or product search",
+    Same access pattern as the old per-worker dict (``in``, ``[]``, ``len``),
+    but backed by one SQLite file so a product fetched by one worker is a hit
+    for the others and the cache isn't duplicated in every process.
+
+    Rows older than max_age are misses (and pruned), as are rows missing
+    fields the current client writes (cached before a format change). Every
+    PRUNE_EVERY writes, expired rows are deleted and the oldest rows beyond
+    max_rows evicted; rows under superseded keys age out the same way.
+    """
+
+    PRUNE_EVERY: ClassVar[int] = 100
+    REQUIRED_FIELDS: ClassVar[tuple] = ("category_path",)
+
+    def __init__(self, db_path: str, max_age: float, max_rows: int):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                barcode TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                cached_at REAL NOT NULL
+            )
+            """
         )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_products_cached_at ON products(cached_at)")
+        self.prune()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, barcode: str, default=None):
+        row = self._connect().execute(
+            "SELECT data FROM products WHERE barcode = ? AND cached_at >= ?",
+            (barcode, time.time() - self.max_age),
+        ).fetchone()
+        if row is None:
+            return default
+        product = json.loads(row[0])
+        if any(field not in product for field in self.REQUIRED_FIELDS):
+            return default
+        return product
 
-    @staticmethod
-    def _format_result(
-        success: bool,
-        message: str,
-        extracted_brand: Optional[str],
-        confidence: int,
-        method: str,
-        parent_company: Optional[str] = None,
-        warning: Optional[str] = None,
-        reason: Optional[str] = None,
-        **kwargs,
-    ) -> Dict[str, Any]:
-        """Format brand extraction result"""
-        result = {
-            "success": success,
-            "message": message,
-            "extracted_brand": extracted_brand,
-            "original_extracted_brand": extracted_brand,
-            "confidence": confidence,
-            "method": method,
-            "parent_company": parent_company,
-            "alternative_brands": [],
-            "warning": warning,
-            "reason": reason,
-        }
+    def __contains__(self, barcode: str) -> bool:
+        return self.get(barcode) is not None
 
-        # Add any additional keyword arguments
-        result.update(kwargs)
-        return result
+    def __getitem__(self, barcode: str) -> Dict[str, Any]:
+        product = self.get(barcode)
+        if product is None:
+            raise KeyError(barcode)
+        return product
 
+    def __setitem__(self, barcode: str, product: Dict[str, Any]):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO products (barcode, data, cached_at) VALUES (?, ?, ?)",
+            (barcode, json.dumps(product, default=str), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete expired rows, then the oldest rows beyond max_rows; returns rows deleted"""
+        conn = self._connect()
+        deleted = conn.execute(
+            "DELETE FROM products WHERE cached_at < ?", (time.time() - self.max_age,)
+        ).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] - self.max_rows
+        if excess > 0:
+            deleted += conn.execute(
+                "DELETE FROM products WHERE rowid IN (SELECT rowid FROM products ORDER BY cached_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+        return deleted
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def since(self, after_rowid: int, limit: int) -> List[tuple]:
+        """
+        (rowid, barcode, product) written after `after_rowid`, oldest first.
+        INSERT OR REPLACE gives a rewritten product a new rowid, so nothing
+        written later is missed.
+        """
+        rows = self._connect().execute(
+            "SELECT rowid, barcode, data FROM products WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (int(after_rowid), int(limit)),
+        ).fetchall()
+        return [(rowid, barcode, json.loads(data)) for rowid, barcode, data in rows]
 
-# ==================== PASSWORD UTILITIES ====================
 
+PRODUCT_CACHE = ProductCache(
+    FileConfig.PRODUCT_CACHE_FILE, FileConfig.PRODUCT_CACHE_MAX_AGE_SECONDS, FileConfig.PRODUCT_CACHE_MAX_ROWS
+)
 
-def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    bcrypt = get_bcrypt()  # Use your cached lazy import
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
+async def ensure_bootstrap_user():
+    """Create the ALB user if it doesn't exist (hashed off the event loop)"""
+    if not user_store.user_exists("ALB"):
+        password_hash = await password_hasher.hash("Oranges#155")
+        if user_store.create_user("ALB", "test@example.com", password_hash):
+            logger.info("Created ALB user")
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
-    bcrypt = get_bcrypt()  # Use your cached lazy import
-    return bcrypt.checkpw(password.encode(), hashed_password.encode())
 
+# ==================== GS1 COMPANY PREFIX INDEX ====================
+# Products missing from Open Food Facts often share a GS1 company prefix
+# with products we've already resolved. Every resolved barcode (product
+# cache, purchase history, imported OFF dumps) is counted under each of its
+# leading 7-11 digits; an unseen barcode takes the brand that dominates the
+# longest of its prefixes with enough evidence. The counts live in their own
+# SQLite file shared by all workers and are updated incrementally: each
+# source is read from a watermark (product cache rowid, purchase id), and a
+# barcode is only ever counted once.
 
-# ==================== GLOBAL STATE ====================
 
-# Initialize managers
-brand_normalizer = BrandNormalizer()
-certification_manager = CertificationManager()
-scoring_manager = ScoringManager()
-food_facts_client = OpenFoodFactsClient()
-brand_extraction_manager = BrandExtractionManager()
+@dataclass
+class CompanyPrefixConfig:
+    """Prefix lengths learned, evidence an inference needs, and how often sources are re-read"""
+
+    MIN_PREFIX: ClassVar[int] = 7
+    MAX_PREFIX: ClassVar[int] = 11
+    MIN_SUPPORT: ClassVar[int] = int(os.getenv("COMPANY_PREFIX_MIN_SUPPORT", "3"))
+    MIN_SHARE: ClassVar[float] = float(os.getenv("COMPANY_PREFIX_MIN_SHARE", "0.8"))
+    REFRESH_SECONDS: ClassVar[float] = float(os.getenv("COMPANY_PREFIX_REFRESH_SECONDS", "60"))  # 0 = off
+    BATCH: ClassVar[int] = 1000
+    # GTIN-13 ranges with no stable company behind them: in-store and variable
+    # measure codes, coupons, ISSN and ISBN
+    RESTRICTED: ClassVar[tuple] = ("02", "04", "05", "2", "98", "99", "977", "978", "979")
+    # A barcode's brand from a better source replaces one from a worse source
+    SOURCE_PRIORITY: ClassVar[Dict[str, int]] = {"purchase": 0, "import": 1, "open_food_facts": 2}
+    # How far a known barcode's brand is trusted, by the source that taught it;
+    # purchases are typed in by users and never checked against a product record
+    SOURCE_CONFIDENCE: ClassVar[Dict[str, tuple]] = {
+        "purchase": (0.7, "medium"),
+        "import": (0.9, "high"),
+        "open_food_facts": (1.0, "high"),
+    }
+    # Sources that can't carry a prefix inference on their own: the winning
+    # brand also needs a barcode under the prefix from some other source
+    UNVOUCHED_SOURCES: ClassVar[tuple] = ("purchase",)
 
-# Initialize in-memory caches
-USERS_DB = {}
-PURCHASE_HISTORY_DB = {}
-PRODUCT_CACHE = {}
 
-# Simple user database class (optional)
+class CompanyPrefixIndex:
+    """
+    Brand counts per GS1 company prefix, learned from resolved barcodes.
 
+    ``barcodes`` holds the one brand counted for each canonical barcode;
+    ``prefix_brands`` holds how many barcodes under each prefix carry each
+    brand (keyed by BrandNormalizer.normalize). Re-learning a barcode with
+    the same brand is a no-op, so sources can overlap freely.
+    """
 
-class UserDatabase:
-    def __init__(self):
-        self.users = {}
-        self.history = {}
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS barcodes (
+                    barcode TEXT PRIMARY KEY,
+                    brand_key TEXT NOT NULL,
+                    brand TEXT NOT NULL,
+                    source TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS prefix_brands (
+                    prefix TEXT NOT NULL,
+                    brand_key TEXT NOT NULL,
+                    brand TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (prefix, brand_key)
+                )
+                """
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
 
-# ==================== PERSISTENT STORAGE SETUP ====================
+    # ----- keys -----
 
+    @staticmethod
+    def company_key(barcode: str) -> Optional[str]:
+        """
+        The GTIN-13 digits whose prefixes identify the company, or None for
+        codes without one (invalid reads, EAN-8s, restricted ranges).
+        GTIN-14 case codes drop their packaging indicator digit.
+        """
+        try:
+            code = Gtin.canonicalize(barcode).code
+        except InvalidBarcodeError:
+            return None
+        if len(code) == 8:
+            return None  # GS1-8 numbers are allocated per product, not per company
+        key = code[-13:]
+        if key.startswith(CompanyPrefixConfig.RESTRICTED):
+            return None
+        return key
 
-# JSON file for persistent storage
-USER_DATA_FILE = "user_data.json"
+    @staticmethod
+    def prefixes(key: str) -> List[str]:
+        return [key[:n] for n in range(CompanyPrefixConfig.MIN_PREFIX, CompanyPrefixConfig.MAX_PREFIX + 1)]
 
+    @staticmethod
+    def primary_brand(value: Any) -> Optional[str]:
+        """First brand of an OFF-style "A, B" list; None for placeholders"""
+        brand = str(value or "").split(",")[0].strip()
+        if brand.lower() in ("", "unknown", "n/a", "generic", "none"):
+            return None
+        return brand
 
-def load_user_data():
-    """Load user data from JSON file"""
-    try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"Loaded user data from {USER_DATA_FILE}")
-                return data
-    except Exception as e:
-        logger.error(f"Error loading user data: {e}")
+    # ----- learning -----
+
+    def _learn(self, conn: sqlite3.Connection, barcode: str, brand: Any, source: str) -> bool:
+        key = self.company_key(barcode)
+        brand = self.primary_brand(brand)
+        if key is None or brand is None:
+            return False
+        brand_key = BrandNormalizer.normalize(brand)
+        if not brand_key:
+            return False
+
+        row = conn.execute("SELECT brand_key, source FROM barcodes WHERE barcode = ?", (key,)).fetchone()
+        if row is not None:
+            priority = CompanyPrefixConfig.SOURCE_PRIORITY
+            if priority.get(source, 0) < priority.get(row[1], 0):
+                return False
+            if row[0] == brand_key:
+                # Same brand: the counts stand, but a better source vouches for it now
+                if priority.get(source, 0) == priority.get(row[1], 0):
+                    return False
+                conn.execute("UPDATE barcodes SET brand = ?, source = ? WHERE barcode = ?", (brand, source, key))
+                return True
+            for prefix in self.prefixes(key):
+                conn.execute(
+                    "UPDATE prefix_brands SET count = count - 1 WHERE prefix = ? AND brand_key = ?",
+                    (prefix, row[0]),
+                )
+            conn.execute("DELETE FROM prefix_brands WHERE count <= 0")
+
+        conn.execute(
+            "INSERT OR REPLACE INTO barcodes (barcode, brand_key, brand, source) VALUES (?, ?, ?, ?)",
+            (key, brand_key, brand, source),
+        )
+        conn.executemany(
+            """
+            INSERT INTO prefix_brands (prefix, brand_key, brand, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT (prefix, brand_key) DO UPDATE SET count = count + 1
+            """,
+            [(prefix, brand_key, brand) for prefix in self.prefixes(key)],
+        )
+        return True
+
+    def learn(self, rows, source: str) -> int:
+        """Count (barcode, brand) pairs in one transaction; returns how many changed the index"""
+        with self._transaction() as conn:
+            return sum(self._learn(conn, barcode, brand, source) for barcode, brand in rows)
+
+    def _watermark(self, conn: sqlite3.Connection, name: str) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def refresh(self, product_cache: "ProductCache", users: "UserStore") -> Dict[str, int]:
+        """
+        Learn what the product cache and purchase history gained since the
+        last refresh. Each batch and its watermark commit together, so
+        concurrent workers never count a row twice.
+        """
+        def cached_products(after: int, limit: int) -> List[tuple]:
+            return [
+                (rowid, barcode, product.get("brand") if product.get("found") else None)
+                for rowid, barcode, product in product_cache.since(after, limit)
+            ]
+
+        learned = {"open_food_facts": 0, "purchase": 0}
+        sources = (
+            ("open_food_facts", "product_cache_rowid", cached_products),
+            ("purchase", "purchase_id", users.purchase_barcodes_since),
+        )
+        for source, mark, read in sources:
+            while True:
+                with self._transaction() as conn:
+                    rows = read(self._watermark(conn, mark), CompanyPrefixConfig.BATCH)
+                    if not rows:
+                        break
+                    for _, barcode, brand in rows:
+                        learned[source] += self._learn(conn, barcode, brand, source)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (mark, str(rows[-1][0]))
+                    )
+                if len(rows) < CompanyPrefixConfig.BATCH:
+                    break
+        return learned
+
+    def import_dump(self, stream, filename: str) -> Dict[str, int]:
+        """
+        Learn from an Open Food Facts export: the products CSV (tab
+        separated, as OFF publishes it) or the JSONL dump, optionally
+        gzipped. Only the "code" and "brands" fields are read.
+        """
+        name = (filename or "").lower()
+        if name.endswith(".gz"):
+            stream = gzip.open(stream)
+            name = name[:-3]
+        text = codecs.getreader("utf-8")(stream, errors="replace")
+        if name.endswith((".jsonl", ".ndjson")):
+            def pairs():
+                for line in text:
+                    try:
+                        product = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(product, dict):
+                        yield product.get("code"), product.get("brands")
+        else:
+            csv.field_size_limit(2 ** 31 - 1)  # OFF rows carry very long ingredient fields
+
+            def pairs():
+                for record in csv.DictReader(text, delimiter="\t"):
+                    yield record.get("code"), record.get("brands")
+
+        rows = learned = 0
+        records = pairs()
+        while True:
+            batch = list(islice(records, CompanyPrefixConfig.BATCH))
+            if not batch:
+                break
+            rows += len(batch)
+            learned += self.learn([(str(code or ""), brand) for code, brand in batch], "import")
+        return {"rows": rows, "learned": learned}
+
+    # ----- inference -----
+
+    def infer(self, barcode: str) -> Optional[Dict[str, Any]]:
+        """
+        The brand for an unseen barcode, or None without enough evidence.
 
-    # Return empty structure if file doesn't exist or has errors
-    return {"users": {}, "purchases": {}}
+        The longest prefix where one brand holds at least MIN_SHARE of at
+        least MIN_SUPPORT barcodes wins, provided one of its barcodes there
+        came from a source outside UNVOUCHED_SOURCES. Confidence is that share
+        shrunk towards zero for thin evidence (share * n / (n + 1)).
+        """
+        key = self.company_key(barcode)
+        if key is None:
+            return None
+        conn = self._connect()
+        known = conn.execute("SELECT brand, source FROM barcodes WHERE barcode = ?", (key,)).fetchone()
+        if known is not None:
+            confidence, level = CompanyPrefixConfig.SOURCE_CONFIDENCE.get(known[1], (0.7, "medium"))
+            return {
+                "brand": known[0],
+                "match_type": "known_barcode",
+                "source": known[1],
+                "confidence": confidence,
+                "confidence_level": level,
+            }
 
+        prefixes = self.prefixes(key)
+        counts: Dict[str, List[tuple]] = {}
+        for prefix, brand_key, brand, count in conn.execute(
+            f"SELECT prefix, brand_key, brand, count FROM prefix_brands "
+            f"WHERE prefix IN ({','.join('?' * len(prefixes))})",
+            prefixes,
+        ):
+            counts.setdefault(prefix, []).append((count, brand, brand_key))
+
+        for prefix in reversed(prefixes):
+            brands = counts.get(prefix)
+            if not brands:
+                continue
+            support = sum(count for count, _, _ in brands)
+            top, brand, brand_key = max(brands)
+            share = top / support
+            if support < CompanyPrefixConfig.MIN_SUPPORT or share < CompanyPrefixConfig.MIN_SHARE:
+                continue
+            if not self._vouched(conn, prefix, brand_key):
+                continue
+            confidence = round(share * support / (support + 1), 2)
+            return {
+                "brand": brand,
+                "match_type": "company_prefix",
+                "prefix": prefix,
+                "prefix_length": len(prefix),
+                "support": support,
+                "brand_share": round(share, 2),
+                "confidence": confidence,
+                "confidence_level": "high" if confidence >= 0.85 else "medium" if confidence >= 0.7 else "low",
+            }
+        return None
 
-def save_user_data():
-    """Save current user data to JSON file"""
-    try:
-        data = {
-            "users": USERS_DB,
-            "purchases": PURCHASE_HISTORY_DB
+    @staticmethod
+    def _vouched(conn: sqlite3.Connection, prefix: str, brand_key: str) -> bool:
+        """Does a source outside UNVOUCHED_SOURCES back this brand under the prefix?"""
+        unvouched = CompanyPrefixConfig.UNVOUCHED_SOURCES
+        row = conn.execute(
+            f"""
+            SELECT 1 FROM barcodes
+            WHERE barcode >= ? AND barcode < ? AND brand_key = ?
+              AND source NOT IN ({','.join('?' * len(unvouched))})
+            LIMIT 1
+            """,
+            (prefix, prefix + ":", brand_key, *unvouched),  # ":" sorts right after "9"
+        ).fetchone()
+        return row is not None
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        by_source = dict(conn.execute("SELECT source, COUNT(*) FROM barcodes GROUP BY source").fetchall())
+        return {
+            "barcodes": sum(by_source.values()),
+            "barcodes_by_source": by_source,
+            "prefixes": conn.execute("SELECT COUNT(DISTINCT prefix) FROM prefix_brands").fetchone()[0],
+            "watermarks": dict(conn.execute("SELECT key, value FROM meta").fetchall()),
         }
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str)
-        logger.info(f"Saved user data to {USER_DATA_FILE}")
-    except Exception as e:
-        logger.error(f"Error saving user data: {e}")
 
 
-# Load existing data or initialize
-user_data = load_user_data()
-USERS_DB.update(user_data.get("users", {}))
-PURCHASE_HISTORY_DB.update(user_data.get("purchases", {}))
+company_prefix_index = CompanyPrefixIndex(FileConfig.COMPANY_PREFIX_FILE)
 
-# Initialize ALB user if not exists
-if "ALB" not in USERS_DB:
-    USERS_DB["ALB"] = {
-        "username": "ALB",
-        "email": "test@example.com",
-        "password_hash": hash_password("Oranges#155"),
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    PURCHASE_HISTORY_DB["ALB"] = []
-    save_user_data()  # Save the new user
-    logger.info("Created ALB user")
 
 # ==================== SCRIPT EXECUTION FUNCTIONS ====================
 
@@ -3410,24 +8045,46 @@ def render_score_breakdown(
 
 
 @app.get("/scoring-methodology")
-async def get_scoring_methodology():
+async def get_scoring_methodology(request: Request):
     """Explain the scoring methodology transparently to users"""
-    return HTMLResponse(content=render_scoring_methodology())
+    # Rendered from ScoringConfig only: one compressed copy per scoring config
+    cached = response_cache.get_or_build(
+        "scoring-methodology",
+        ScoringConfig.version(),
+        lambda: CompressedBody.from_bytes(render_scoring_methodology().encode("utf-8"), "text/html; charset=utf-8"),
+    )
+    return cached.response(request)
 
 # ✅ ADD THIS NEW ROUTE RIGHT HERE:
 
 
 @app.get("/data-sources", response_class=HTMLResponse)
-async def get_data_sources():
+async def get_data_sources(request: Request):
     """Serve the data sources information page."""
-    with open("data-sources.html", "r", encoding="utf-8") as file:
-        html_content = file.read()
-    return HTMLResponse(content=html_content)
+    return static_assets.response(request, "data-sources.html")
 
 
 @app.get("/test/scoring/{brand}")
-async def test_scoring_methodology(brand: str, category: str = None):
+async def test_scoring_methodology(brand: str, request: Request, category: str = None):
     """Test the scoring methodology for a specific brand - returns HTML"""
+    dataset = certification_manager.ensure_loaded()
+    if dataset is None:
+        return HTMLResponse(content=build_score_breakdown_page(brand, category))
+
+    # Linked from every scan result: cache per (brand, category) under the
+    # dataset and scoring versions, least recently used pages evicted first
+    cached = score_page_cache.get_or_build(
+        "score-breakdown",
+        f"{dataset.version}:{ScoringConfig.version()}",
+        lambda: CompressedBody.rendered_html(build_score_breakdown_page(brand, category)),
+        brand,
+        category,
+    )
+    return cached.response(request)
+
+
+def build_score_breakdown_page(brand: str, category: Optional[str]) -> str:
+    """Look up, score and render the /test/scoring page for a brand"""
     # Try to get certifications with provided category
     excel_result = certification_manager.get_certifications(brand, category)
 
@@ -3437,7 +8094,8 @@ async def test_scoring_methodology(brand: str, category: str = None):
         categories = certification_manager.brand_categories.get(brand_normalized, [])
 
         if categories:
-            # Prefer categories with certifications
+            # Prefer categories with certifications (sorted: the same choice in every worker)
+            categories = sorted(categories)
             best_category = None
             for cat in categories:
                 test_result = certification_manager.get_certifications(brand, cat)
@@ -3460,27 +8118,21 @@ async def test_scoring_methodology(brand: str, category: str = None):
         scores.environmental,
         scores.economic)
 
-    return HTMLResponse(
-        content=render_score_breakdown(brand, scores, tbl, excel_result)
-    )
+    return render_score_breakdown(brand, scores, tbl, excel_result)
 
 
 @app.post("/auth/register")
 async def register_user(user: UserRegistration) -> Dict[str, Any]:
     """Register new user"""
-    if user.username in USERS_DB:
+    if user_store.user_exists(user.username):
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    USERS_DB[user.username] = {
-        "username": user.username,
-        "email": user.email,
-        "password_hash": hash_password(user.password),
-        "created_at": datetime.utcnow().isoformat(),
-    }
-    PURCHASE_HISTORY_DB[user.username] = []
-
-    # ✅ ADD THIS LINE: Save to persistent storage
-    save_user_data()
+    created = user_store.create_user(
+        user.username, user.email, await password_hasher.hash(user.password)
+    )
+    if not created:
+        # Another worker registered the same name between the check and insert
+        raise HTTPException(status_code=400, detail="Username already exists")
 
     logger.info(f"New user registered: {user.username}")
     return {
@@ -3489,14 +8141,34 @@ async def register_user(user: UserRegistration) -> Dict[str, Any]:
 
 
 @app.post("/auth/login")
-async def login_user(login_data: LoginRequest) -> Dict[str, Any]:
+async def login_user(login_data: LoginRequest, request: Request) -> Dict[str, Any]:
     """Login user"""
-    user = USERS_DB.get(login_data.username)
-    if not user or not verify_password(
+    # Throttle before doing any bcrypt work so credential stuffing stays cheap
+    client_ip = get_client_ip(request)
+    retry_after = max(
+        login_ip_limiter.try_acquire(f"ip:{client_ip}"),
+        login_user_limiter.try_acquire(f"user:{login_data.username.lower()}"),
+    )
+    if retry_after > 0:
+        logger.warning(f"Login rate limited: user={login_data.username}, ip={client_ip}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts. Please try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    user = user_store.get_user(login_data.username)
+    if not user or not await password_hasher.verify(
             login_data.password,
             user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # Transparently upgrade hashes made with a different bcrypt cost
+    if password_needs_rehash(user["password_hash"], PasswordConfig.BCRYPT_ROUNDS):
+        new_hash = await password_hasher.hash(login_data.password)
+        user_store.update_password_hash(login_data.username, new_hash)
+        logger.info(f"Rehashed password for {login_data.username} at cost {PasswordConfig.BCRYPT_ROUNDS}")
+
     logger.info(f"User logged in: {login_data.username}")
     return {
         "message": "Login successful",
@@ -3505,9 +8177,29 @@ async def login_user(login_data: LoginRequest) -> Dict[str, Any]:
     }
 
 
-@app.post("/scan")
-async def scan_product(product: Product) -> Dict[str, Any]:
+@app.post("/scan", response_class=FastJSONResponse)
+async def scan_product(product: Product):
     """Scan product and return TBL scores with verified certifications"""
+    # Stages that would overrun the budget (or hit an open OFF breaker) are skipped and listed
+    deadline = Deadline(DeadlineConfig.SCAN_SECONDS)
+    # Identical scans against the same dataset and scoring config give the same result
+    dataset = certification_manager.ensure_loaded(deadline)
+    memo_version = result_cache_version(dataset)
+    # Canonical GTIN, so UPC-A/EAN-13/UPC-E reads of one product share caches; misreads skip the lookup
+    barcode = product.barcode.strip()
+    barcode_error = None
+    alternates = ()
+    if barcode:
+        try:
+            gtin = Gtin.canonicalize(barcode)
+            barcode, alternates = gtin.code, gtin.alternates
+        except InvalidBarcodeError as e:
+            barcode_error = str(e)
+    memo_key = (barcode, product.brand, product.product_name, product.category)
+    if memo_version is not None:
+        memoized = result_cache.get("scan", memo_version, *memo_key)
+        if memoized is not None:
+            return memoized.response("hit")
     try:
         logger.info(
             f"Scan request: barcode={product.barcode}, brand={product.brand}, name={product.product_name}"
@@ -3521,20 +8213,28 @@ async def scan_product(product: Product) -> Dict[str, Any]:
 
         product_name = product.product_name or "Unknown Product"
         brand = product.brand or "Unknown"
-        barcode = product.barcode or ""
         category = product.category or ""
+        category_path = None
+        # Results that leaned on live OFF answers (a miss, a name search) aren't memoized
+        memoizable = True
 
-        # If barcode provided, try to get product info from Open Food Facts
-        if barcode and barcode.strip() != "":
+        if barcode_error is not None:
+            logger.warning(f"Rejected barcode read {barcode!r}: {barcode_error}")
+
+        # If a valid barcode was provided, try to get product info from Open Food Facts
+        if barcode and barcode_error is None:
             try:
-                product_info = await food_facts_client.lookup_barcode(barcode)
+                product_info = await food_facts_client.lookup_barcode(barcode, deadline, alternates=alternates)
+                memoizable = bool(product_info.get("found"))
                 if product_info.get("found"):
                     # Use data from Open Food Facts
                     brand = product_info.get("brand", brand)
                     product_name = product_info.get("name", product_name)
                     category = product_info.get("category", category)
+                    category_path = product_info.get("category_path")
             except Exception as e:
                 logger.error(f"Barcode lookup error: {e}")
+                memoizable = False
                 # Continue with original values
 
         # If brand is empty/Unknown but product_name is provided, try to
@@ -3543,7 +8243,11 @@ async def scan_product(product: Product) -> Dict[str, Any]:
             logger.info(
                 f"Attempting to extract brand from product name: {product_name}")
             try:
-                brand_extraction = await brand_extraction_manager.extract_brand_from_product_name(product_name)
+                brand_extraction = await brand_extraction_manager.extract_brand_from_product_name(
+                    product_name, deadline
+                )
+                if (brand_extraction.get("execution") or {}).get("winner") == "open_food_facts":
+                    memoizable = False
 
                 if brand_extraction["success"]:
                     extracted_brand = brand_extraction["extracted_brand"]
@@ -3561,6 +8265,7 @@ async def scan_product(product: Product) -> Dict[str, Any]:
                         "warning": brand_extraction.get("warning"),
                         "alternative_brands": brand_extraction.get("alternative_brands", []),
                         "search_results": brand_extraction.get("search_results", {}),
+                        "execution": brand_extraction.get("execution"),
                     }
                 else:
                     logger.warning(
@@ -3569,16 +8274,20 @@ async def scan_product(product: Product) -> Dict[str, Any]:
                     brand = product_name
                     brand_extraction_info = {
                         "extracted_from_name": False, "error": brand_extraction.get(
-                            "message", "Brand extraction failed"), }
+                            "message", "Brand extraction failed"),
+                        "execution": brand_extraction.get("execution"), }
             except Exception as e:
                 logger.error(f"Brand extraction error: {e}")
+                memoizable = False
                 brand = product_name if product_name != "Generic Product" else "Unknown"
 
         # ===== STEP 1: Get certifications FIRST (to get the correct category) =====
         try:
             # Determine source based on whether barcode was used
-            source = "barcode" if (barcode and barcode.strip() != "") else "manual"
-            cert_result = certification_manager.get_certifications(brand, category, source=source)
+            source = "barcode" if (barcode and barcode_error is None) else "manual"
+            cert_result = certification_manager.get_certifications(
+                brand, category, source=source, category_path=category_path, deadline=deadline
+            )
 
             # ===== DEBUG: Log the certification result =====
             logger.info(f"🔍 CERT_RESULT from get_certifications: {cert_result}")
@@ -3683,8 +8392,21 @@ async def scan_product(product: Product) -> Dict[str, Any]:
             "success": True,
             "timestamp": datetime.utcnow().isoformat()
         }
+        if barcode_error is not None:
+            response_data["invalid_barcode"] = True
+            response_data["barcode_error"] = barcode_error
+        if deadline.degraded:
+            response_data["degraded"] = True
+            response_data["degraded_stages"] = list(deadline.skipped)
+            response_data["degraded_note"] = (
+                "Some lookups were skipped (Open Food Facts unavailable or out of time); answered from local data"
+            )
+        elif memoizable and memo_version is not None and certification_manager.dataset is dataset:
+            memoized = MemoizedResult.from_content(response_data, ("certification_verified_date", "timestamp"))
+            result_cache.put("scan", memo_version, memoized, *memo_key)
+            return memoized.response("miss")
 
-        return sanitize_for_json(response_data)
+        return FastJSONResponse(response_data)
 
     except Exception as e:
         logger.error(f"Unhandled error in scan_product: {e}", exc_info=True)
@@ -3739,7 +8461,7 @@ async def scan_product(product: Product) -> Dict[str, Any]:
             "scoring_method": "error_fallback",
             "notes": f"Error processing request: {str(e)}",
             "timestamp": datetime.utcnow().isoformat()}
-        return sanitize_for_json(error_response)
+        return FastJSONResponse(error_response)
 
 
 @app.post("/extract-brand")
@@ -3773,12 +8495,8 @@ async def test_brand_extraction_endpoint(product_name: str):
 @app.get("/search-brand")
 async def search_brand(q: str = Query(...), category: str = Query(None)):
     """Search for a brand with fuzzy matching and OFF discovery fallback"""
-    # Load certification data if not already loaded
-    if certification_manager.data is None:
-        certification_manager.load_certification_data()
-
-    # Check if we have data
-    if certification_manager.data is None:
+    # Load certification data if not already loaded (and pick up record changes)
+    if certification_manager.ensure_loaded() is None:
         raise HTTPException(status_code=500, detail="Database not initialized")
 
     best_match = None
@@ -3788,50 +8506,24 @@ async def search_brand(q: str = Query(...), category: str = Query(None)):
     if len(search_query) < 2:
         return {"suggestions": [], "source": "local", "query": q}
 
-    # 1. Try local Excel search for auto-suggest
+    # 1. Try local brand index for auto-suggest (starts-with, workbook order)
     try:
-        pd = get_pandas()
-        if not os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE):
-            logger.warning(f"Excel file not found: {FileConfig.CERTIFICATION_EXCEL_FILE}")
-            df = None
-        else:
-            df = pd.read_excel(FileConfig.CERTIFICATION_EXCEL_FILE)
-
-            if df is not None and 'Product_Brand' in df.columns:
-                matches = []
-                seen_brands = set()
-
-                for _, row in df.iterrows():
-                    brand_name = str(row['Product_Brand'])
-                    brand_lower = brand_name.lower()
-
-                    # Simple starts-with check for auto-suggest
-                    if brand_lower.startswith(search_query):
-                        if brand_name not in seen_brands:
-                            seen_brands.add(brand_name)
-                            matches.append({
-                                "brand": brand_name,
-                                "category": row.get('Category', ''),
-                                "confidence": 100
-                            })
-
-                    # Limit results for performance
-                    if len(matches) >= 10:
-                        break
-
-                if matches:
-                    return {
-                        "suggestions": matches,
-                        "source": "local_database",
-                        "query": q,
-                        "success": True
-                    }
+        matches = [
+            {"brand": brand_name, "category": brand_category, "confidence": 100}
+            for brand_name, brand_category in certification_manager.brand_prefix_index.search(search_query, limit=10)
+        ]
+        if matches:
+            return {
+                "suggestions": matches,
+                "source": "local_database",
+                "query": q,
+                "success": True
+            }
     except Exception as e:
-        logger.error(f"Error reading Excel file for search: {e}")
-        df = None
+        logger.error(f"Error searching brand index: {e}")
 
-    # 2. IF local search score is low, query OFF for discovery
-    if not best_match or best_score < 60:
+    # 2. IF local search score is low, query OFF for discovery (unless its breaker is open)
+    if (not best_match or best_score < 60) and not off_breakers.refusing():
         logger.info(
             f"Low local match score ({round(best_score, 1)}%). Discovering via OFF...")
 
@@ -3839,8 +8531,8 @@ async def search_brand(q: str = Query(...), category: str = Query(None)):
 
         async with httpx.AsyncClient() as client:
             try:
-                headers = {"User-Agent": "TBLGroceryScanner/1.0"}
-                response = await client.get(off_url, headers=headers, timeout=10.0)
+                # Type-ahead discovery queues behind scans
+                response = await OpenFoodFactsClient.get(client, off_url, 10.0, lane="batch")
 
                 if response.status_code == 200:
                     products = response.json().get("products", [])
@@ -3898,20 +8590,18 @@ async def search_brand(q: str = Query(...), category: str = Query(None)):
 
 
 @app.get("/categories")
-async def get_categories():
+async def get_categories(request: Request):
     """Get all unique categories from Excel"""
-    if certification_manager.data is None:
+    dataset = certification_manager.ensure_loaded()
+    if dataset is None:
         return {"categories": []}
 
-    all_categories = set()
-    for brand, products in certification_manager.data.items():
-        for product_key in products.keys():
-            if product_key != "_default":
-                all_categories.add(product_key)
-
-    return {
-        "categories": sorted(list(all_categories))
-    }
+    cached = response_cache.get_or_build(
+        "categories",
+        dataset.version,
+        lambda: cached_json({"categories": list(certification_manager.category_taxonomy.categories)}),
+    )
+    return conditional_response(request, cached)
 
 @app.get("/certifications/status")
 async def get_certification_status():
@@ -3928,14 +8618,15 @@ async def get_certification_status():
 
     # Get sample brands with their certifications
     sample_brands = []
-    for i, (brand_key, data) in enumerate(certification_manager.data.items()):
+    for i, (brand_key, products) in enumerate(certification_manager.data.items()):
         if i >= 5:
             break
+        first_product = next(iter(products.values()))
         sample_brands.append(
             {
-                "original_brand": data["original_brand"],
+                "original_brand": first_product.original_brand,
                 "normalized": brand_key,
-                "certifications": data["certifications"],
+                "certifications": first_product.certifications,
             }
         )
 
@@ -3952,76 +8643,138 @@ async def get_certification_status():
     }
 
 
-@app.post("/certifications/upload")
-async def upload_certifications(file: UploadFile = File(...)):
-    """Upload new Excel file with certification data"""
-    try:
-        # Read the uploaded file
-        contents = await file.read()
-
-        # Save to the certification file
-        with open(FileConfig.CERTIFICATION_EXCEL_FILE, "wb") as f:
-            f.write(contents)
-
-        # Reload data
-        certification_manager.load_certification_data()
-
-        return {
-            "status": "success",
-            "message": "Certification data uploaded successfully",
-            "filename": file.filename,
-            "total_records": (
-                len(certification_manager.data) if certification_manager.data else 0
-            ),
-        }
+@app.post("/certifications/upload", status_code=202)
+async def upload_certifications(file: UploadFile = File(...), force: bool = Query(False)):
+    """
+    Upload new Excel file with certification data.
 
+    The file is streamed to disk and validated in the background; poll
+    /certifications/upload/{job_id} for progress and the validation report.
+    force=true accepts a workbook much smaller than the current one.
+    """
+    job = workbook_uploads.create(file.filename)
+    try:
+        version = await workbook_uploads.receive(job, file)
+    except WorkbookValidationError as e:
+        workbook_uploads.fail(job, "Upload rejected", str(e))
+        raise HTTPException(status_code=413 if isinstance(e, UploadTooLargeError) else 400, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading certification file: {e}")
+        workbook_uploads.fail(job, "Upload failed", str(e))
         raise HTTPException(status_code=500,
                             detail=f"Error uploading file: {str(e)}")
 
+    workbook_uploads.submit(job, version, force)
+    return {
+        "status": "accepted",
+        "message": "Upload received; validating in the background",
+        "job_id": job["job_id"],
+        "status_url": f"/certifications/upload/{job['job_id']}",
+        "job": job,
+    }
+
+
+@app.get("/certifications/upload/{job_id}")
+async def get_upload_status(job_id: str):
+    """Progress and validation report of a workbook upload"""
+    job = workbook_uploads.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload job")
+    return job
+
 
-@app.get("/certifications/search/{brand}")
+@app.get("/certifications/search/{brand}", response_class=FastJSONResponse)
 async def search_certifications(brand: str):
     """Search for a brand in the certification database"""
     result = certification_manager.get_certifications(brand)
 
-    # Sanitize the result
-    sanitized_result = sanitize_for_json(result)
-
-    return {
+    return FastJSONResponse({
         "brand": brand,
-        "found": sanitized_result.get("found", False),
-        "certifications": sanitized_result.get("certifications", {}),
-        "details": sanitized_result.get("details", {}),
-        "match_type": sanitized_result.get("match_type"),
-        "note": sanitized_result.get("note")
-    }
+        "found": result.get("found", False),
+        "certifications": result.get("certifications", {}),
+        "details": result.get("details", {}),
+        "match_type": result.get("match_type"),
+        "note": result.get("note")
+    })
 
 
 @app.get("/certifications/export")
-async def export_certifications():
-    """Export certification data as JSON"""
-    if certification_manager.data is None:
-        certification_manager.load_certification_data()
-
-    if certification_manager.data is None:
+async def export_certifications(
+    request: Request,
+    format: str = Query("json", description="json (nested by brand), ndjson, csv or parquet"),
+    category: Optional[str] = Query(None, description="Only this workbook category"),
+    certification: Optional[str] = Query(None, description="Comma-separated certifications that must all be held"),
+    research_complete: Optional[bool] = Query(None),
+    row_data: bool = Query(True, description="Include the raw spreadsheet columns"),
+    limit: Optional[int] = Query(None, ge=1, description="Page size; the next page's cursor is in X-Next-Cursor"),
+    cursor: Optional[str] = Query(None),
+):
+    """Export certification data, streamed (one record per brand + category)"""
+    dataset = certification_manager.ensure_loaded()
+
+    if dataset is None:
         raise HTTPException(status_code=404,
                             detail="No certification data available")
 
-    return JSONResponse(content=certification_manager.data)
+    if format not in ExportConfig.MEDIA_TYPES:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown format '{format}'. Use one of: {', '.join(ExportConfig.MEDIA_TYPES)}")
+    certifications = [c.strip().lower() for c in certification.split(",") if c.strip()] if certification else []
+    unknown = [c for c in certifications if c not in CERTIFICATION_FLAGS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown certification(s): {', '.join(unknown)}. Use: {', '.join(CERTIFICATION_FLAGS)}",
+        )
+    if format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed on the server")
+
+    try:
+        export = CertificationExport(
+            dataset,
+            fmt=format,
+            category=category,
+            certifications=certifications,
+            research_complete=research_complete,
+            include_row_data=row_data,
+            limit=limit,
+            cursor=cursor,
+        )
+    except StaleCursorError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ExportCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = cache_headers(export.etag)
+    if etag_matches(request.headers.get("if-none-match"), export.etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["X-Dataset-Version"] = dataset.version
+    next_cursor = export.next_cursor()
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    if format in ("csv", "parquet"):
+        headers["Content-Disposition"] = f'attachment; filename="certifications-{dataset.version}.{format}"'
+
+    return StreamingResponse(export.stream(), media_type=ExportConfig.MEDIA_TYPES[format], headers=headers)
 
 
 @app.get("/excel/verify")
-async def verify_excel_data():
-    """Verify Excel data is loaded correctly and provide detailed statistics"""
+async def verify_excel_data(request: Request):
+    """
+    Verify Excel data is loaded correctly and provide detailed statistics.
+
+    The report is built once per dataset version; its timestamp is when
+    that happened. Timestamps differ between workers, so the ETag is a weak
+    one on the dataset version rather than a hash of the bytes.
+    """
     try:
         # Check if data is loaded
-        if certification_manager.data is None:
-            logger.info("Excel data not loaded, attempting to load...")
-            certification_manager.load_certification_data()
+        dataset = certification_manager.ensure_loaded()
 
-        if certification_manager.data is None:
+        if dataset is None:
             return {
                 "status": "error",
                 "message": "No Excel data loaded",
@@ -4029,67 +8782,71 @@ async def verify_excel_data():
                 "file_exists": os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE)
             }
 
-        # Get file info
-        file_exists = os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE)
-        file_size = os.path.getsize(FileConfig.CERTIFICATION_EXCEL_FILE) if file_exists else 0
-
-        # Count certifications
-        cert_counts = {
-            "b_corp": 0,
-            "fair_trade": 0,
-            "rainforest_alliance": 0,
-            "leaping_bunny": 0,
-            "research_complete": 0
-        }
-
-        # Brand categories stats
-        brands_with_categories = 0
-        total_categories = set()
+        def build():
+            # Get file info
+            file_exists = os.path.exists(FileConfig.CERTIFICATION_EXCEL_FILE)
+            file_size = os.path.getsize(FileConfig.CERTIFICATION_EXCEL_FILE) if file_exists else 0
+
+            # Count certifications
+            cert_counts = {
+                "b_corp": 0,
+                "fair_trade": 0,
+                "rainforest_alliance": 0,
+                "leaping_bunny": 0,
+                "research_complete": 0
+            }
 
-        for brand_key, products in certification_manager.data.items():
-            for product_key, product_data in products.items():
-                if product_key != "_default":
-                    brands_with_categories += 1
-                    total_categories.add(product_key)
-                    # Count certifications
-                    certs = product_data.get("certifications", {})
-                    for cert in cert_counts.keys():
-                        if certs.get(cert, False):
-                            cert_counts[cert] += 1
-
-        # Get a few sample brands
-        sample_brands = []
-        for i, (brand_key, products) in enumerate(certification_manager.data.items()):
-            if i >= 5:
-                break
-            first_product = next(iter(products.values()))
-            sample_brands.append({
-                "brand": brand_key,
-                "original_brand": first_product.get("original_brand"),
-                "certifications": first_product.get("certifications", {}),
-                "categories": list(products.keys())[:3]  # Show up to 3 categories
-            })
+            # Brand categories stats
+            brands_with_categories = 0
+            total_categories = set()
 
-        return {
-            "status": "success",
-            "timestamp": datetime.utcnow().isoformat(),
-            "file_info": {
-                "path": FileConfig.CERTIFICATION_EXCEL_FILE,
-                "exists": file_exists,
-                "size_bytes": file_size,
-                "size_mb": round(file_size / (1024 * 1024), 2) if file_exists else 0
-            },
-            "data_stats": {
-                "total_brands": len(certification_manager.data),
-                "brands_with_categories": brands_with_categories,
-                "total_categories": len(total_categories),
-                "categories": sorted(list(total_categories))[:20],  # Show first 20
-                "certification_counts": cert_counts
-            },
-            "last_loaded": certification_manager.last_loaded.isoformat() if certification_manager.last_loaded else None,
-            "sample_brands": sample_brands,
-            "is_healthy": len(certification_manager.data) > 0
-        }
+            for brand_key, products in dataset.data.items():
+                for product_key, product_data in products.items():
+                    if product_key != "_default":
+                        brands_with_categories += 1
+                        total_categories.add(product_key)
+                        # Count certifications
+                        for cert in cert_counts.keys():
+                            if product_data.has(cert):
+                                cert_counts[cert] += 1
+
+            # Get a few sample brands
+            sample_brands = []
+            for i, (brand_key, products) in enumerate(dataset.data.items()):
+                if i >= 5:
+                    break
+                first_product = next(iter(products.values()))
+                sample_brands.append({
+                    "brand": brand_key,
+                    "original_brand": first_product.original_brand,
+                    "certifications": first_product.certifications,
+                    "categories": list(products.keys())[:3]  # Show up to 3 categories
+                })
+
+            return cached_json({
+                "status": "success",
+                "timestamp": datetime.utcnow().isoformat(),
+                "dataset_version": dataset.version,
+                "file_info": {
+                    "path": FileConfig.CERTIFICATION_EXCEL_FILE,
+                    "exists": file_exists,
+                    "size_bytes": file_size,
+                    "size_mb": round(file_size / (1024 * 1024), 2) if file_exists else 0
+                },
+                "data_stats": {
+                    "total_brands": len(dataset.data),
+                    "brands_with_categories": brands_with_categories,
+                    "total_categories": len(total_categories),
+                    "categories": sorted(list(total_categories))[:20],  # Show first 20
+                    "certification_counts": cert_counts
+                },
+                "last_loaded": dataset.loaded_at.isoformat(),
+                "sample_brands": sample_brands,
+                "is_healthy": len(dataset.data) > 0
+            }, etag=f'W/"{dataset.version}"')
+
+        cached = response_cache.get_or_build("excel-verify", dataset.version, build)
+        return conditional_response(request, cached)
 
     except Exception as e:
         logger.error(f"Error verifying Excel data: {e}")
@@ -4178,40 +8935,47 @@ async def reset_excel_file():
 
 @app.get("/validate/barcode/{barcode}")
 async def validate_barcode_format(barcode: str):
-    """Validate barcode format and provide compatibility info for Html5Qrcode"""
-    # Html5Qrcode supported formats
-    patterns = {
-        "EAN-13": r"^\d{13}$",
-        "EAN-8": r"^\d{8}$",
-        "UPC-A": r"^\d{12}$",
-        "UPC-E": r"^\d{6,8}$",
-        "Code 128": r"^[\x00-\x7F]+$",
-        "Code 39": r"^[A-Z0-9\-\.\ \$\/\+\%]+$",
-        "Code 93": r"^[A-Z0-9\-\.\ \$\/\+\%]+$",
-        "Codabar": r"^[0-9\-\$\:\.\+\/]+$",
-        "ITF": r"^\d+$",  # Interleaved 2 of 5
-        "PDF417": r"^.+$",
-        "Data Matrix": r"^.+$",
-        "QR Code": r"^.+$",
-    }
+    """Validate barcode format and check digit, and provide compatibility info for Html5Qrcode"""
+    try:
+        gtin = Gtin.canonicalize(barcode)
+        gtin_error = None
+    except InvalidBarcodeError as e:
+        gtin, gtin_error = None, str(e)
 
+    # Html5Qrcode supported formats; product formats only when the check digit holds
     detected_formats = []
-    for format_name, pattern in patterns.items():
-        if re.match(pattern, barcode):
+    if gtin is not None:
+        detected_formats.append(gtin.symbology)
+        if gtin.symbology == "UPC-A":
+            detected_formats.append("EAN-13")
+        if gtin.alternates:
+            detected_formats.append("EAN-8" if gtin.symbology == "UPC-E" else "UPC-E")
+    for format_name, pattern in Gtin.OTHER_FORMATS:
+        if pattern.fullmatch(barcode):
             detected_formats.append(format_name)
 
+    if gtin is not None:
+        suggested_action = "âœ“ Compatible with Html5Qrcode scanner"
+    elif barcode.isdigit() and 6 <= len(barcode) <= 14:
+        suggested_action = "âš ï¸ Check digit doesn't match, likely a misread. Scan again or enter manually."
+    elif detected_formats:
+        suggested_action = "âš ï¸ Not a product barcode (EAN/UPC). Try scanning the barcode on the pack."
+    else:
+        suggested_action = "âš ï¸ This format may not be supported. Try manual entry."
+
     return {
         "barcode": barcode,
         "length": len(barcode),
         "detected_formats": detected_formats,
         "is_numeric": barcode.isdigit(),
         "html5qrcode_compatible": len(detected_formats) > 0,
+        "gtin_valid": gtin is not None,
+        "canonical_barcode": gtin.code if gtin is not None else None,
+        "gtin_symbology": gtin.symbology if gtin is not None else None,
+        "alternate_barcodes": list(gtin.alternates) if gtin is not None else [],
+        "gtin_error": gtin_error,
         "library": "Html5Qrcode v2.3.8",
-        "suggested_action": (
-            "âœ“ Compatible with Html5Qrcode scanner"
-            if detected_formats
-            else "âš ï¸ This format may not be supported. Try manual entry."
-        ),
+        "suggested_action": suggested_action,
     }
 
 
@@ -4219,31 +8983,36 @@ async def validate_barcode_format(barcode: str):
 
 
 @app.get("/test/excel/{brand}")
-async def test_excel_lookup(brand: str):
+async def test_excel_lookup(brand: str, request: Request):
     """Test endpoint to check Excel lookup for a specific brand"""
-    result = certification_manager.get_certifications(brand)
+    dataset = certification_manager.ensure_loaded()
 
-    # Sanitize the result to handle NaN/NaT values
-    sanitized_result = sanitize_for_json(result)
+    def build():
+        result = certification_manager.get_certifications(brand)
 
-    # Also get brand categories for debugging
-    brand_normalized = BrandNormalizer.normalize(brand)
-    categories = certification_manager.brand_categories.get(brand_normalized, set())
+        # Also get brand categories for debugging
+        brand_normalized = BrandNormalizer.normalize(brand)
+        categories = dataset.brand_categories.get(brand_normalized, set()) if dataset else set()
 
-    return {
-        "test_brand": brand,
-        "normalized_brand": brand_normalized,
-        "brand_categories": list(categories),
-        "result": sanitized_result,
-        "total_brands_in_excel": len(certification_manager.data) if certification_manager.data else 0
-    }
+        return cached_json({
+            "test_brand": brand,
+            "normalized_brand": brand_normalized,
+            "brand_categories": sorted(categories),
+            "result": result,
+            "total_brands_in_excel": len(dataset.data) if dataset else 0
+        })
+
+    if dataset is None:
+        return Response(content=build().body, media_type="application/json")
+    cached = response_cache.get_or_build("test-excel", dataset.version, build, brand)
+    return conditional_response(request, cached)
 
 
 # ==================== OTHER ENDPOINTS ====================
 
 
-@app.post("/compare")
-async def compare_brands(brands: List[BrandInput]) -> Dict[str, Any]:
+@app.post("/compare", response_class=FastJSONResponse)
+async def compare_brands(brands: List[BrandInput]):
     """Compare multiple brands with verified certifications"""
     comparison = []
 
@@ -4253,7 +9022,7 @@ async def compare_brands(brands: List[BrandInput]) -> Dict[str, Any]:
         tbl = calculate_overall_score(
             scores.social, scores.environmental, scores.economic
         )
-        cert_result = certification_manager.get_certifications(brand)  # Remove category parameter
+        cert_result = certification_manager.get_certifications(brand, include_details=False)
 
         comparison.append(
             {
@@ -4278,7 +9047,7 @@ async def compare_brands(brands: List[BrandInput]) -> Dict[str, Any]:
     comparison.sort(key=lambda x: x["overall_score"], reverse=True)
 
     logger.info(f"Compared {len(brands)} brands")
-    return sanitize_for_json({"comparison": comparison})
+    return FastJSONResponse({"comparison": comparison})
 
 
 @app.post("/purchase")
@@ -4286,7 +9055,7 @@ async def record_purchase(
     username: str = Query(...), product: Optional[Product] = None
 ) -> Dict[str, Any]:
     """Record user purchase"""
-    if username not in USERS_DB:
+    if not user_store.user_exists(username):
         raise HTTPException(status_code=404, detail="User not found")
 
     if not product:
@@ -4311,12 +9080,7 @@ async def record_purchase(
         "scoring_methodology": f"Base {ScoringConfig.BASE_SCORE} + Certification Bonuses + Multi-Cert Bonus",
     }
 
-    if username not in PURCHASE_HISTORY_DB:
-        PURCHASE_HISTORY_DB[username] = []
-    PURCHASE_HISTORY_DB[username].append(purchase)
-
-    # ✅ ADD THIS LINE: Save to persistent storage
-    save_user_data()
+    user_store.add_purchase(username, purchase)
 
     logger.info(f"Purchase recorded for {username}: {product.product_name}")
     return {"message": "Purchase recorded", "purchase": purchase}
@@ -4324,71 +9088,140 @@ async def record_purchase(
 
 @app.get("/history/{username}")
 async def get_purchase_history(
-        username: str, limit: int = 50) -> Dict[str, Any]:
-    """Get user purchase history"""
-    if username not in USERS_DB:
+        username: str,
+        limit: int = Query(50, ge=1, le=500),
+        cursor: Optional[str] = Query(None)) -> Dict[str, Any]:
+    """Get user purchase history (newest page first, pass next_cursor for older pages)"""
+    if not user_store.user_exists(username):
         raise HTTPException(status_code=404, detail="User not found")
 
-    history = PURCHASE_HISTORY_DB.get(username, [])
+    before_id = None
+    if cursor:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        before_id = int(cursor)
 
-    # Calculate average TBL score
-    avg_score = 0
-    if history:
-        avg_score = sum(p.get("tbl_score", 0) for p in history) / len(history)
+    summary = user_store.get_purchase_summary(username)
+    page = user_store.get_purchase_page(username, limit, before_id)
 
     return {
         "username": username,
-        "total_purchases": len(history),
-        "average_tbl_score": round(avg_score, 2),
-        "purchases": history[-limit:],
+        "total_purchases": summary["total"],
+        "average_tbl_score": round(summary["average"], 2),
+        "purchases": page["purchases"],
+        "next_cursor": page["next_cursor"],
+        "has_more": page["next_cursor"] is not None,
     }
 
 
+@app.get("/history/{username}/stats")
+async def get_purchase_stats(username: str) -> Dict[str, Any]:
+    """Get aggregate purchase statistics (grades, certifications, monthly trend)"""
+    if not user_store.user_exists(username):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {"username": username, **user_store.get_purchase_stats(username)}
+
+
 @app.get("/debug/users")
 async def debug_users():
     """Debug endpoint to check users"""
+    usernames = user_store.list_usernames()
     return {
-        "users": list(USERS_DB.keys()),
-        "test_user_exists": "Test123" in USERS_DB,
-        "alb_exists": "ALB" in USERS_DB,
-        "total_users": len(USERS_DB),
-        "purchase_history_counts": {user: len(PURCHASE_HISTORY_DB.get(user, []))
-                                    for user in USERS_DB.keys()}
+        "users": usernames,
+        "test_user_exists": "Test123" in usernames,
+        "alb_exists": "ALB" in usernames,
+        "total_users": len(usernames),
+        "purchase_history_counts": user_store.purchase_counts()
     }
 
 
 @app.get("/debug/storage")
 async def debug_storage():
     """Debug endpoint to check storage status"""
-    file_exists = os.path.exists(USER_DATA_FILE)
-    file_size = os.path.getsize(USER_DATA_FILE) if file_exists else 0
+    file_exists = os.path.exists(user_store.db_path)
+    file_size = os.path.getsize(user_store.db_path) if file_exists else 0
 
     return {
-        "storage_file": USER_DATA_FILE,
+        "storage_file": user_store.db_path,
+        "storage_engine": "sqlite (WAL)",
         "file_exists": file_exists,
         "file_size_bytes": file_size,
-        "total_users": len(USERS_DB),
-        "total_purchases": sum(
-            len(purchases) for purchases in PURCHASE_HISTORY_DB.values()),
-        "users": list(
-            USERS_DB.keys()),
+        "legacy_json_file": USER_DATA_FILE,
+        "total_users": user_store.count_users(),
+        "total_purchases": user_store.count_purchases(),
+        "users": user_store.list_usernames(),
+    }
+
+
+def build_inferred_product(barcode: str, inference: Dict[str, Any], deadline: Deadline) -> Dict[str, Any]:
+    """/product result for a barcode OFF couldn't answer, scored from the brand its company prefix implies"""
+    brand = inference["brand"]
+    cert_result = certification_manager.get_certifications(brand, None, source="barcode", deadline=deadline)
+    found_in_excel = cert_result.get("found", False)
+    if found_in_excel:
+        scores = scoring_manager.calculate_brand_scores(brand)
+    else:
+        scores = BrandData(
+            brand=brand,
+            social=5.0,
+            environmental=5.0,
+            economic=5.0,
+            certifications=[],
+            scoring_method="default_fallback",
+            notes="Inferred brand not found in certification database. Using default score of 5.0."
+        )
+    tbl = calculate_overall_score(scores.social, scores.environmental, scores.economic)
+
+    if inference["match_type"] == "known_barcode":
+        how = "this barcode's brand from earlier scans and purchases"
+    else:
+        how = (
+            f"{inference['brand_share']:.0%} of {inference['support']} known barcodes "
+            f"starting {inference['prefix']} are {brand}"
+        )
+    return {
+        "barcode": barcode,
+        "found": False,
+        "name": "Unknown Product",
+        "brand": brand,
+        "category": cert_result.get("matched_category") or "Unknown",
+        "message": f"Not in Open Food Facts. Brand inferred from the manufacturer's barcode prefix ({how}).",
+        "brand_inferred": True,
+        "brand_inference": inference,
+        "social_score": scores.social,
+        "environmental_score": scores.environmental,
+        "economic_score": scores.economic,
+        "overall_tbl_score": tbl["overall_score"],
+        "grade": tbl["grade"],
+        "rating": tbl["grade"],
+        "certifications": scores.certifications,
+        "scoring_method": scores.scoring_method,
+        "notes": scores.notes,
+        "certification_source": "Excel Database" if found_in_excel else "No certifications found",
+        "found_in_excel": found_in_excel,
+        "match_type": cert_result.get("match_type"),
+        "certification_verified_date": datetime.utcnow().isoformat() if found_in_excel else None,
+        "certification_sources": FileConfig.CERT_SOURCES,
+        "scanner_notes": "Brand inferred locally from the barcode; scan the brand name to confirm.",
     }
 
 
-@app.get("/product/{barcode}")
-async def get_product_info(barcode: str) -> Dict[str, Any]:
+@app.get("/product/{barcode}", response_class=FastJSONResponse)
+async def get_product_info(barcode: str):
     """Get comprehensive product info by barcode with verified certifications"""
+    deadline = Deadline(DeadlineConfig.PRODUCT_SECONDS)
 
     # ===== SAFETY CHECK: Check if data is ready =====
     if certification_manager.data is None:
         logger.warning("⚠️ Data not ready, attempting to load...")
         certification_manager.load_certification_data()
 
-        # Wait and retry if still not ready
+        # Wait and retry if still not ready (within the request's budget)
         retries = 3
-        while certification_manager.data is None and retries > 0:
+        while certification_manager.data is None and retries > 0 and deadline.allows(1.0):
             logger.info(f"⏳ Waiting for data to load... ({retries} retries left)")
-            time.sleep(1)
+            await asyncio.sleep(1)
             retries -= 1
 
         if certification_manager.data is None:
@@ -4413,18 +9246,85 @@ async def get_product_info(barcode: str) -> Dict[str, Any]:
             detail="Empty barcode. Please try scanning again or enter manually.",
         )
 
-    # Check if barcode looks valid
-    if len(barcode) < 6:
-        logger.warning(f"Short barcode detected: {barcode}. May be misread.")
+    # ===== CANONICAL GTIN: misreads never reach the caches or Open Food Facts =====
+    try:
+        gtin = Gtin.canonicalize(barcode)
+        barcode = gtin.code
+    except InvalidBarcodeError as e:
+        logger.warning(f"Rejected barcode read {barcode!r}: {e}")
+        return {
+            "barcode": barcode,
+            "found": False,
+            "brand": "Unknown",
+            "name": "Invalid Barcode",
+            "category": "Unknown",
+            "message": f"{e}. Please scan again or enter the barcode manually.",
+            "overall_tbl_score": 5.0,
+            "grade": "GOOD",
+            "certifications": [],
+            "invalid_barcode": True,
+            "scanner_notes": "Try scanning again with better lighting or enter the barcode manually.",
+        }
+
+    # ===== MEMOIZED RESULT (same barcode, dataset and scoring config) =====
+    dataset = certification_manager.ensure_loaded(deadline)
+    memo_version = result_cache_version(dataset)
+    if memo_version is not None:
+        memoized = result_cache.get("product", memo_version, barcode)
+        if memoized is not None:
+            return memoized.response("hit")
 
     # ===== GET PRODUCT FROM OFF FIRST =====
-    product = await food_facts_client.lookup_barcode(barcode)
+    product = await food_facts_client.lookup_barcode(barcode, deadline, alternates=gtin.alternates)
 
     # Enhanced logging for debugging scanner issues
     logger.info(
         f"Html5Qrcode scan -> Barcode: {barcode}, Length: {len(barcode)}, Found in OFF: {product.get('found', False)}"
     )
 
+    # ===== NOT IN OFF (or OFF unavailable): INFER THE BRAND FROM THE GS1 COMPANY PREFIX =====
+    if not product.get("found", False):
+        inference = company_prefix_index.infer(barcode)
+        if inference is not None:
+            logger.info(
+                f"Inferred brand '{inference['brand']}' for barcode {barcode} "
+                f"({inference['match_type']}, confidence {inference['confidence']})"
+            )
+            result = build_inferred_product(barcode, inference, deadline)
+            if deadline.degraded:
+                result["degraded"] = True
+                result["degraded_stages"] = list(deadline.skipped)
+            return result
+
+    # ===== OFF UNAVAILABLE (breaker open) AND NOT CACHED =====
+    if product.get("degraded"):
+        return {
+            "barcode": barcode,
+            "found": False,
+            "brand": "Unknown",
+            "name": "Product details unavailable",
+            "category": "Unknown",
+            "message": (
+                "Open Food Facts is unavailable or slow right now. "
+                "Try searching by brand name, or scan again shortly."
+            ),
+            "overall_tbl_score": 5.0,
+            "grade": "GOOD",
+            "certifications": [],
+            "social_score": 5.0,
+            "environmental_score": 5.0,
+            "economic_score": 5.0,
+            "scoring_method": "default_fallback",
+            "notes": (
+                "Open Food Facts did not answer in time and this barcode is not cached. "
+                "Using default score of 5.0."
+            ),
+            "found_in_excel": False,
+            "degraded": True,
+            "degraded_stages": list(deadline.skipped),
+            "retry": True,
+        }
+
     # ===== HANDLE CASE WHERE OFF DOESN'T FIND THE PRODUCT =====
     if not product.get("found", False):
         return {
@@ -4451,7 +9351,10 @@ async def get_product_info(barcode: str) -> Dict[str, Any]:
         brand_name = brand_name.replace("The ", "").strip()
 
     # ===== GET CERTIFICATIONS FROM EXCEL (if available) =====
-    cert_result = certification_manager.get_certifications(brand_name, product.get("category"), source="barcode")
+    cert_result = certification_manager.get_certifications(
+        brand_name, product.get("category"), source="barcode", category_path=product.get("category_path"),
+        deadline=deadline,
+    )
     found_in_excel = cert_result.get("found", False)
 
     # ===== ALWAYS USE OFF BRAND AND PRODUCT NAME =====
@@ -4533,9 +9436,16 @@ async def get_product_info(barcode: str) -> Dict[str, Any]:
             "last_updated": product.get("last_updated"),
         }
     }
+    if deadline.degraded:
+        result["degraded"] = True
+        result["degraded_stages"] = list(deadline.skipped)
 
     logger.info(f"Product lookup for barcode: {barcode} - Found in OFF: True, Found in Excel: {found_in_excel}")
-    return sanitize_for_json(result)
+    if not deadline.degraded and memo_version is not None and certification_manager.dataset is dataset:
+        memoized = MemoizedResult.from_content(result, ("certification_verified_date",))
+        result_cache.put("product", memo_version, memoized, barcode)
+        return memoized.response("miss")
+    return FastJSONResponse(result)
 
 
 # ==================== SCANNER HEALTH ENDPOINT ====================
@@ -4547,6 +9457,8 @@ async def scanner_health():
     return {
         "scanner_system": "Html5Qrcode (Lightweight JavaScript Scanner)",
         "backend_integration": "âœ“ Ready",
+        # Degraded: Open Food Facts is unreachable, barcode scans answer from local data
+        "open_food_facts": off_breakers.stats(),
         "library": "Html5Qrcode v2.3.8 - actively maintained",
         "api_endpoints": {
             "scan": "/scan (POST) - Main scanning endpoint",
@@ -4603,8 +9515,16 @@ async def health_check() -> Dict[str, Any]:
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
         "total_brands": len(certification_manager.data) if certification_manager.data else 0,  # ← CHANGED
-        "total_users": len(USERS_DB),
+        "total_users": user_store.count_users(),
         "cache_size": len(PRODUCT_CACHE),
+        "response_cache": response_cache.stats(),
+        "score_page_cache": score_page_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "open_food_facts": off_breakers.stats(),
+        "open_food_facts_outbound": off_scheduler.stats(),
+        "category_resolution": (
+            certification_manager.category_taxonomy.stats() if certification_manager.data else None
+        ),
         "scoring_methodology": f"Base {ScoringConfig.BASE_SCORE} + Weighted Certification Bonuses + Multi-Cert Bonus (capped at 10.0)",
         "scoring_priority": "Brand Synonyms → Parent Company → Dynamic Calculation",
         "scoring_consistency": "Single scoring function ensures identical results across all search methods",
@@ -4638,19 +9558,15 @@ async def health_check() -> Dict[str, Any]:
 
 
 @app.get("/", response_class=HTMLResponse)
-async def serve_frontend():
+async def serve_frontend(request: Request):
     """Serve the frontend HTML file"""
     try:
-        # Read the index.html file
-        with open("index.html", "r", encoding="utf-8") as f:
-            html_content = f.read()
-        return HTMLResponse(content=html_content, status_code=200)
+        # index.html from memory (compressed, with ETag)
+        return static_assets.response(request, "index.html")
     except FileNotFoundError:
         # If index.html doesn't exist, serve a basic page with instructions from file
         try:
-            with open("backend_status.html", "r", encoding="utf-8") as f:
-                html_content = f.read()
-            return HTMLResponse(content=html_content, status_code=200)
+            return static_assets.response(request, "backend_status.html")
         except FileNotFoundError:
             # Ultimate fallback - minimal HTML
             return HTMLResponse(
@@ -4677,13 +9593,233 @@ async def favicon():
     return Response(content=transparent_png, media_type="image/png")
 
 
+# ==================== DATASET CHANGE ENDPOINTS ====================
+
+
+def admin_username(request: Request) -> str:
+    """Basic-auth user name for the change log"""
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Basic "):
+        return ""
+    try:
+        return base64.b64decode(header[6:]).decode().split(":", 1)[0]
+    except (ValueError, UnicodeDecodeError):
+        return ""
+
+
+@app.patch("/admin/certifications/record")
+async def upsert_certification_record(
+    change: CertificationRecordChange,
+    request: Request,
+    _: bool = Depends(require_auth),
+):
+    """Create or update one (brand, category) record without uploading a workbook"""
+    certifications = {
+        name: getattr(change, name)
+        for name in CERTIFICATION_FLAGS
+        if getattr(change, name) is not None
+    }
+    try:
+        applied = await asyncio.to_thread(
+            certification_manager.upsert_record,
+            change.brand,
+            change.category,
+            certifications,
+            change.original_brand,
+            change.columns,
+            admin_username(request),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    dataset = certification_manager.dataset
+    record = dataset.data[applied.brand_key][applied.product_key]
+    return FastJSONResponse({
+        "status": "success",
+        "change": applied.to_dict(),
+        "record": record.to_dict(),
+        "dataset_version": dataset.version,
+    })
+
+
+@app.delete("/admin/certifications/record")
+async def delete_certification_record(
+    request: Request,
+    brand: str = Query(...),
+    category: str = Query(""),
+    _: bool = Depends(require_auth),
+):
+    """Delete one (brand, category) record"""
+    try:
+        applied = await asyncio.to_thread(
+            certification_manager.delete_record, brand, category, admin_username(request)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if applied is None:
+        raise HTTPException(status_code=404, detail=f"No record for brand '{brand}' in category '{category}'")
+
+    return {
+        "status": "success",
+        "change": applied.to_dict(),
+        "dataset_version": certification_manager.dataset.version,
+    }
+
+
+@app.get("/admin/certifications/changes")
+async def list_certification_changes(_: bool = Depends(require_auth)):
+    """Changes applied on top of the workbook that compaction has not written back yet"""
+    certification_manager.ensure_loaded()
+    pending = certification_manager.pending_changes()
+    dataset = certification_manager.dataset
+    return FastJSONResponse({
+        "dataset_version": dataset.version if dataset else None,
+        "workbook_version": dataset.base_version if dataset else None,
+        "pending": len(pending),
+        "last_seq": certification_manager.change_log.last_seq(),
+        "changes": [change.to_dict() for change in pending],
+    })
+
+
+@app.post("/admin/certifications/compact")
+async def compact_certification_changes(_: bool = Depends(require_auth)):
+    """Write pending changes back into the workbook now"""
+    try:
+        result = await asyncio.to_thread(certification_manager.compact_changes)
+    except Exception as e:
+        logger.error(f"Error compacting dataset changes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error compacting changes: {str(e)}")
+    if result["status"] in ("busy", "conflict"):
+        raise HTTPException(status_code=409, detail=result["message"])
+    return result
+
+
+async def compact_dataset_changes_periodically():
+    """Background loop: fold the change log into the workbook every DATASET_COMPACT_SECONDS"""
+    while True:
+        await asyncio.sleep(FileConfig.DATASET_COMPACT_SECONDS)
+        try:
+            result = await asyncio.to_thread(certification_manager.compact_changes)
+            if result.get("applied"):
+                logger.info(f"🗜️ Periodic compaction applied {result['applied']} change(s)")
+        except Exception as e:
+            logger.error(f"Periodic dataset compaction failed: {e}")
+
+
+# ==================== COMPANY PREFIX ENDPOINTS ====================
+
+
+@app.get("/admin/company-prefixes")
+async def company_prefix_status(_: bool = Depends(verify_auth)):
+    """Barcodes learned per source, prefixes indexed and refresh watermarks"""
+    return await asyncio.to_thread(company_prefix_index.stats)
+
+
+@app.post("/admin/company-prefixes/refresh")
+async def refresh_company_prefixes(_: bool = Depends(require_auth)):
+    """Learn barcodes resolved since the last refresh now"""
+    learned = await asyncio.to_thread(company_prefix_index.refresh, PRODUCT_CACHE, user_store)
+    return {"status": "success", "learned": learned}
+
+
+@app.post("/admin/company-prefixes/import")
+async def import_company_prefixes(file: UploadFile = File(...), _: bool = Depends(require_auth)):
+    """Learn barcode brands from an Open Food Facts export (products CSV or JSONL dump, optionally .gz)"""
+    filename = file.filename or ""
+    if not filename.lower().removesuffix(".gz").endswith((".csv", ".tsv", ".jsonl", ".ndjson")):
+        raise HTTPException(
+            status_code=400,
+            detail="Expected an Open Food Facts products export (.csv, .tsv, .jsonl or .ndjson, optionally .gz)",
+        )
+    try:
+        result = await asyncio.to_thread(company_prefix_index.import_dump, file.file, filename)
+    except (OSError, EOFError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read {filename}: {e}")
+    logger.info(f"🏷️ Imported {filename}: {result['learned']} of {result['rows']} barcodes learned")
+    return {"status": "success", "filename": filename, **result}
+
+
+async def refresh_company_prefixes_periodically():
+    """Background loop: learn newly resolved barcodes now and every COMPANY_PREFIX_REFRESH_SECONDS"""
+    while True:
+        try:
+            learned = await asyncio.to_thread(company_prefix_index.refresh, PRODUCT_CACHE, user_store)
+            if any(learned.values()):
+                logger.info(f"🏷️ Company prefix index learned {learned}")
+        except Exception as e:
+            logger.error(f"Company prefix refresh failed: {e}")
+        await asyncio.sleep(CompanyPrefixConfig.REFRESH_SECONDS)
+
+
+# ==================== PROFILING ENDPOINTS ====================
+
+
+@app.get("/admin/profile")
+async def sample_profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(ProfilerConfig.DEFAULT_INTERVAL_MS, ge=1, le=1000),
+    include_idle: bool = Query(False),
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    _: bool = Depends(verify_auth),
+):
+    """
+    Sample this worker's stacks for N seconds.
+
+    Returns collapsed stacks ("frame;frame;frame count" per line) that
+    flamegraph.pl and speedscope read directly. With several gunicorn
+    workers only the worker that serves this request is sampled; its pid is
+    in X-Profile-Pid.
+    """
+    if not ProfilerConfig.ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (set PROFILER_ENABLED=true)")
+
+    seconds = min(seconds, ProfilerConfig.MAX_SECONDS)
+    try:
+        result = await asyncio.to_thread(
+            sampling_profiler.sample, seconds, interval_ms / 1000.0, include_idle
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    headers = {"X-Profile-Pid": str(os.getpid()), "X-Profile-Samples": str(result["samples"])}
+    stacks = result["stacks"].most_common()
+    if format == "json":
+        return JSONResponse(
+            {
+                "pid": os.getpid(),
+                "seconds": seconds,
+                "interval_ms": interval_ms,
+                "samples": result["samples"],
+                "idle_samples": result["idle_samples"],
+                "stacks": [{"stack": stack, "count": count} for stack, count in stacks],
+            },
+            headers=headers,
+        )
+    body = "".join(f"{stack} {count}\n" for stack, count in stacks)
+    return PlainTextResponse(body, headers=headers)
+
+
 # ==================== STARTUP EVENT ====================
 # ✅ ADD THIS: Load data before accepting requests
 
+_compaction_task: Optional[asyncio.Task] = None
+_company_prefix_task: Optional[asyncio.Task] = None
+
+
 @app.on_event("startup")
 async def startup_event():
     """Load certification data on startup and wait for it to complete"""
     logger.info("🚀 Application starting up...")
+    await ensure_bootstrap_user()
+    global _compaction_task, _company_prefix_task
+    if FileConfig.DATASET_COMPACT_SECONDS > 0:
+        _compaction_task = asyncio.create_task(compact_dataset_changes_periodically())
+    if CompanyPrefixConfig.REFRESH_SECONDS > 0:
+        _company_prefix_task = asyncio.create_task(refresh_company_prefixes_periodically())
     logger.info("📊 Loading certification data...")
 
     # Load the data with retry
@@ -4702,6 +9838,18 @@ async def startup_event():
     logger.warning("⚠️ Certification data did not load on startup. Will retry on first request.")
     logger.info("🚀 Application startup complete!")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background worker pools"""
+    if _compaction_task is not None:
+        _compaction_task.cancel()
+    if _company_prefix_task is not None:
+        _company_prefix_task.cancel()
+    workbook_uploads.shutdown()
+    password_hasher.shutdown()
+
+
 if __name__ == "__main__":
 
     # Check if Excel data is loaded